@@ -188,3 +188,126 @@ def largest_indices(array, k, smallest=False):
     else:
         indices = indices[np.argsort(-flat[indices])]
     return np.unravel_index(indices, array.shape, order=order)
+
+
+def _block_scores(X_A, X_B, metric):
+    if metric == "dot":
+        return np.matmul(X_A, X_B.T)
+    elif metric == "cosine":
+        return np.matmul(X_A, X_B.T)  # rows are already normalized in blocked_top_k()
+    elif metric == "euclidean":
+        sq_dists = np.sum(np.square(X_A), axis=1)[:, np.newaxis] + np.sum(np.square(X_B), axis=1)[np.newaxis, :] - \
+                   2 * np.matmul(X_A, X_B.T)
+        return -np.sqrt(np.clip(sq_dists, 0, None))
+    else:
+        raise Exception("metric must be one of {'dot', 'cosine', 'euclidean'}")
+
+
+def _get_block_size(n_cols, block_size=None, max_block_elements=2 ** 24):
+    if block_size is None:
+        block_size = max(1, int(max_block_elements // max(n_cols, 1)))
+    return block_size
+
+
+def blocked_column_logsumexp(X_rows, X_cols, block_size=None):
+    """
+    Computes log(sum_i exp(X_rows[i] . X_cols[j])) for every column j, i.e. the log of the normalizer of a softmax over
+    axis 0 of X_rows @ X_cols.T, by streaming over blocks of rows so that the full matrix is never materialized.
+
+    :param X_rows: Embedding matrix of shape (n_rows, d)
+    :param X_cols: Embedding matrix of shape (n_cols, d)
+    :param block_size: Number of rows per block. Default is such that a block has at most 2^24 elements.
+    :return: Array of shape (n_cols,)
+    """
+    block_size = _get_block_size(X_cols.shape[0], block_size)
+    col_max = np.full(X_cols.shape[0], -np.inf)
+    col_sum = np.zeros(X_cols.shape[0])
+    for start in range(0, X_rows.shape[0], block_size):
+        scores = np.matmul(X_rows[start: start + block_size], X_cols.T)
+        block_max = scores.max(axis=0)
+        new_max = np.maximum(col_max, block_max)
+        col_sum = col_sum * np.exp(col_max - new_max) + np.exp(scores - new_max[np.newaxis, :]).sum(axis=0)
+        col_max = new_max
+
+    return col_max + np.log(col_sum)
+
+
+def blocked_top_k(X_A, X_B, top_k, metric="dot", per_row=False, exclude_adj=None, ids_A=None, ids_B=None,
+                  col_bias=None, block_size=None):
+    """
+    Streaming top-k scorer over the pairwise scores of rows in X_A against rows in X_B. Scores are computed for one block
+    of rows at a time while keeping a running global (or per-row) top-k, so memory is O(block_size * n_B + top_k) instead
+    of the O(n_A * n_B) of a dense reconstructed adjacency.
+
+    :param X_A: Embedding matrix of shape (n_A, d)
+    :param X_B: Embedding matrix of shape (n_B, d)
+    :param top_k: Number of top scoring pairs to return, over all pairs or for each row if `per_row`.
+    :param metric: one of {"dot", "cosine", "euclidean"}. For "euclidean", the score is the negative distance.
+    :param per_row: If True, return the top_k pairs of each row of X_A instead of the global top_k.
+    :param exclude_adj: Sparse matrix of shape (n_A, n_B). Nonzero pairs are excluded, e.g. training edges.
+    :param ids_A: Array of shape (n_A,) of node ids of X_A rows. Pairs with ids_A[i] == ids_B[j] (self-loops) are excluded.
+    :param ids_B: Array of shape (n_B,) of node ids of X_B rows.
+    :param col_bias: Array of shape (n_B,) added to the scores of each column, e.g. the negative log softmax normalizer.
+    :param block_size: Number of rows of X_A per block. Default is such that a block has at most 2^24 elements.
+    :return: rows, cols, scores: arrays of the top pairs sorted by descending scores
+    """
+    X_A, X_B = np.asarray(X_A, dtype=np.float32), np.asarray(X_B, dtype=np.float32)
+    if metric == "cosine":
+        X_A = X_A / np.clip(np.linalg.norm(X_A, axis=1, keepdims=True), 1e-12, None)
+        X_B = X_B / np.clip(np.linalg.norm(X_B, axis=1, keepdims=True), 1e-12, None)
+    if exclude_adj is not None:
+        exclude_adj = sp.csr_matrix(exclude_adj)
+    if ids_A is not None and ids_B is not None:
+        ids_A, ids_B = np.asarray(ids_A), np.asarray(ids_B)
+        col_pos = {node_id: j for j, node_id in enumerate(ids_B)}
+
+    block_size = _get_block_size(X_B.shape[0], block_size)
+    best_rows, best_cols, best_scores = [], [], []
+    for start in range(0, X_A.shape[0], block_size):
+        scores = _block_scores(X_A[start: start + block_size], X_B, metric)
+        if col_bias is not None:
+            scores = scores + col_bias[np.newaxis, :]
+
+        if exclude_adj is not None:
+            rows, cols = exclude_adj[start: start + scores.shape[0]].nonzero()
+            scores[rows, cols] = -np.inf
+        if ids_A is not None and ids_B is not None:
+            self_pairs = [(i, col_pos[node_id]) for i, node_id in enumerate(ids_A[start: start + scores.shape[0]]) \
+                          if node_id in col_pos]
+            if len(self_pairs) > 0:
+                rows, cols = zip(*self_pairs)
+                scores[list(rows), list(cols)] = -np.inf
+
+        if per_row:
+            k = min(top_k, scores.shape[1])
+            cols = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            rows = np.repeat(np.arange(scores.shape[0]), k)
+            cols = cols.ravel()
+            best_rows.append(rows + start)
+            best_cols.append(cols)
+            best_scores.append(scores[rows, cols])
+        else:
+            flat = scores.ravel()
+            k = min(top_k, flat.shape[0])
+            idx = np.argpartition(-flat, k - 1)[:k]
+            rows, cols = np.unravel_index(idx, scores.shape)
+            best_rows.append(rows + start)
+            best_cols.append(cols)
+            best_scores.append(flat[idx])
+
+            # Merge the running top_k with the block's top_k
+            best_rows, best_cols, best_scores = [np.concatenate(best_rows)], [np.concatenate(best_cols)], \
+                                                [np.concatenate(best_scores)]
+            if best_scores[0].shape[0] > top_k:
+                idx = np.argpartition(-best_scores[0], top_k - 1)[:top_k]
+                best_rows, best_cols, best_scores = [best_rows[0][idx]], [best_cols[0][idx]], [best_scores[0][idx]]
+
+    rows, cols, scores = np.concatenate(best_rows), np.concatenate(best_cols), np.concatenate(best_scores)
+    valid = np.isfinite(scores)
+    rows, cols, scores = rows[valid], cols[valid], scores[valid]
+
+    if per_row:
+        order = np.lexsort((-scores, rows))
+    else:
+        order = np.argsort(-scores, kind="stable")
+    return rows[order], cols[order], scores[order]
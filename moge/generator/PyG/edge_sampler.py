@@ -8,9 +8,9 @@ from moge.module.PyG.latte import tag_negative
 class EdgeSampler(HeteroNetDataset):
     def __init__(self, dataset, node_types=None, metapaths=None, head_node_type=None, directed=True,
                  resample_train=None,
-                 add_reverse_metapaths=True):
+                 add_reverse_metapaths=True, cache_dir=None):
         super(EdgeSampler, self).__init__(dataset, node_types, metapaths, head_node_type, directed, resample_train,
-                                          add_reverse_metapaths)
+                                          add_reverse_metapaths, cache_dir=cache_dir)
 
     def process_PygLinkDataset_homo(self, dataset: PygLinkPropPredDataset):
         data = dataset[0]
@@ -74,24 +74,15 @@ class EdgeSampler(HeteroNetDataset):
         edge_reltype = self.edge_reltype[iloc]
         reltype_ids = self.edge_reltype[iloc].unique()
 
-        # Gather all nodes sampled
-        X["global_node_index"][self.head_node_type] = edge_index.view(-1).unique()
-
-        local2batch = {
-            node_type: dict(zip(X["global_node_index"][node_type].numpy(),
-                                range(len(X["global_node_index"][node_type])))
-                            ) for node_type in X["global_node_index"]}
-
-        # Get edge_index with batch id
+        # Gather all nodes sampled, and get edge_index with batch id from the inverse of the unique nodes
+        X["global_node_index"][self.head_node_type], edge_index = edge_index.unique(return_inverse=True)
         for relation_id in reltype_ids:
             if relation_id == 1:
                 mask = edge_reltype == relation_id
-                X["edge_index_dict"][self.metapaths[0]] = edge_index[mask, :].apply_(
-                    local2batch[self.head_node_type].get).t()
+                X["edge_index_dict"][self.metapaths[0]] = edge_index[mask, :].t()
             elif relation_id == 0:
                 mask = edge_reltype == relation_id
-                X["edge_index_dict"][tag_negative(self.metapaths[0])] = edge_index[mask, :].apply_(
-                    local2batch[self.head_node_type].get).t()
+                X["edge_index_dict"][tag_negative(self.metapaths[0])] = edge_index[mask, :].t()
 
         if self.use_reverse:
             self.add_reverse_edge_index(X["edge_index_dict"])
@@ -1,21 +1,22 @@
 from collections import OrderedDict
+from functools import partial
 
-import numpy as np
-import pandas as pd
 import torch
 from ogb.nodeproppred import PygNodePropPredDataset
 from torch_geometric.data import NeighborSampler
 from torch_geometric.utils.hetero import group_hetero_graph
+from torch_sparse import SparseTensor
 
 from moge.generator.network import HeteroNetDataset
+from moge.generator.utils import sample_csr_neighbors, share_memory, node_mask, unique_rows, nonduplicate_mask
 
 
 class HeteroNeighborSampler(HeteroNetDataset):
     def __init__(self, dataset, neighbor_sizes, node_types=None, metapaths=None, head_node_type=None, directed=True,
-                 resample_train=None, add_reverse_metapaths=True, inductive=False):
+                 resample_train=None, add_reverse_metapaths=True, inductive=False, cache_dir=None):
         self.neighbor_sizes = neighbor_sizes
         super(HeteroNeighborSampler, self).__init__(dataset, node_types, metapaths, head_node_type, directed,
-                                                    resample_train, add_reverse_metapaths, inductive)
+                                                    resample_train, add_reverse_metapaths, inductive, cache_dir)
 
         if self.use_reverse:
             self.add_reverse_edge_index(self.edge_index_dict)
@@ -33,6 +34,8 @@ class HeteroNeighborSampler(HeteroNetDataset):
 
         self.neighbor_sampler = NeighborSampler(self.edge_index, node_idx=self.training_idx,
                                                 sizes=self.neighbor_sizes, batch_size=128, shuffle=True)
+        self.typed_adjs = None
+        self.allowed_masks = {}
 
     def process_PygNodeDataset_hetero(self, dataset: PygNodePropPredDataset, ):
         data = dataset[0]
@@ -140,14 +143,155 @@ class HeteroNeighborSampler(HeteroNetDataset):
     def get_collate_fn(self, collate_fn: str, mode=None):
         assert mode is not None, "Must pass arg `mode` at get_collate_fn(). {'train', 'valid', 'test'}"
 
-        def collate_wrapper(iloc):
-            return self.sample(iloc, mode=mode)
-
-        if "neighbor_sampler" in collate_fn:
-            return collate_wrapper
+        # Partials of bound methods, unlike closures, can be pickled to spawned DataLoader workers
+        if "typed_neighbor_sampler" in collate_fn:
+            # Build the CSR adjacencies before the workers start, so that they are shared instead of built per worker
+            self.get_typed_adjs()
+            return partial(self.sample_typed, mode=mode)
+        elif "neighbor_sampler" in collate_fn and getattr(self, "device", torch.device("cpu")).type != "cpu":
+            print(f"WARNING: NeighborSampler only samples on CPU, using `typed_neighbor_sampler` on {self.device}")
+            self.get_typed_adjs()
+            return partial(self.sample_typed, mode=mode)
+        elif "neighbor_sampler" in collate_fn:
+            return partial(self.sample, mode=mode)
         else:
             return super().get_collate_fn(collate_fn, mode=mode)
 
+    def share_memory_(self):
+        super().share_memory_()
+        share_memory(self.neighbor_sampler.adj_t)
+        return self
+
+    def get_allowed_nodes(self, mode):
+        """
+        :param mode: one of {"train", "valid", "test"}
+        :return filter, allowed_nodes: whether sampled nodes of `head_node_type` must be filtered, and the indices of the
+            `head_node_type` nodes allowed in a batch of `mode`
+        """
+        if "train" in mode:
+            filter = True if self.inductive else False
+            if self.inductive and hasattr(self, "training_subgraph_idx"):
+                allowed_nodes = self.training_subgraph_idx
+            else:
+                allowed_nodes = self.training_idx
+        elif "valid" in mode:
+            filter = True if self.inductive else False
+            if self.inductive and hasattr(self, "training_subgraph_idx"):
+                allowed_nodes = torch.cat([self.validation_idx, self.training_subgraph_idx])
+            else:
+                allowed_nodes = self.validation_idx
+        elif "test" in mode:
+            filter = False
+            allowed_nodes = self.testing_idx
+        else:
+            raise Exception(f"Must set `mode` to either 'training', 'validation', or 'testing'. mode={mode}")
+        return filter, allowed_nodes
+
+    def get_allowed_nodes_mask(self, mode):
+        """
+        A boolean mask over all `head_node_type` nodes of `get_allowed_nodes(mode)`, for O(1) membership tests. The mask
+        of each mode is built once, and rebuilt only when the split tensors are replaced, e.g. by a resampling or `to()`.
+        """
+        splits = (self.training_idx, self.validation_idx, self.testing_idx, getattr(self, "training_subgraph_idx", None))
+        cached = self.allowed_masks.get(mode, None)
+        if cached is not None and all(a is b for a, b in zip(cached[0], splits)):
+            return cached[1], cached[2]
+
+        filter, allowed_nodes = self.get_allowed_nodes(mode)
+        allowed_nodes = torch.as_tensor(allowed_nodes, dtype=torch.long)
+        num_nodes = max(self.num_nodes_dict[self.head_node_type],
+                        int(allowed_nodes.max()) + 1 if allowed_nodes.numel() else 0)
+        mask = node_mask(allowed_nodes, num_nodes)
+        self.allowed_masks[mode] = (splits, filter, mask)
+        return filter, mask
+
+    def get_typed_adjs(self):
+        """
+        A CSR adjacency (rowptr, col) of each metapath from its head node type's local index to its tail node type's
+        local index, built once from `edge_index_dict`.
+        """
+        if self.typed_adjs is None:
+            self.typed_adjs = {}
+            for metapath, edge_index in self.edge_index_dict.items():
+                head_type, tail_type = metapath[0], metapath[-1]
+                if head_type not in self.num_nodes_dict or tail_type not in self.num_nodes_dict: continue
+                adj = SparseTensor(row=edge_index[0], col=edge_index[1],
+                                   sparse_sizes=(self.num_nodes_dict[head_type], self.num_nodes_dict[tail_type]))
+                rowptr, col, _ = adj.csr()
+                self.typed_adjs[metapath] = (rowptr, col)
+        return self.typed_adjs
+
+    def sample_typed(self, iloc, mode):
+        """
+        Neighbor sampling directly on the per-metapath CSR adjacencies in the type-specific local index, without the
+        homogeneous `group_hetero_graph` index. At each hop, only the newly sampled nodes of each node type are expanded
+        along the metapaths whose head type matches, with a fanout of `neighbor_sizes[hop]` per metapath. The edges
+        follow the direction of `edge_index_dict`, i.e. the head nodes of a metapath aggregate from its tail nodes, so the
+        coverage of `sample()` requires `add_reverse_metapaths=True`.
+
+        :param iloc: A tensor of a batch of indices in training_idx, validation_idx, or testing_idx
+        :return: X, y, weights, in the same format as `sample()`
+        """
+        if not isinstance(iloc, torch.Tensor):
+            iloc = torch.tensor(iloc)
+        iloc = iloc.to(torch.long)
+
+        filter, allowed_mask = self.get_allowed_nodes_mask(mode)
+        typed_adjs = self.get_typed_adjs()
+
+        sampled_nodes = {self.head_node_type: [iloc]}
+        sampled_edges = {}
+        frontier = {self.head_node_type: iloc.unique()}
+        for num_neighbors in self.neighbor_sizes:
+            next_frontier = {}
+            for metapath, (rowptr, col) in typed_adjs.items():
+                head_type, tail_type = metapath[0], metapath[-1]
+                if head_type not in frontier: continue
+
+                heads, tails = sample_csr_neighbors(rowptr, col, frontier[head_type], num_neighbors)
+                # Remove sampled nodes of head_node_type not in the allowed nodes
+                if filter and tail_type == self.head_node_type:
+                    mask = allowed_mask[tails]
+                    heads, tails = heads[mask], tails[mask]
+
+                sampled_edges.setdefault(metapath, []).append(torch.stack([heads, tails], dim=0))
+                next_frontier.setdefault(tail_type, []).append(tails)
+
+            frontier = {node_type: torch.cat(nodes, dim=0).unique() for node_type, nodes in next_frontier.items()}
+            for node_type, nodes in frontier.items():
+                sampled_nodes.setdefault(node_type, []).append(nodes)
+
+        # `global_node_index` here actually refers to the 'local' type-specific index of the original graph
+        X = {"edge_index_dict": {},
+             "global_node_index": {node_type: torch.cat(nodes, dim=0).unique() \
+                                   for node_type, nodes in sampled_nodes.items()},
+             "x_dict": {}}
+
+        # Convert local index -> batch index, and remove duplicate edges sampled from multiple hops
+        for metapath, edge_index in sampled_edges.items():
+            head_type, tail_type = metapath[0], metapath[-1]
+            edge_index = unique_rows(torch.cat(edge_index, dim=1).t()).t()
+            if edge_index.size(1) == 0: continue
+
+            X["edge_index_dict"][metapath] = torch.stack([
+                self.batch_index_map.remap(edge_index[0], X["global_node_index"][head_type], head_type),
+                self.batch_index_map.remap(edge_index[1], X["global_node_index"][tail_type], tail_type)], dim=0)
+
+        # x_dict attributes
+        if hasattr(self, "x_dict") and len(self.x_dict) > 0:
+            X["x_dict"] = {node_type: self.x_dict[node_type][X["global_node_index"][node_type]] \
+                           for node_type in self.x_dict if node_type in X["global_node_index"]}
+
+        # y_dict
+        if len(self.y_dict) > 1:
+            y = {node_type: y_true[X["global_node_index"][node_type]] for node_type, y_true in self.y_dict.items()}
+            y_head = y[self.head_node_type]
+        else:
+            y = y_head = self.y_dict[self.head_node_type][X["global_node_index"][self.head_node_type]].squeeze(-1)
+
+        weights = ((y_head != -1) & allowed_mask[X["global_node_index"][self.head_node_type]]).to(torch.float)
+        return X, y, weights
+
     def get_local_nodes_dict(self, adjs, n_id):
         """
 
@@ -185,41 +329,19 @@ class HeteroNeighborSampler(HeteroNetDataset):
         sampled_local_nodes = self.get_local_nodes_dict(adjs, n_id)
 
         # Ensure the sampled nodes only either belongs to training, validation, or testing set
-        if "train" in mode:
-            filter = True if self.inductive else False
-            if self.inductive and hasattr(self, "training_subgraph_idx"):
-                allowed_nodes = self.training_subgraph_idx
-            else:
-                allowed_nodes = self.training_idx
-        elif "valid" in mode:
-            filter = True if self.inductive else False
-            if self.inductive and hasattr(self, "training_subgraph_idx"):
-                allowed_nodes = torch.cat([self.validation_idx, self.training_subgraph_idx])
-            else:
-                allowed_nodes = self.validation_idx
-        elif "test" in mode:
-            filter = False
-            allowed_nodes = self.testing_idx
-        else:
-            raise Exception(f"Must set `mode` to either 'training', 'validation', or 'testing'. mode={mode}")
+        filter, allowed_mask = self.get_allowed_nodes_mask(mode)
 
         if filter:
-            node_mask = np.isin(sampled_local_nodes[self.head_node_type], allowed_nodes)
-            sampled_local_nodes[self.head_node_type] = sampled_local_nodes[self.head_node_type][node_mask]
+            sampled_local_nodes[self.head_node_type] = sampled_local_nodes[self.head_node_type][
+                allowed_mask[sampled_local_nodes[self.head_node_type]]]
 
         # `global_node_index` here actually refers to the 'local' type-specific index of the original graph
         X = {"edge_index_dict": {},
              "global_node_index": sampled_local_nodes,
              "x_dict": {}}
 
-        local2batch = {
-            node_type: dict(zip(sampled_local_nodes[node_type].numpy(),
-                                range(len(sampled_local_nodes[node_type])))
-                            ) for node_type in sampled_local_nodes}
-
         X["edge_index_dict"] = self.get_local_edge_index_dict(adjs=adjs, n_id=n_id,
                                                               sampled_local_nodes=sampled_local_nodes,
-                                                              local2batch=local2batch,
                                                               filter_nodes=filter)
 
         # x_dict attributes
@@ -233,8 +355,7 @@ class HeteroNeighborSampler(HeteroNetDataset):
         else:
             y = self.y_dict[self.head_node_type][X["global_node_index"][self.head_node_type]].squeeze(-1)
 
-        weights = (y != -1) & np.isin(X["global_node_index"][self.head_node_type], allowed_nodes)
-        weights = torch.tensor(weights, dtype=torch.float)
+        weights = ((y != -1) & allowed_mask[X["global_node_index"][self.head_node_type]]).to(torch.float)
 
         if hasattr(self, "x_dict") and len(self.x_dict) > 0:
             assert X["global_node_index"][self.head_node_type].size(0) == X["x_dict"][self.head_node_type].size(0)
@@ -243,18 +364,21 @@ class HeteroNeighborSampler(HeteroNetDataset):
         # assert y.size(0) == weights.size(0)
         return X, y, weights
 
-    def get_local_edge_index_dict(self, adjs, n_id, sampled_local_nodes: dict, local2batch: dict,
-                                  filter_nodes: bool):
+    def get_local_edge_index_dict(self, adjs, n_id, sampled_local_nodes: dict, filter_nodes: bool):
         """
         # Conbine all edge_index's and convert local node id to "batch node index" that aligns with `x_dict` and `global_node_index`
         :param adjs:
         :param n_id:
         :param sampled_local_nodes:
-        :param local2batch:
         :param filter_nodes:
         :return:
         """
         edge_index_dict = {}
+        if filter_nodes:
+            # Mask of the allowed nodes of head_node_type in the global index, to remove edge_index with other nodes
+            allowed_mask = node_mask(self.local2global[self.head_node_type][sampled_local_nodes[self.head_node_type]],
+                                     num_nodes=self.node_type.size(0))
+
         for adj in adjs:
             for edge_type_id in self.edge_type[adj.e_id].unique():
                 metapath = self.int2edge_type[edge_type_id.item()]
@@ -269,21 +393,22 @@ class HeteroNeighborSampler(HeteroNetDataset):
                 edge_index[1] = n_id[edge_index[1]]
 
                 if filter_nodes:
-                    # If node_type==self.head_node_type, then remove edge_index with nodes not in allowed_nodes_idx
-                    allowed_nodes_idx = self.local2global[self.head_node_type][sampled_local_nodes[self.head_node_type]]
+                    # If node_type==self.head_node_type, then remove edge_index with nodes not in allowed_mask
                     if head_type == self.head_node_type and tail_type == self.head_node_type:
-                        mask = np.isin(edge_index[0], allowed_nodes_idx) & np.isin(edge_index[1], allowed_nodes_idx)
+                        mask = allowed_mask[edge_index[0]] & allowed_mask[edge_index[1]]
                         edge_index = edge_index[:, mask]
                     elif head_type == self.head_node_type:
-                        mask = np.isin(edge_index[0], allowed_nodes_idx)
+                        mask = allowed_mask[edge_index[0]]
                         edge_index = edge_index[:, mask]
                     elif tail_type == self.head_node_type:
-                        mask = np.isin(edge_index[1], allowed_nodes_idx)
+                        mask = allowed_mask[edge_index[1]]
                         edge_index = edge_index[:, mask]
 
                 # Convert node global index -> local index -> batch index
-                edge_index[0] = self.local_node_idx[edge_index[0]].apply_(local2batch[head_type].get)
-                edge_index[1] = self.local_node_idx[edge_index[1]].apply_(local2batch[tail_type].get)
+                edge_index[0] = self.batch_index_map.remap(self.local_node_idx[edge_index[0]],
+                                                           sampled_local_nodes[head_type], head_type)
+                edge_index[1] = self.batch_index_map.remap(self.local_node_idx[edge_index[1]],
+                                                           sampled_local_nodes[tail_type], tail_type)
 
                 edge_index_dict.setdefault(metapath, []).append(edge_index)
         # Join edges from the adjs
@@ -295,7 +420,6 @@ class HeteroNeighborSampler(HeteroNetDataset):
         return edge_index_dict
 
     def nonduplicate_indices(self, edge_index):
-        edge_df = pd.DataFrame(edge_index.t().numpy())  # shape: (n_edges, 2)
-        return ~edge_df.duplicated(subset=[0, 1])
+        return nonduplicate_mask(edge_index.t())  # shape: (n_edges, 2)
 
 
@@ -8,9 +8,9 @@ from moge.generator.network import HeteroNetDataset
 
 class TripletSampler(HeteroNetDataset):
     def __init__(self, dataset, node_types=None, metapaths=None, head_node_type=None, directed=True,
-                 resample_train=None, add_reverse_metapaths=True):
+                 resample_train=None, add_reverse_metapaths=True, cache_dir=None):
         super(TripletSampler, self).__init__(dataset, node_types, metapaths, head_node_type, directed, resample_train,
-                                             add_reverse_metapaths)
+                                             add_reverse_metapaths, cache_dir=cache_dir)
         self.n_classes = None
         self.classes = None
 
@@ -62,6 +62,8 @@ class TripletSampler(HeteroNetDataset):
         assert self.validation_idx.max() < self.testing_idx.min()
         assert self.testing_idx.max() < self.training_idx.min()
 
+        self.sort_triples_by_relation()
+
     def process_edge_reltype_dataset(self, dataset: PygLinkPropPredDataset):
         data = dataset[0]
         self._name = dataset.name
@@ -112,6 +114,26 @@ class TripletSampler(HeteroNetDataset):
         assert self.validation_idx.max() < self.testing_idx.min()
         assert self.testing_idx.max() < self.training_idx.min()
 
+        self.sort_triples_by_relation()
+
+    def sort_triples_by_relation(self):
+        """
+        Sort the triples of each split by relation (stable, so the original order is kept within a relation), in-place.
+        The splits stay in their ranges of `start_idx`, so a sorted batch of indices is grouped by relation into
+        contiguous slices.
+        """
+        end_idx = {"valid": self.start_idx["test"], "test": self.start_idx["train"],
+                   "train": self.triples["relation"].size(0)}
+        perm = torch.cat([start + torch.sort(self.triples["relation"][start: end_idx[split]], stable=True).indices \
+                          for split, start in sorted(self.start_idx.items(), key=lambda item: item[1])])
+
+        for key, values in self.triples.items():
+            # Negative triples only exist for the valid and test splits, which come first
+            split_perm = perm[:len(values)]
+            if isinstance(values, torch.Tensor):
+                self.triples[key] = values[split_perm]
+            else:
+                self.triples[key] = values[split_perm.numpy()]
 
     def get_collate_fn(self, collate_fn: str, batch_size=None, mode=None):
         if "triples_batch" in collate_fn:
@@ -131,47 +153,57 @@ class TripletSampler(HeteroNetDataset):
 
         X = {"edge_index_dict": {}, "global_node_index": {}, "x_dict": {}}
 
-        triples = {k: v[iloc] for k, v in self.triples.items() if not is_negative(k)}
+        # Since the triples are sorted by relation within each split, the sorted batch is grouped by relation
+        iloc = iloc.sort().values
+        triples = {k: v[iloc] for k, v in self.triples.items() if not is_negative(k) and isinstance(v, torch.Tensor)}
         if has_neg_edges:
             triples.update({k: v[iloc] for k, v in self.triples.items() if is_negative(k)})
 
+        relation_ids, counts = torch.unique_consecutive(triples["relation"], return_counts=True)
+        relation_slices = {}
+        for relation_id, end, count in zip(relation_ids.tolist(), counts.cumsum(0).tolist(), counts.tolist()):
+            relation_slices.setdefault(relation_id, []).append(slice(end - count, end))
+
+        def get_slices(key, relation_id):
+            if len(relation_slices[relation_id]) == 1:
+                return triples[key][relation_slices[relation_id][0]]
+            return torch.cat([triples[key][s] for s in relation_slices[relation_id]], dim=0)
+
         # Gather all nodes sampled
-        relation_ids_all = triples["relation"].unique()
-        for relation_id in relation_ids_all:
+        for relation_id in relation_slices:
             metapath = self.metapaths[relation_id]
             head_type, tail_type = metapath[0], metapath[-1]
 
-            mask = triples["relation"] == relation_id
-            X["global_node_index"].setdefault(head_type, []).append(triples["head"][mask])
-            X["global_node_index"].setdefault(tail_type, []).append(triples["tail"][mask])
+            X["global_node_index"].setdefault(head_type, []).append(get_slices("head", relation_id))
+            X["global_node_index"].setdefault(tail_type, []).append(get_slices("tail", relation_id))
             if has_neg_edges:
-                X["global_node_index"].setdefault(head_type, []).append(triples["head_neg"][mask].view(-1))
-                X["global_node_index"].setdefault(tail_type, []).append(triples["tail_neg"][mask].view(-1))
+                X["global_node_index"].setdefault(head_type, []).append(get_slices("head_neg", relation_id).view(-1))
+                X["global_node_index"].setdefault(tail_type, []).append(get_slices("tail_neg", relation_id).view(-1))
 
         X["global_node_index"] = {node_type: torch.cat(node_sets, dim=0).unique() \
                                   for node_type, node_sets in X["global_node_index"].items()}
 
-        local2batch = {
-            node_type: dict(zip(X["global_node_index"][node_type].numpy(),
-                                range(len(X["global_node_index"][node_type])))
-                            ) for node_type in X["global_node_index"]}
-
         # Get edge_index with batch id
-        for relation_id in relation_ids_all:
+        for relation_id in relation_slices:
             metapath = self.metapaths[relation_id]
             head_type, tail_type = metapath[0], metapath[-1]
 
-            mask = triples["relation"] == relation_id
-            sources = triples["head"][mask].apply_(local2batch[head_type].get)
-            targets = triples["tail"][mask].apply_(local2batch[tail_type].get)
+            sources = self.batch_index_map.remap(get_slices("head", relation_id), X["global_node_index"][head_type],
+                                                 head_type)
+            targets = self.batch_index_map.remap(get_slices("tail", relation_id), X["global_node_index"][tail_type],
+                                                 tail_type)
             X["edge_index_dict"][metapath] = torch.stack([sources, targets], dim=1).t()
 
             if has_neg_edges:
-                head_neg = triples["head_neg"][mask].apply_(local2batch[head_type].get)
-                tail_neg = triples["tail_neg"][mask].apply_(local2batch[tail_type].get)
+                head_neg = self.batch_index_map.remap(get_slices("head_neg", relation_id),
+                                                      X["global_node_index"][head_type], head_type)
+                tail_neg = self.batch_index_map.remap(get_slices("tail_neg", relation_id),
+                                                      X["global_node_index"][tail_type], tail_type)
+                # Pair each triple's negative heads (tails) with its own tail (head), in the row-major order of
+                # head_neg (tail_neg), i.e. num_neg consecutive negative edges per triple
                 head_batch = torch.stack([head_neg.view(-1),
-                                          targets.repeat(head_neg.size(1))])
-                tail_batch = torch.stack([sources.repeat(tail_neg.size(1)),
+                                          targets.repeat_interleave(head_neg.size(1))])
+                tail_batch = torch.stack([sources.repeat_interleave(tail_neg.size(1)),
                                           tail_neg.view(-1)])
                 X["edge_index_dict"][tag_negative(metapath)] = torch.cat([head_batch, tail_batch], dim=1)
 
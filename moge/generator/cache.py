@@ -0,0 +1,148 @@
+import hashlib
+import os
+import pickle
+import shutil
+
+import numpy as np
+import torch
+
+CACHE_VERSION = 1
+MANIFEST_FILE = "manifest.pk"
+
+
+class CachedArray:
+    def __init__(self, filename: str, is_tensor: bool):
+        """
+        Placeholder for an array saved to a .npy file within the cache directory.
+        """
+        self.filename = filename
+        self.is_tensor = is_tensor
+
+
+def get_cache_key(*args, **kwargs) -> str:
+    """
+    Content hash of the preprocessing arguments, used to name the cache directory of a processed dataset.
+    """
+    content = repr((CACHE_VERSION, args, sorted(kwargs.items(), key=lambda item: item[0])))
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+
+def get_cache_path(cache_dir: str, name: str, key: str) -> str:
+    return os.path.join(os.path.expanduser(cache_dir), f"{name}_v{CACHE_VERSION}_{key}")
+
+
+def _to_cached(value, arrays: list):
+    if isinstance(value, (torch.Tensor, np.ndarray)) and not (isinstance(value, np.ndarray) and value.dtype == object):
+        cached = CachedArray(filename=f"{len(arrays)}.npy", is_tensor=isinstance(value, torch.Tensor))
+        arrays.append((cached.filename, value.cpu().numpy() if isinstance(value, torch.Tensor) else value))
+        return cached
+    elif isinstance(value, dict):
+        return value.__class__((k, _to_cached(v, arrays)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)) and any(isinstance(v, (torch.Tensor, np.ndarray)) for v in value):
+        return value.__class__(_to_cached(v, arrays) for v in value)
+    else:
+        return value
+
+
+def _from_cached(value, path: str, mmap: bool):
+    if isinstance(value, CachedArray):
+        array = np.load(os.path.join(path, value.filename), mmap_mode="c" if mmap else None)
+        if not value.is_tensor:
+            return array
+        tensor = torch.from_numpy(array)
+        if mmap:
+            tensor.mmap_file = os.path.join(path, value.filename)
+        return tensor
+    elif isinstance(value, dict):
+        return value.__class__((k, _from_cached(v, path, mmap)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)) and any(isinstance(v, CachedArray) for v in value):
+        return value.__class__(_from_cached(v, path, mmap) for v in value)
+    else:
+        return value
+
+
+def is_mmap(tensor: torch.Tensor) -> bool:
+    """
+    Whether `tensor` was memory-mapped from a cache file by `load_state()`.
+    """
+    return getattr(tensor, "mmap_file", None) is not None
+
+
+def to_mmap_refs(value):
+    """
+    Replace the tensors memory-mapped by `load_state()` in `value`, also when nested in dicts, lists and tuples, with
+    references to their cache files, e.g. before pickling, so that they are mapped again by `from_mmap_refs()` instead of
+    being copied.
+    """
+    if isinstance(value, torch.Tensor) and is_mmap(value):
+        return CachedArray(filename=value.mmap_file, is_tensor=True)
+    elif isinstance(value, dict):
+        return value.__class__((k, to_mmap_refs(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return value.__class__(to_mmap_refs(v) for v in value)
+    return value
+
+
+def from_mmap_refs(value):
+    """
+    Memory-map the cache files referenced by `to_mmap_refs()` in `value` again, copy-on-write.
+    """
+    if isinstance(value, CachedArray):
+        tensor = torch.from_numpy(np.load(value.filename, mmap_mode="c"))
+        tensor.mmap_file = value.filename
+        return tensor
+    elif isinstance(value, dict):
+        return value.__class__((k, from_mmap_refs(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return value.__class__(from_mmap_refs(v) for v in value)
+    return value
+
+
+def save_state(state: dict, path: str) -> None:
+    """
+    Save a dict of attributes to the `path` directory. Tensors and numpy arrays (also when nested in dicts, lists and
+    tuples) are written to separate .npy files so they can be memory-mapped at load, while everything else is pickled
+    into a single manifest. The directory is written to a temporary location first and renamed when complete, so that
+    an interrupted run never leaves a partial cache.
+
+    :param state: Dict of <attribute name>:<value>
+    :param path: the cache directory to write to
+    """
+    arrays = []
+    manifest = {"version": CACHE_VERSION,
+                "state": {name: _to_cached(value, arrays) for name, value in state.items()}}
+
+    tmp_path = path + f".tmp{os.getpid()}"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    for filename, array in arrays:
+        np.save(os.path.join(tmp_path, filename), array, allow_pickle=False)
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "wb") as file:
+        pickle.dump(manifest, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def load_state(path: str, mmap=True) -> dict:
+    """
+    Load a dict of attributes saved with `save_state()`. If `mmap`, arrays are memory-mapped copy-on-write, so pages are
+    only read from disk when accessed and in-place modifications are never written back to the cache.
+
+    :param path: the cache directory
+    :param mmap: whether to memory-map the arrays instead of reading them to memory
+    :return: Dict of <attribute name>:<value>, or None if the cache doesn't exist or has a different version
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "rb") as file:
+        manifest = pickle.load(file)
+    if manifest.get("version", None) != CACHE_VERSION:
+        return None
+
+    return {name: _from_cached(value, path, mmap) for name, value in manifest["state"].items()}
@@ -1,4 +1,5 @@
-import numpy as np
+import hashlib
+
 import torch
 from torch.utils.data import DataLoader
 
@@ -13,8 +14,14 @@ class DGLNodeSampler(HeteroNetDataset):
     def __init__(self, dataset: DglNodePropPredDataset, neighbor_sizes, full_neighbor=False, node_types=None,
                  metapaths=None,
                  head_node_type=None, directed=True, resample_train: float = None, add_reverse_metapaths=True,
-                 inductive=True):
+                 inductive=True, shared_memory=False):
+        """
+        :param shared_memory: If True, the cached inductive subgraphs are moved to shared memory, so the DataLoader
+            workers attach to them instead of receiving a copy.
+        """
         self.neighbor_sizes = neighbor_sizes
+        self.shared_memory = shared_memory
+        self.subgraphs = {}
         super().__init__(dataset, node_types, metapaths, head_node_type, directed, resample_train,
                          add_reverse_metapaths, inductive)
         assert isinstance(self.G, (dgl.DGLGraph, dgl.DGLHeteroGraph))
@@ -88,14 +95,42 @@ class DGLNodeSampler(HeteroNetDataset):
     def sample(self, iloc, mode):
         raise NotImplementedError()
 
-    def train_dataloader(self, collate_fn=None, batch_size=128, num_workers=12, **kwargs):
-        if self.inductive:
-            nodes = {ntype: self.G.nodes(ntype) for ntype in self.node_types if ntype != self.head_node_type}
-            nodes[self.head_node_type] = self.training_idx
+    def get_subgraph(self, mode):
+        """
+        The graph to sample neighbors from in `mode`. If inductive, it's the subgraph induced by the `head_node_type`
+        nodes of the training split (and the validation split in "valid" mode) and all nodes of the other node types.
+        The induced subgraphs are built once and cached, keyed on the split and a hash of its nodes, so that a resampled
+        split builds a new subgraph.
+
+        :param mode: one of {"train", "valid", "test"}
+        """
+        if not self.inductive or "test" in mode:
+            return self.G
+
+        if "train" in mode:
+            head_nodes = self.training_idx
+        elif "valid" in mode:
+            head_nodes = torch.cat([torch.as_tensor(self.training_idx), torch.as_tensor(self.validation_idx)]).unique()
+        else:
+            raise Exception(f"Must set `mode` to either 'train', 'valid', or 'test'. mode={mode}")
 
+        head_nodes = torch.as_tensor(head_nodes, dtype=self.G.idtype)
+        key = (mode, hashlib.sha1(head_nodes.cpu().numpy().tobytes()).hexdigest()[:16])
+        if key not in self.subgraphs:
+            # Remove subgraphs of a previous node set of the split
+            self.subgraphs = {k: graph for k, graph in self.subgraphs.items() if k[0] != mode}
+
+            nodes = {ntype: self.G.nodes(ntype) for ntype in self.node_types if ntype != self.head_node_type}
+            nodes[self.head_node_type] = head_nodes
             graph = dgl.node_subgraph(self.G, nodes)
-        else:
-            graph = self.G
+            if self.shared_memory:
+                graph = graph.shared_memory(f"{self.name()}_{key[0]}_{key[1]}")
+            self.subgraphs[key] = graph
+
+        return self.subgraphs[key]
+
+    def train_dataloader(self, collate_fn=None, batch_size=128, num_workers=12, **kwargs):
+        graph = self.get_subgraph("train")
 
         collator = dgl.dataloading.NodeCollator(graph, {self.head_node_type: self.training_idx}, self.neighbor_sampler)
         dataloader = DataLoader(collator.dataset, collate_fn=collator.collate,
@@ -109,12 +144,7 @@ class DGLNodeSampler(HeteroNetDataset):
         return dataloader
 
     def valid_dataloader(self, collate_fn=None, batch_size=128, num_workers=4, **kwargs):
-        if self.inductive:
-            nodes = {ntype: self.G.nodes(ntype) for ntype in self.node_types if ntype != self.head_node_type}
-            nodes[self.head_node_type] = torch.tensor(np.union1d(self.training_idx, self.validation_idx))
-            graph = dgl.node_subgraph(self.G, nodes)
-        else:
-            graph = self.G
+        graph = self.get_subgraph("valid")
 
         collator = dgl.dataloading.NodeCollator(graph, {self.head_node_type: self.validation_idx},
                                                 self.neighbor_sampler)
@@ -128,7 +158,7 @@ class DGLNodeSampler(HeteroNetDataset):
         return dataloader
 
     def test_dataloader(self, collate_fn=None, batch_size=128, num_workers=4, **kwargs):
-        graph = self.G
+        graph = self.get_subgraph("test")
 
         collator = dgl.dataloading.NodeCollator(graph, {self.head_node_type: self.testing_idx},
                                                 self.neighbor_sampler)
@@ -0,0 +1,174 @@
+import json
+import os
+from collections.abc import Mapping
+
+import numpy as np
+import torch
+
+STORE_VERSION = 1
+HEADER_FILE = "header.json"
+DTYPES = {"float32", "float16", "int8"}
+
+
+class FeatureMatrix:
+    def __init__(self, path: str, node_type: str, num_nodes: int, dim: int, dtype: str, mmap=True,
+                 out_dtype=torch.float):
+        """
+        The feature matrix of one node type in a NodeFeatureStore. Indexing with a tensor of node ids, like a tensor of
+        shape (num_nodes, dim), only reads and dequantizes the requested rows.
+        """
+        self.path = path
+        self.node_type = node_type
+        self.num_nodes = num_nodes
+        self.dim = dim
+        self.dtype = dtype
+        self.mmap = mmap
+        self.out_dtype = out_dtype
+        self._values = None
+        self._scale = None
+
+    @property
+    def shape(self) -> torch.Size:
+        return torch.Size((self.num_nodes, self.dim))
+
+    def size(self, dim=None):
+        return self.shape if dim is None else self.shape[dim]
+
+    def __len__(self):
+        return self.num_nodes
+
+    @property
+    def values(self) -> np.ndarray:
+        if self._values is None:
+            self._values = np.load(os.path.join(self.path, f"{self.node_type}.npy"), mmap_mode="r" if self.mmap else None)
+        return self._values
+
+    @property
+    def scale(self) -> np.ndarray:
+        if self._scale is None and self.dtype == "int8":
+            self._scale = np.load(os.path.join(self.path, f"{self.node_type}.scale.npy"))
+        return self._scale
+
+    def __getstate__(self):
+        # The matrices are opened again when first accessed after unpickling, e.g. in a DataLoader worker
+        return {**self.__dict__, "_values": None, "_scale": None}
+
+    def __getitem__(self, idx) -> torch.Tensor:
+        """
+        :param idx: a tensor, array or list of node ids, or a slice
+        :return: a tensor of shape (len(idx), dim) of `out_dtype`, on the device of `idx`
+        """
+        device = idx.device if isinstance(idx, torch.Tensor) else torch.device("cpu")
+        if isinstance(idx, slice):
+            idx = np.arange(self.num_nodes)[idx]
+        elif isinstance(idx, torch.Tensor):
+            idx = idx.cpu().numpy()
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1)
+
+        # Read the rows in file order, then restore the order of idx
+        order = np.argsort(idx, kind="stable")
+        rows = np.empty((idx.shape[0], self.dim), dtype=self.values.dtype)
+        rows[order] = self.values[idx[order]]
+
+        x = torch.from_numpy(rows).to(torch.float)
+        if self.dtype == "int8":
+            x = x * torch.from_numpy(self.scale[idx]).unsqueeze(1)
+        return x.to(device=device, dtype=self.out_dtype)
+
+    def to_tensor(self) -> torch.Tensor:
+        return self[slice(None)]
+
+
+class NodeFeatureStore(Mapping):
+    def __init__(self, path: str, mmap=True, out_dtype=torch.float):
+        """
+        A node feature store, i.e. a directory with a `header.json` and one .npy feature matrix per node type, stored as
+        float32, float16 or int8 with a float32 scale per row. The matrices are memory-mapped, so a batch only reads the
+        rows of its sampled nodes from disk. It can be used in place of a HeteroNetDataset's `x_dict`, since indexing
+        `store[node_type][global_node_index]` returns a dequantized feature tensor. Use `NodeFeatureStore.save()` to
+        make a new store.
+
+        :param path: the store directory
+        :param mmap: whether to memory-map the matrices instead of reading them to memory when first accessed
+        :param out_dtype: the dtype of the gathered features
+        """
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE), "r") as file:
+            header = json.load(file)
+        if header.get("version", None) != STORE_VERSION:
+            raise Exception("Unsupported node feature store version {} at {}".format(header.get("version"), path))
+
+        self.matrices = {node_type: FeatureMatrix(path, node_type, num_nodes=info["num_nodes"], dim=info["dim"],
+                                                  dtype=info["dtype"], mmap=mmap, out_dtype=out_dtype) \
+                         for node_type, info in header["node_types"].items()}
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, HEADER_FILE))
+
+    @classmethod
+    def save(cls, path: str, x_dict: dict, dtype="float32", chunk_size=100000, overwrite=False):
+        """
+        Write the feature matrices of `x_dict` to a new store at `path`, in chunks of rows so that the quantized copy is
+        never held in memory at once.
+
+        :param x_dict: Dict of <node_type>:<tensor or array of shape (num_nodes, dim)>
+        :param dtype: one of {"float32", "float16", "int8"}. int8 quantizes each row symmetrically by its max absolute
+            value.
+        :param chunk_size: number of rows converted at a time
+        :param overwrite: whether to replace an existing store at `path`
+        """
+        if dtype not in DTYPES:
+            raise Exception(f"dtype must be one of {DTYPES}")
+        if cls.exists(path) and not overwrite:
+            raise Exception("A node feature store already exists at {}".format(path))
+        os.makedirs(path, exist_ok=True)
+
+        node_types = {}
+        for node_type, x in x_dict.items():
+            if "/" in str(node_type) or str(node_type).startswith("."):
+                raise Exception(f"Invalid node type for a file name: {node_type}")
+            num_nodes, dim = x.shape
+
+            values = np.lib.format.open_memmap(os.path.join(path, f"{node_type}.npy"), mode="w+", dtype=dtype,
+                                               shape=(num_nodes, dim))
+            scale = np.ones(num_nodes, dtype=np.float32)
+            for start in range(0, num_nodes, chunk_size):
+                chunk = x[start: start + chunk_size]
+                chunk = chunk.detach().cpu().numpy() if isinstance(chunk, torch.Tensor) else np.asarray(chunk)
+                chunk = chunk.astype(np.float32)
+
+                if dtype == "int8":
+                    chunk_scale = np.abs(chunk).max(axis=1) / 127
+                    chunk_scale[chunk_scale == 0] = 1
+                    scale[start: start + chunk_size] = chunk_scale
+                    chunk = np.round(chunk / chunk_scale[:, None])
+                values[start: start + chunk_size] = chunk.astype(dtype)
+            values.flush()
+            del values
+
+            if dtype == "int8":
+                np.save(os.path.join(path, f"{node_type}.scale.npy"), scale)
+            node_types[node_type] = {"num_nodes": int(num_nodes), "dim": int(dim), "dtype": dtype}
+
+        # The header is written last, so that an interrupted save never leaves a readable store
+        tmp_file = os.path.join(path, HEADER_FILE + ".tmp")
+        with open(tmp_file, "w") as file:
+            json.dump({"version": STORE_VERSION, "node_types": node_types}, file)
+        os.replace(tmp_file, os.path.join(path, HEADER_FILE))
+        return cls(path)
+
+    def __getitem__(self, node_type) -> FeatureMatrix:
+        return self.matrices[node_type]
+
+    def __iter__(self):
+        return iter(self.matrices)
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def to_dict(self) -> dict:
+        """
+        :return: Dict of <node_type>:<the full feature tensor>, loaded to memory
+        """
+        return {node_type: matrix.to_tensor() for node_type, matrix in self.matrices.items()}
@@ -1,3 +1,5 @@
+import os
+
 import networkx as nx
 import numpy as np
 import pandas as pd
@@ -11,6 +13,11 @@ from scipy.io import loadmat
 from torch.utils import data
 from torch_geometric.data import InMemoryDataset
 
+from moge.generator.cache import get_cache_key, get_cache_path, load_state, save_state, to_mmap_refs, \
+    from_mmap_refs
+from moge.generator.feature_store import NodeFeatureStore
+from moge.generator.splits import split_by_hash, save_splits, load_splits
+from moge.generator.utils import BatchIndexMap, share_memory, isin_mask, node_mask, to_device, induced_subgraph
 from moge.module.PyG.latte import is_negative
 
 
@@ -90,7 +97,7 @@ class Network:
 
 class HeteroNetDataset(torch.utils.data.Dataset, Network):
     def __init__(self, dataset, node_types=None, metapaths=None, head_node_type=None, directed=True,
-                 resample_train: float = None, add_reverse_metapaths=True, inductive=True):
+                 resample_train: float = None, add_reverse_metapaths=True, inductive=True, cache_dir=None):
         """
         This class handles processing of the data & train/test spliting.
         :param dataset:
@@ -100,6 +107,9 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
         :param directed:
         :param resample_train:
         :param add_reverse_metapaths:
+        :param inductive:
+        :param cache_dir: default None. If given, the processed dataset is saved to a cache in this directory, keyed on the
+            dataset name and the preprocessing arguments, and is memory-mapped from the cache on later runs.
         """
         self.dataset = dataset
         self.directed = directed
@@ -108,40 +118,38 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
         self.head_node_type = head_node_type
         self.inductive = inductive
 
-        # PyTorchGeometric Dataset
-
-        if isinstance(dataset, PygNodePropPredDataset) and not hasattr(dataset[0], "edge_index_dict"):
-            print("PygNodePropPredDataset Homogenous (use HeteroNeighborSampler class)")
-            self.process_PygNodeDataset_homo(dataset)
-        elif isinstance(dataset, PygNodePropPredDataset) and hasattr(dataset[0], "edge_index_dict"):
-            print("PygNodePropPredDataset Hetero (use HeteroNeighborSampler class)")
-            self.process_PygNodeDataset_hetero(dataset)
-        elif isinstance(dataset, DglNodePropPredDataset):
-            print("DGLNodePropPredDataset Hetero")
-            self.process_DglNodeDataset_hetero(dataset)
-
-        elif isinstance(dataset, PygLinkPropPredDataset) and hasattr(dataset[0], "edge_reltype") and \
-                not hasattr(dataset[0], "edge_index_dict"):
-            print("PygLink_edge_reltype_dataset Hetero (use TripletSampler class)")
-            self.process_edge_reltype_dataset(dataset)
-        elif isinstance(dataset, PygLinkPropPredDataset) and hasattr(dataset[0], "edge_index_dict"):
-            print("PygLinkDataset Hetero (use TripletSampler class)")
-            self.process_PygLinkDataset_hetero(dataset)
-        elif isinstance(dataset, PygLinkPropPredDataset) and not hasattr(dataset[0], "edge_index_dict") \
-                and not hasattr(dataset[0], "edge_reltype"):
-            print("PygLinkDataset Homo (use EdgeSampler class)")
-            self.process_PygLinkDataset_homo(dataset)
-
-        elif isinstance(dataset, InMemoryDataset):
-            print("InMemoryDataset")
-            self.process_inmemorydataset(dataset, train_ratio=0.5)
-        elif isinstance(dataset, HANDataset) or isinstance(dataset, GTNDataset):
-            print(f"{dataset.__class__.__name__}")
-            self.process_COGDLdataset(dataset, metapaths, node_types, resample_train)
-        elif "blogcatalog6k" in dataset:
-            self.process_BlogCatalog6k(dataset, train_ratio=0.5)
+        if cache_dir is not None:
+            cache_path = get_cache_path(cache_dir, name=self.get_dataset_name(dataset),
+                                        key=get_cache_key(self.__class__.__name__, dataset.__class__.__name__,
+                                                          self.get_dataset_name(dataset),
+                                                          node_types=node_types, metapaths=metapaths,
+                                                          head_node_type=head_node_type, directed=directed,
+                                                          inductive=inductive))
+            state = load_state(cache_path)
         else:
-            raise Exception(f"Unsupported dataset {dataset}")
+            cache_path, state = None, None
+
+        if state is not None:
+            print(f"Loaded processed {self.get_dataset_name(dataset)} from {cache_path}")
+            self.__dict__.update(state)
+            if isinstance(dataset, HANDataset) or isinstance(dataset, GTNDataset):
+                self.data = dataset.data
+            if getattr(self, "_random_split", None) is not None:
+                # Random splits aren't cached, so each run draws its own as when processed without a cache
+                self.random_split(*self._random_split)
+        else:
+            init_attrs = dict(self.__dict__)
+            self.process_dataset(dataset, node_types=node_types, metapaths=metapaths, resample_train=resample_train)
+
+            # Only cache the attributes set by the process_* methods, except random splits
+            if cache_path is not None:
+                excluded = ["dataset", "data"]
+                if getattr(self, "_random_split", None) is not None:
+                    excluded.extend(["training_idx", "validation_idx", "testing_idx"])
+                save_state({name: value for name, value in self.__dict__.items() \
+                            if name not in excluded and \
+                            (name not in init_attrs or init_attrs[name] is not value)}, cache_path)
+                print(f"Saved processed {self.get_dataset_name(dataset)} to {cache_path}")
 
         if hasattr(self, "y_dict"):
             if self.y_dict[self.head_node_type].dim() > 1 and self.y_dict[self.head_node_type].size(-1) != 1:
@@ -172,6 +180,7 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
             print("WARNING: Dataset doesn't have node label (y_dict attribute).")
 
         assert hasattr(self, "num_nodes_dict")
+        self.batch_index_map = BatchIndexMap(self.num_nodes_dict)
 
         if not hasattr(self, "x_dict") or len(self.x_dict) == 0:
             self.x_dict = {}
@@ -182,6 +191,51 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
             print("train_ratio", self.get_train_ratio())
         self.train_ratio = self.get_train_ratio()
 
+    def process_dataset(self, dataset, node_types=None, metapaths=None, resample_train=None):
+        # PyTorchGeometric Dataset
+
+        if isinstance(dataset, PygNodePropPredDataset) and not hasattr(dataset[0], "edge_index_dict"):
+            print("PygNodePropPredDataset Homogenous (use HeteroNeighborSampler class)")
+            self.process_PygNodeDataset_homo(dataset)
+        elif isinstance(dataset, PygNodePropPredDataset) and hasattr(dataset[0], "edge_index_dict"):
+            print("PygNodePropPredDataset Hetero (use HeteroNeighborSampler class)")
+            self.process_PygNodeDataset_hetero(dataset)
+        elif isinstance(dataset, DglNodePropPredDataset):
+            print("DGLNodePropPredDataset Hetero")
+            self.process_DglNodeDataset_hetero(dataset)
+
+        elif isinstance(dataset, PygLinkPropPredDataset) and hasattr(dataset[0], "edge_reltype") and \
+                not hasattr(dataset[0], "edge_index_dict"):
+            print("PygLink_edge_reltype_dataset Hetero (use TripletSampler class)")
+            self.process_edge_reltype_dataset(dataset)
+        elif isinstance(dataset, PygLinkPropPredDataset) and hasattr(dataset[0], "edge_index_dict"):
+            print("PygLinkDataset Hetero (use TripletSampler class)")
+            self.process_PygLinkDataset_hetero(dataset)
+        elif isinstance(dataset, PygLinkPropPredDataset) and not hasattr(dataset[0], "edge_index_dict") \
+                and not hasattr(dataset[0], "edge_reltype"):
+            print("PygLinkDataset Homo (use EdgeSampler class)")
+            self.process_PygLinkDataset_homo(dataset)
+
+        elif isinstance(dataset, InMemoryDataset):
+            print("InMemoryDataset")
+            self.process_inmemorydataset(dataset, train_ratio=0.5)
+        elif isinstance(dataset, HANDataset) or isinstance(dataset, GTNDataset):
+            print(f"{dataset.__class__.__name__}")
+            self.process_COGDLdataset(dataset, metapaths, node_types, resample_train)
+        elif "blogcatalog6k" in dataset:
+            self.process_BlogCatalog6k(dataset, train_ratio=0.5)
+        else:
+            raise Exception(f"Unsupported dataset {dataset}")
+
+    @staticmethod
+    def get_dataset_name(dataset) -> str:
+        if hasattr(dataset, "name") and isinstance(dataset.name, str):
+            return dataset.name
+        elif isinstance(dataset, str):
+            return os.path.splitext(os.path.basename(dataset))[0]
+        else:
+            return dataset.__class__.__name__
+
     def name(self):
         if not hasattr(self, "_name"):
             return self.dataset.__class__.__name__
@@ -208,12 +262,60 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
         testing_idx = indices[int(num_indices * train_ratio):]
         return training_idx, validation_idx, testing_idx
 
+    def random_split(self, train_ratio, sample_indices=None):
+        """
+        Set the splits with `split_train_val_test()`, and keep its arguments so that the splits are redrawn instead of
+        being reused from the cache.
+        """
+        self._random_split = (train_ratio, sample_indices)
+        self.training_idx, self.validation_idx, self.testing_idx = \
+            self.split_train_val_test(train_ratio, sample_indices=sample_indices)
+
     def resample_training_idx(self, train_ratio):
         all_idx = torch.cat([self.training_idx, self.validation_idx, self.testing_idx])
         self.training_idx, self.validation_idx, self.testing_idx = \
             self.split_train_val_test(train_ratio=train_ratio, sample_indices=all_idx)
         print(f"Resampled training set at {self.get_train_ratio()}%")
 
+    def resample_splits(self, train_ratio: float, valid_ratio: float, seed=0, stratify=True, split_dir=None):
+        """
+        Deterministically re-split the `head_node_type` nodes of the current splits into disjoint train/valid/test
+        splits with `split_by_hash()`, stratified by class if `stratify` and the labels are not multilabel. The same
+        seed and ratios always give the same splits, regardless of the current splits' order.
+
+        :param train_ratio: fraction of the nodes in the training split
+        :param valid_ratio: fraction of the nodes in the validation split. The rest is the testing split.
+        :param seed: int
+        :param stratify: whether to keep the class proportions in each split
+        :param split_dir: default None. If given, the splits are saved as index arrays to a subdirectory keyed on the
+            dataset, seed and ratios, and are memory-mapped from there on later calls.
+        """
+        stratify = stratify and hasattr(self, "y_dict") and self.head_node_type in self.y_dict and \
+                   not getattr(self, "multilabel", False)
+        name = f"{self.name()}_{self.head_node_type}_seed{seed}_{train_ratio}_{valid_ratio}" + \
+               ("_stratified" if stratify else "")
+        path = os.path.join(os.path.expanduser(split_dir), name) if split_dir is not None else None
+
+        splits_dict = load_splits(path)[0] if path is not None else None
+        if splits_dict is None:
+            ids = torch.cat([self.training_idx, self.validation_idx, self.testing_idx]).unique()
+            strata = self.y_dict[self.head_node_type][ids].view(-1) if stratify else None
+            splits_dict = {self.head_node_type: split_by_hash(ids, seed=seed, train_ratio=train_ratio,
+                                                              valid_ratio=valid_ratio, strata=strata)}
+            if path is not None:
+                save_splits(path, splits_dict, seed=seed, train_ratio=train_ratio, valid_ratio=valid_ratio,
+                            stratify=stratify)
+
+        if hasattr(self, "training_subgraph_idx"):
+            # Keep the nodes outside of the splits in the inductive training subgraph
+            other_nodes = self.training_subgraph_idx[~isin_mask(self.training_subgraph_idx, self.training_idx)]
+            self.training_subgraph_idx = torch.cat([splits_dict[self.head_node_type]["train"], other_nodes]).unique()
+
+        self.training_idx, self.validation_idx, self.testing_idx = [splits_dict[self.head_node_type][split] \
+                                                                    for split in ["train", "valid", "test"]]
+        self.train_ratio = self.get_train_ratio()
+        print(f"Resampled splits with seed {seed} at {self.train_ratio} train ratio")
+
 
     def get_metapaths(self):
         if self.use_reverse:
@@ -289,7 +391,7 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
             ("tag", "tagnetwork", "tag"): self.sps_adj_to_edgeindex(data["tagnetwork"])}
         self.num_nodes_dict = self.get_num_nodes_dict(self.edge_index_dict)
         assert train_ratio is not None
-        self.training_idx, self.validation_idx, self.testing_idx = self.split_train_val_test(train_ratio)
+        self.random_split(train_ratio)
 
     def process_COGDLdataset(self, dataset: HANDataset, metapath, node_types, train_ratio):
         data = dataset.data
@@ -325,13 +427,12 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
         self.y_dict = new_y_dict
 
         if self.inductive:
-            other_nodes = torch.arange(self.num_nodes_dict[self.head_node_type])
-            idx = ~np.isin(other_nodes, self.training_idx) & \
-                  ~np.isin(other_nodes, self.validation_idx) & \
-                  ~np.isin(other_nodes, self.testing_idx)
-            other_nodes = other_nodes[idx]
+            num_nodes = self.num_nodes_dict[self.head_node_type]
+            labeled_nodes = torch.cat([self.training_idx, self.validation_idx, self.testing_idx])
+            labeled_mask = node_mask(labeled_nodes, num_nodes=max(num_nodes, int(labeled_nodes.max()) + 1))
+            other_nodes = (~labeled_mask[:num_nodes]).nonzero().view(-1)
             self.training_subgraph_idx = torch.cat(
-                [self.training_idx, torch.tensor(other_nodes, dtype=self.training_idx.dtype)],
+                [self.training_idx, other_nodes.to(self.training_idx.dtype)],
                 dim=0).unique()
 
         self.data = data
@@ -367,41 +468,106 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
 
         self.metapaths = list(self.edge_index_dict.keys())
         assert train_ratio is not None
-        self.training_idx, self.validation_idx, self.testing_idx = \
-            self.split_train_val_test(train_ratio,
-                                      sample_indices=self.y_index_dict[self.head_node_type])
+        self.random_split(train_ratio, sample_indices=self.y_index_dict[self.head_node_type])
 
-    def train_dataloader(self, collate_fn=None, batch_size=128, num_workers=12, **kwargs):
-        loader = data.DataLoader(self.training_idx, batch_size=batch_size,
-                                 shuffle=True, num_workers=num_workers,
-                                 collate_fn=collate_fn if callable(collate_fn) else self.get_collate_fn(collate_fn,
-                                                                                                        mode="train",
-                                                                                                        **kwargs))
+    def __getstate__(self):
+        """
+        The pickled state, e.g. of the collate function sent to DataLoader workers started with spawn. The source
+        dataset is left out, except for the HAN/GTN datasets whose `data` is used by the HAN collate functions. The
+        tensors memory-mapped from the dataset cache are pickled as references to their files, so that each worker maps
+        them again instead of receiving a copy in shared memory. In-place writes to those tensors after loading are not
+        carried over.
+        """
+        state = {name: to_mmap_refs(value) for name, value in self.__dict__.items()}
+        if not isinstance(getattr(self, "dataset", None), (HANDataset, GTNDataset)):
+            state.update(_name=self.name(), dataset=None, data=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update({name: from_mmap_refs(value) for name, value in state.items()})
+
+    def share_memory_(self):
+        """
+        Move the graph topology, node features, labels and sampler state tensors to shared memory, so that each
+        DataLoader worker attaches to the same storage instead of receiving a copy of the dataset. Called whenever a
+        dataloader with `num_workers > 0` is created, where tensors already in shared memory are left untouched. Workers
+        started with spawn receive the dataset pickled by `__getstate__()`.
+        """
+        for name, value in self.__dict__.items():
+            if name in ["dataset", "data"]: continue
+            share_memory(value)
+        return self
+
+    def to(self, device):
+        """
+        Move the graph topology, node features, labels, splits and sampler state tensors to `device`. If `device` is a
+        GPU, the dataloaders then sample, remap and collate each batch with tensor ops on the device in the main
+        process, so batches never leave the device and need no host-to-device copy. A NodeFeatureStore `x_dict` is
+        loaded in full to the device, so it must fit in the device memory.
+
+        :param device: a torch.device or str, e.g. "cuda:0"
+        """
+        device = torch.device(device)
+        for name, value in self.__dict__.items():
+            if name in ["dataset", "data"]: continue
+            if isinstance(value, NodeFeatureStore):
+                value = value.to_dict()
+            self.__dict__[name] = to_device(value, device)
+        self.device = device
+        return self
+
+    def get_dataloader(self, indices, collate_fn, mode, batch_size=128, num_workers=0, shuffle=True, pin_memory=None,
+                       prefetch_factor=2, persistent_workers=False, **kwargs):
+        """
+        A DataLoader over `indices` whose workers sample batches with `collate_fn`. With `num_workers > 0`, the dataset
+        is first moved to shared memory, and each worker keeps up to `prefetch_factor` ready batches in the DataLoader's
+        bounded queue. Batches are copied to pinned memory for asynchronous host-to-GPU transfers. If the dataset was
+        moved to a GPU with `to()`, batches are sampled on the device without workers.
+
+        :param indices: the node or edge indices to iterate over
+        :param collate_fn: a callable, or a collate function name for `get_collate_fn()`
+        :param mode: one of {"train", "validation", "testing"}
+        :param pin_memory: default None, which pins the batches if CUDA is available
+        :param prefetch_factor: number of batches prefetched by each worker
+        :param persistent_workers: whether to keep the workers alive between epochs
+        :param kwargs: passed to `get_collate_fn()`
+        """
+        if not callable(collate_fn):
+            collate_fn = self.get_collate_fn(collate_fn, mode=mode, **kwargs)
+
+        if getattr(self, "device", torch.device("cpu")).type != "cpu":
+            # Each batch of indices is gathered from `indices` on the device with a single index op, and collated in the
+            # main process, since the DataLoader workers can't share the device tensors.
+            sampler = data.RandomSampler(indices) if shuffle else data.SequentialSampler(indices)
+            return data.DataLoader(indices, batch_size=None, num_workers=0, collate_fn=collate_fn,
+                                   sampler=data.BatchSampler(sampler, batch_size=batch_size, drop_last=False))
+
+        loader_kwargs = {}
+        if num_workers > 0:
+            self.share_memory_()
+            loader_kwargs.update(prefetch_factor=prefetch_factor, persistent_workers=persistent_workers)
+
+        loader = data.DataLoader(indices, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+                                 collate_fn=collate_fn,
+                                 pin_memory=torch.cuda.is_available() if pin_memory is None else pin_memory,
+                                 **loader_kwargs)
         return loader
 
+    def train_dataloader(self, collate_fn=None, batch_size=128, num_workers=12, **kwargs):
+        return self.get_dataloader(self.training_idx, collate_fn, mode="train", batch_size=batch_size,
+                                   num_workers=num_workers, **kwargs)
+
     def valtrain_dataloader(self, collate_fn=None, batch_size=128, num_workers=12, **kwargs):
-        loader = data.DataLoader(torch.cat([self.training_idx, self.validation_idx]), batch_size=batch_size,
-                                 shuffle=True, num_workers=num_workers,
-                                 collate_fn=collate_fn if callable(collate_fn) else self.get_collate_fn(collate_fn,
-                                                                                                        mode="validation",
-                                                                                                        **kwargs))
-        return loader
+        return self.get_dataloader(torch.cat([self.training_idx, self.validation_idx]), collate_fn, mode="validation",
+                                   batch_size=batch_size, num_workers=num_workers, **kwargs)
 
     def valid_dataloader(self, collate_fn=None, batch_size=128, num_workers=4, **kwargs):
-        loader = data.DataLoader(self.validation_idx, batch_size=batch_size,
-                                 shuffle=True, num_workers=num_workers,
-                                 collate_fn=collate_fn if callable(collate_fn) else self.get_collate_fn(collate_fn,
-                                                                                                        mode="validation",
-                                                                                                        **kwargs))
-        return loader
+        return self.get_dataloader(self.validation_idx, collate_fn, mode="validation", batch_size=batch_size,
+                                   num_workers=num_workers, **kwargs)
 
     def test_dataloader(self, collate_fn=None, batch_size=128, num_workers=4, **kwargs):
-        loader = data.DataLoader(self.testing_idx, batch_size=batch_size,
-                                 shuffle=True, num_workers=num_workers,
-                                 collate_fn=collate_fn if callable(collate_fn) else self.get_collate_fn(collate_fn,
-                                                                                                        mode="testing",
-                                                                                                        **kwargs))
-        return loader
+        return self.get_dataloader(self.testing_idx, collate_fn, mode="testing", batch_size=batch_size,
+                                   num_workers=num_workers, **kwargs)
 
     def get_collate_fn(self, collate_fn: str, mode=None, **kwargs):
 
@@ -418,18 +584,28 @@ class HeteroNetDataset(torch.utils.data.Dataset, Network):
     def filter_edge_index(self, input, allowed_nodes):
         if isinstance(input, tuple):
             edge_index = input[0]
-            values = edge_index[1]
+            values = input[1]
         else:
             edge_index = input
             values = None
 
-        mask = np.isin(edge_index[0], allowed_nodes) & np.isin(edge_index[1], allowed_nodes)
-        edge_index = edge_index[:, mask]
-
-        if values == None:
+        allowed_nodes = torch.as_tensor(allowed_nodes, dtype=torch.long)
+        if edge_index.numel() == 0 or allowed_nodes.numel() == 0:
+            edge_index, edge_id = edge_index[:, :0], torch.empty(0, dtype=torch.long, device=edge_index.device)
+        else:
+            # The edges are between head_node_type nodes
+            metapath = (self.head_node_type, self.head_node_type)
+            num_nodes = int(max(edge_index.max(), allowed_nodes.max())) + 1
+            edge_index_dict, edge_id_dict = induced_subgraph({metapath: edge_index},
+                                                             nodes_dict={self.head_node_type: allowed_nodes},
+                                                             num_nodes_dict={self.head_node_type: num_nodes},
+                                                             relabel=False)
+            edge_index, edge_id = edge_index_dict[metapath], edge_id_dict[metapath]
+
+        if values is None:
             values = torch.ones(edge_index.size(1))
         else:
-            values = values[mask]
+            values = values[edge_id]
 
         return (edge_index, values)
 
@@ -9,11 +9,12 @@ from tensorflow import keras
 
 from moge.generator.sequences import SequenceTokenizer, SEQUENCE_COL
 # import moge
+from moge.network.base import NodeIndexMixin
 from moge.network.multi_digraph import MultiDigraphNetwork
 from moge.network.hetero import HeteroNetwork
 
 
-class DataGenerator(keras.utils.Sequence, SequenceTokenizer):
+class DataGenerator(NodeIndexMixin, keras.utils.Sequence, SequenceTokenizer):
     def __init__(self, network, variables=None, targets=None, method="GAT", adj_output="dense", sparse_target=False,
                  weighted=False, batch_size=1, replace=True, seed=0,
                  verbose=True, **kwargs):
@@ -221,8 +221,8 @@ class PairsGenerator(DataGenerator):
 
         if return_sequence_data:
             X_seq = {}
-            X[:, 0] = [self.node_list.index(node) for node in X[:, 0].tolist()]
-            X[:, 1] = [self.node_list.index(node) for node in X[:, 1].tolist()]
+            X[:, 0] = self.node_index.get_index(X[:, 0])
+            X[:, 1] = self.node_index.get_index(X[:, 1])
             X_seq["input_seq_i"] = self.get_sequence_encodings(
                 [self.node_list[node_id] for node_id in X[:, 0].tolist()],
                 variable_length=False)
@@ -249,8 +249,8 @@ class PairsGenerator(DataGenerator):
         self.Ens_rows_all, self.Ens_cols_all = np.where(adj_positive.todense() == 0)
 
         # Filter by nodes list
-        node_A_ind = [self.node_list.index(node) for node in self.node_list if node in node_list_A]
-        node_B_ind = [self.node_list.index(node) for node in self.node_list if node in node_list_B]
+        node_A_ind = self.node_index.get_index([node for node in node_list_A if node in self.node_index])
+        node_B_ind = self.node_index.get_index([node for node in node_list_B if node in self.node_index])
         filter_indices = np.where(np.isin(self.Ens_rows_all, node_A_ind) & np.isin(self.Ens_cols_all, node_B_ind))
 
         self.Ens_rows_all = self.Ens_rows_all[filter_indices]
@@ -402,7 +402,7 @@ class SampledPairsGenerator(PairsGenerator):
         return edge_type
 
     def get_negative_sampled_edges(self, node_u):
-        node_idx = self.node_list.index(node_u)
+        node_idx = self.node_index.index[node_u]
         _, col = self.adj_negative_sampled[node_idx].nonzero()
         node_v = self.node_list[np.random.choice(col)]
         return (node_u, node_v, DIRECTED_NEG_EDGE)
@@ -413,19 +413,19 @@ class SampledPairsGenerator(PairsGenerator):
         for u, v, type in sampled_edges:
             if type == DIRECTED_EDGE:
                 X_list.append((u, v, IS_DIRECTED,
-                               self.get_edge_weight(self.node_list.index(u), self.node_list.index(v),
+                               self.get_edge_weight(self.node_index.index[u], self.node_index.index[v],
                                                     type, True, weighted=self.weighted)))
             elif type == UNDIRECTED_EDGE:
                 X_list.append((u, v, IS_UNDIRECTED,
-                               self.get_edge_weight(self.node_list.index(u), self.node_list.index(v),
+                               self.get_edge_weight(self.node_index.index[u], self.node_index.index[v],
                                                     type, True, weighted=self.weighted)))
             elif type == UNDIRECTED_NEG_EDGE:
                 X_list.append((u, v, IS_UNDIRECTED,
-                               self.get_edge_weight(self.node_list.index(u), self.node_list.index(v),
+                               self.get_edge_weight(self.node_index.index[u], self.node_index.index[v],
                                                     type, False, weighted=self.weighted)))
             elif type == DIRECTED_NEG_EDGE:
                 X_list.append((u, v, IS_DIRECTED,
-                               self.get_edge_weight(self.node_list.index(u), self.node_list.index(v),
+                               self.get_edge_weight(self.node_index.index[u], self.node_index.index[v],
                                                     type, False, weighted=self.weighted)))
             else:
                 raise Exception("Edge type is wrong:" + u + v + type)
@@ -138,7 +138,7 @@ class OnlineTripletGenerator(SampledDataGenerator):
         X["labels_directed"] = sampled_directed_adj
         X["labels_undirected"] = self.network.get_adjacency_matrix(edge_types=["u", "u_n"], node_list=sampled_nodes)
 
-        y = np.asarray([self.node_list.index(node) for node in sampled_nodes], dtype=np.int)
+        y = self.node_index.get_index(sampled_nodes)
         if return_node_name: y = np.asarray(sampled_nodes, dtype="O")
 
         return X, y
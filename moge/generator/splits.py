@@ -0,0 +1,128 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+SPLITS_VERSION = 2
+SPLITS = ["train", "valid", "test"]
+
+
+def _signed(value: int) -> int:
+    # Unsigned 64-bit constant to the int64 with the same bits
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+GOLDEN_GAMMA = _signed(0x9E3779B97F4A7C15)
+MIX_1 = _signed(0xBF58476D1CE4E5B9)
+MIX_2 = _signed(0x94D049BB133111EB)
+
+
+def _shift_right(x: torch.Tensor, bits: int) -> torch.Tensor:
+    # Logical right shift of int64, since `>>` is arithmetic
+    return (x >> bits) & ((1 << (64 - bits)) - 1)
+
+
+def hash_uniform(ids: torch.Tensor, seed: int, chunk_size=2 ** 22) -> torch.Tensor:
+    """
+    Deterministic uniform numbers in [0, 1) for each id, from the splitmix64 hash of (id, seed). The number of an id
+    doesn't depend on the other ids, so it's the same for any ordering or subset of the ids, and the ids are hashed in
+    chunks without allocating temporaries of the full size.
+
+    :param ids: 1-D integer tensor of ids
+    :param seed: int
+    :return: float64 tensor of the same size as `ids`
+    """
+    ids = torch.as_tensor(ids, dtype=torch.long)
+    output = torch.empty(ids.size(0), dtype=torch.float64, device=ids.device)
+    offset = _signed(((seed + 1) * 0x9E3779B97F4A7C15) % (1 << 64))
+
+    for start in range(0, ids.size(0), chunk_size):
+        z = ids[start: start + chunk_size] * GOLDEN_GAMMA + offset
+        z = (z ^ _shift_right(z, 30)) * MIX_1
+        z = (z ^ _shift_right(z, 27)) * MIX_2
+        z = z ^ _shift_right(z, 31)
+        output[start: start + chunk_size] = _shift_right(z, 11).to(torch.float64) / float(1 << 53)
+    return output
+
+
+def split_by_hash(ids: torch.Tensor, seed: int, train_ratio: float, valid_ratio: float, strata: torch.Tensor = None):
+    """
+    Deterministic train/valid/test split of `ids` from `seed`. Within each stratum, the ids are ordered by
+    `hash_uniform()` and cut at the ratios, so each split has the stratum's proportions up to rounding, and the splits
+    of a seed are reproduced exactly without storing a permutation.
+
+    :param ids: 1-D tensor of ids to split, e.g. the labeled nodes of a node type
+    :param seed: int
+    :param train_ratio: fraction of each stratum in the training split
+    :param valid_ratio: fraction of each stratum in the validation split. The rest is the testing split.
+    :param strata: default None. A 1-D tensor of the same size as `ids` with the stratum (e.g. class) of each id.
+    :return: Dict of <split>:<sorted 1-D tensor of ids> for the splits {"train", "valid", "test"}
+    """
+    assert 0 <= train_ratio and 0 <= valid_ratio and train_ratio + valid_ratio <= 1, "Invalid split ratios"
+    ids = torch.as_tensor(ids, dtype=torch.long)
+    u = hash_uniform(ids, seed)
+
+    if strata is None:
+        strata = torch.zeros_like(ids)
+    # Order by stratum, then by hash within each stratum
+    order = torch.argsort(u)
+    order = order[torch.sort(torch.as_tensor(strata)[order], stable=True).indices]
+    _, counts = torch.unique_consecutive(torch.as_tensor(strata)[order], return_counts=True)
+
+    splits = {split: [] for split in SPLITS}
+    start = 0
+    for count in counts.tolist():
+        n_train, n_valid = int(count * train_ratio), int(count * valid_ratio)
+        splits["train"].append(order[start: start + n_train])
+        splits["valid"].append(order[start + n_train: start + n_train + n_valid])
+        splits["test"].append(order[start + n_train + n_valid: start + count])
+        start += count
+
+    return {split: ids[torch.cat(positions)].sort().values for split, positions in splits.items()}
+
+
+def save_splits(path: str, splits_dict: dict, **metadata):
+    """
+    Save the splits of each node type as int64 .npy index arrays, which `load_splits()` memory-maps as index tensors
+    without a conversion, and a `meta.json` with `metadata` (e.g. the seed and ratios).
+
+    :param splits_dict: Dict of <node_type>:<Dict of <split>:<1-D tensor of ids>>
+    """
+    os.makedirs(path, exist_ok=True)
+    for node_type, splits in splits_dict.items():
+        for split, idx in splits.items():
+            idx = idx.cpu().numpy() if isinstance(idx, torch.Tensor) else np.asarray(idx)
+            np.save(os.path.join(path, f"{node_type}.{split}.npy"), idx.astype(np.int64))
+
+    tmp_file = os.path.join(path, "meta.json.tmp")
+    with open(tmp_file, "w") as file:
+        json.dump({"version": SPLITS_VERSION, "node_types": list(splits_dict.keys()), **metadata}, file)
+    os.replace(tmp_file, os.path.join(path, "meta.json"))
+
+
+def _load_index(file: str, mmap: bool) -> torch.Tensor:
+    # Copy-on-write memory-map, so the tensor is writable without modifying the file
+    tensor = torch.from_numpy(np.load(file, mmap_mode="c" if mmap else None))
+    if mmap:
+        tensor.mmap_file = file
+    return tensor
+
+
+def load_splits(path: str, mmap=True):
+    """
+    Load splits saved with `save_splits()`. If `mmap`, the index tensors are memory-mapped copy-on-write, so they are
+    only read from disk when accessed, and are tagged like the tensors of `load_state()` (see `cache.is_mmap()`).
+
+    :return: splits_dict, metadata, or None, None if there are no splits at `path`
+    """
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None, None
+    with open(os.path.join(path, "meta.json"), "r") as file:
+        metadata = json.load(file)
+    if metadata.get("version", None) != SPLITS_VERSION:
+        return None, None
+
+    splits_dict = {node_type: {split: _load_index(os.path.join(path, f"{node_type}.{split}.npy"), mmap) \
+                               for split in SPLITS} for node_type in metadata["node_types"]}
+    return splits_dict, metadata
@@ -0,0 +1,175 @@
+import torch
+from ogb.linkproppred import PygLinkPropPredDataset
+from ogb.nodeproppred import PygNodePropPredDataset
+from torch_geometric.data import Data
+
+
+def get_synthetic_metapaths(node_types: list) -> list:
+    """
+    A metapath between each consecutive pair of node types, and a self-relation of the first node type.
+    """
+    metapaths = [(node_types[0], "cites", node_types[0])]
+    for head_type, tail_type in zip(node_types[:-1], node_types[1:]):
+        metapaths.append((head_type, f"{head_type}_{tail_type}", tail_type))
+    return metapaths
+
+
+def generate_edge_index_dict(num_nodes_dict: dict, metapaths: list, avg_degree: float, generator: torch.Generator):
+    """
+    Random edges for each metapath with a power-law-like head degree distribution, so that the neighbor sampling and
+    metapath joins see hub nodes like in real heterogeneous networks.
+
+    :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+    :param metapaths: list of (head_type, relation, tail_type)
+    :param avg_degree: average number of edges per head node for each metapath
+    :return: Dict of <metapath>:<tensor size (2, num_edges)>, with unique edges
+    """
+    edge_index_dict = {}
+    for metapath in metapaths:
+        head_type, tail_type = metapath[0], metapath[-1]
+        num_edges = int(num_nodes_dict[head_type] * avg_degree)
+
+        head_weights = torch.rand(num_nodes_dict[head_type], generator=generator).pow(4)
+        heads = torch.multinomial(head_weights, num_edges, replacement=True, generator=generator)
+        tails = torch.randint(0, num_nodes_dict[tail_type], (num_edges,), generator=generator)
+
+        edge_index = torch.stack([heads, tails], dim=0)
+        edge_index_dict[metapath] = torch.unique(edge_index, dim=1)
+    return edge_index_dict
+
+
+def split_indices(num: int, generator: torch.Generator, train_ratio=0.8, valid_ratio=0.1):
+    perm = torch.randperm(num, generator=generator)
+    n_train, n_valid = int(num * train_ratio), int(num * valid_ratio)
+    return perm[:n_train], perm[n_train: n_train + n_valid], perm[n_train + n_valid:]
+
+
+class SyntheticNodeDataset(PygNodePropPredDataset):
+    def __init__(self, num_nodes_dict: dict, metapaths: list = None, avg_degree=10.0, in_channels: int = None,
+                 n_classes=10, seed=0):
+        """
+        A synthetic heterogeneous node classification dataset with the interface of an ogbn hetero dataset (e.g.
+        ogbn-mag), for benchmarking the samplers and models without downloading data. Labels are on the first node
+        type.
+
+        :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+        :param metapaths: list of (head_type, relation, tail_type). Default `get_synthetic_metapaths()`.
+        :param avg_degree: average number of edges per head node for each metapath
+        :param in_channels: If given, all node types have random features of this size.
+        :param n_classes: number of classes of the head node type
+        :param seed: random seed
+        """
+        generator = torch.Generator().manual_seed(seed)
+        node_types = list(num_nodes_dict.keys())
+        head_node_type = node_types[0]
+        if metapaths is None:
+            metapaths = get_synthetic_metapaths(node_types)
+
+        self.name = f"synthetic-node-{'-'.join(str(n) for n in num_nodes_dict.values())}-{seed}"
+        self.data = Data(edge_index_dict=generate_edge_index_dict(num_nodes_dict, metapaths, avg_degree, generator),
+                         num_nodes_dict=num_nodes_dict,
+                         y_dict={head_node_type: torch.randint(0, n_classes, (num_nodes_dict[head_node_type], 1),
+                                                               generator=generator)})
+        if in_channels is not None:
+            self.data.x_dict = {node_type: torch.randn(num_nodes, in_channels, generator=generator) \
+                                for node_type, num_nodes in num_nodes_dict.items()}
+
+        train, valid, test = split_indices(num_nodes_dict[head_node_type], generator)
+        self.split_idx = {"train": {head_node_type: train}, "valid": {head_node_type: valid},
+                          "test": {head_node_type: test}}
+
+    def __getitem__(self, idx):
+        return self.data
+
+    def __len__(self):
+        return 1
+
+    def get_idx_split(self):
+        return self.split_idx
+
+
+class SyntheticTripletDataset(PygLinkPropPredDataset):
+    def __init__(self, num_nodes_dict: dict, metapaths: list = None, avg_degree=10.0, num_neg=32, seed=0):
+        """
+        A synthetic heterogeneous link prediction dataset with the interface of ogbl-biokg, whose edge split contains
+        (head, relation, tail) triples with `num_neg` sampled head_neg and tail_neg for the valid and test triples.
+
+        :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+        :param metapaths: list of (head_type, relation, tail_type). Default `get_synthetic_metapaths()`.
+        :param avg_degree: average number of edges per head node for each metapath
+        :param num_neg: number of negative heads and tails per valid/test triple
+        :param seed: random seed
+        """
+        generator = torch.Generator().manual_seed(seed)
+        if metapaths is None:
+            metapaths = get_synthetic_metapaths(list(num_nodes_dict.keys()))
+
+        edge_index_dict = generate_edge_index_dict(num_nodes_dict, metapaths, avg_degree, generator)
+        self.name = f"synthetic-triplet-{'-'.join(str(n) for n in num_nodes_dict.values())}-{seed}"
+        self.data = Data(edge_index_dict=edge_index_dict, num_nodes_dict=num_nodes_dict)
+
+        self.split_edge = {"train": {}, "valid": {}, "test": {}}
+        for relation_id, (metapath, edge_index) in enumerate(edge_index_dict.items()):
+            head_type, tail_type = metapath[0], metapath[-1]
+            for split, idx in zip(["train", "valid", "test"], split_indices(edge_index.size(1), generator)):
+                triples = self.split_edge[split]
+                triples.setdefault("head_type", []).extend([head_type] * idx.numel())
+                triples.setdefault("tail_type", []).extend([tail_type] * idx.numel())
+                triples.setdefault("head", []).append(edge_index[0, idx])
+                triples.setdefault("tail", []).append(edge_index[1, idx])
+                triples.setdefault("relation", []).append(torch.full((idx.numel(),), relation_id, dtype=torch.long))
+                if split != "train":
+                    triples.setdefault("head_neg", []).append(
+                        torch.randint(0, num_nodes_dict[head_type], (idx.numel(), num_neg), generator=generator))
+                    triples.setdefault("tail_neg", []).append(
+                        torch.randint(0, num_nodes_dict[tail_type], (idx.numel(), num_neg), generator=generator))
+
+        for triples in self.split_edge.values():
+            for key, values in triples.items():
+                if isinstance(values[0], torch.Tensor):
+                    triples[key] = torch.cat(values, dim=0)
+
+    def __getitem__(self, idx):
+        return self.data
+
+    def __len__(self):
+        return 1
+
+    def get_edge_split(self):
+        return self.split_edge
+
+
+class SyntheticEdgeDataset(PygLinkPropPredDataset):
+    def __init__(self, num_nodes: int, avg_degree=10.0, in_channels: int = None, seed=0):
+        """
+        A synthetic homogeneous link prediction dataset with the interface of ogbl-collab/ogbl-ddi, whose edge split
+        contains "edge" pairs and "edge_neg" pairs for the valid and test sets.
+
+        :param num_nodes: number of nodes
+        :param avg_degree: average number of edges per node
+        :param in_channels: If given, nodes have random features of this size.
+        :param seed: random seed
+        """
+        generator = torch.Generator().manual_seed(seed)
+        metapath = ("entity", "default", "entity")
+        edge_index = generate_edge_index_dict({"entity": num_nodes}, [metapath], avg_degree, generator)[metapath]
+
+        self.name = f"synthetic-edge-{num_nodes}-{seed}"
+        self.data = Data(edge_index=edge_index)
+        if in_channels is not None:
+            self.data.x = torch.randn(num_nodes, in_channels, generator=generator)
+
+        self.split_edge = {}
+        for split, idx in zip(["train", "valid", "test"], split_indices(edge_index.size(1), generator)):
+            self.split_edge[split] = {"edge": edge_index[:, idx].t()}
+            if split != "train":
+                self.split_edge[split]["edge_neg"] = torch.randint(0, num_nodes, (idx.numel(), 2), generator=generator)
+
+    def __getitem__(self, idx):
+        return self.data
+
+    def __len__(self):
+        return 1
+
+    def get_edge_split(self):
+        return self.split_edge
@@ -1,3 +1,246 @@
+import torch
+from torch_sparse import SparseTensor
 
+from moge.generator.cache import is_mmap
 
 
+class BatchIndexMap:
+    def __init__(self, num_nodes_dict: dict):
+        """
+        Reusable per-node-type lookup tensors that convert node ids into their batch index, i.e. the position in the
+        batch's `global_node_index[node_type]` which aligns with `x_dict[node_type]`. The lookup tensor of each node type
+        is allocated once and reset after each remapping, so every call costs O(batch_size) tensor ops instead of a
+        Python call per element.
+
+        :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+        """
+        self.num_nodes_dict = num_nodes_dict
+        self.lookup_dict = {}
+
+    def get_lookup(self, node_type, min_size: int, device=None) -> torch.Tensor:
+        lookup = self.lookup_dict.get(node_type, None)
+        if lookup is None or lookup.numel() < min_size or lookup.device != device:
+            num_nodes = max(self.num_nodes_dict.get(node_type, 0), min_size)
+            lookup = torch.full((num_nodes,), -1, dtype=torch.long, device=device)
+            self.lookup_dict[node_type] = lookup
+        return lookup
+
+    def remap(self, index: torch.Tensor, batch_nodes: torch.Tensor, node_type) -> torch.Tensor:
+        """
+        :param index: Tensor of node ids of `node_type`, of any shape
+        :param batch_nodes: 1-D tensor of unique node ids of `node_type` sampled in the batch
+        :param node_type: the node type of both `index` and `batch_nodes`
+        :return: a tensor of the same shape as `index`, with -1 for ids not contained in `batch_nodes`
+        """
+        if index.numel() == 0:
+            return index.clone()
+
+        min_size = int(max(batch_nodes.max(), index.max())) + 1 if batch_nodes.numel() > 0 else int(index.max()) + 1
+        lookup = self.get_lookup(node_type, min_size=min_size, device=index.device)
+
+        lookup[batch_nodes] = torch.arange(batch_nodes.size(0), dtype=torch.long, device=index.device)
+        batch_index = lookup[index]
+        lookup[batch_nodes] = -1
+        return batch_index
+
+
+def sample_csr_neighbors(rowptr: torch.Tensor, col: torch.Tensor, nodes: torch.Tensor, num_neighbors: int):
+    """
+    Sample up to `num_neighbors` neighbors of each node in `nodes` from a CSR adjacency. Nodes with a degree of at most
+    `num_neighbors` keep all of their neighbors, while higher degree nodes draw `num_neighbors` neighbors with
+    replacement, deduplicated. All steps are tensor ops on the device of `nodes`.
+
+    :param rowptr: CSR row pointers of size (num_rows + 1,)
+    :param col: CSR column indices
+    :param nodes: 1-D tensor of row indices to sample from
+    :param num_neighbors: fanout per node, where -1 keeps all neighbors
+    :return: heads, tails: 1-D tensors of the sampled edges' row and column indices
+    """
+    deg = rowptr[nodes + 1] - rowptr[nodes]
+    full = deg <= num_neighbors if num_neighbors >= 0 else torch.ones_like(deg, dtype=torch.bool)
+
+    # All neighbors of low degree nodes
+    full_nodes, full_deg = nodes[full], deg[full]
+    starts = rowptr[full_nodes].repeat_interleave(full_deg)
+    offsets = torch.arange(starts.numel(), device=nodes.device) - \
+              (torch.cumsum(full_deg, dim=0) - full_deg).repeat_interleave(full_deg)
+    pos = starts + offsets
+
+    # Sampled neighbors of high degree nodes
+    part_nodes, part_deg = nodes[~full], deg[~full]
+    if part_nodes.numel() > 0:
+        rand = torch.rand((part_nodes.numel(), num_neighbors), device=nodes.device)
+        part_pos = rowptr[part_nodes].unsqueeze(1) + (rand * part_deg.unsqueeze(1)).to(torch.long)
+        pos = torch.cat([pos, part_pos.view(-1).unique()], dim=0)
+
+    heads = torch.searchsorted(rowptr, pos, right=True) - 1
+    return heads, col[pos]
+
+
+def share_memory(value):
+    """
+    Move the tensors in `value`, also when nested in dicts, lists and tuples, to shared memory in-place, so that
+    DataLoader workers attach to the same storage instead of each holding a copy. Other objects with a
+    `share_memory_()` method (e.g. torch_sparse.SparseTensor) are shared too, while numpy arrays are left as is. Tensors
+    memory-mapped from the dataset cache are also left as is, since workers already share their pages through the file
+    and `share_memory_()` would copy them to shared memory.
+
+    :return: value
+    """
+    if isinstance(value, torch.Tensor):
+        if not is_mmap(value):
+            value.share_memory_()
+    elif isinstance(value, dict):
+        for v in value.values():
+            share_memory(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            share_memory(v)
+    elif callable(getattr(value, "share_memory_", None)):
+        value.share_memory_()
+    return value
+
+
+def node_mask(nodes: torch.Tensor, num_nodes: int, device=None) -> torch.Tensor:
+    """
+    A boolean mask of size `num_nodes` which is True at the ids in `nodes`, for O(1) membership tests by indexing.
+
+    :param nodes: 1-D tensor of node ids
+    :param num_nodes: size of the mask, must be larger than the largest id in `nodes`
+    :param device: default the device of `nodes`
+    """
+    nodes = torch.as_tensor(nodes, dtype=torch.long)
+    mask = torch.zeros(num_nodes, dtype=torch.bool, device=nodes.device if device is None else device)
+    mask[nodes.to(mask.device)] = True
+    return mask
+
+
+def isin_mask(input: torch.Tensor, nodes: torch.Tensor, num_nodes: int = None) -> torch.Tensor:
+    """
+    Element-wise membership test of `input` in `nodes` by gathering from a `node_mask()`, on the device of `input`.
+    Replaces `np.isin()` without copying the tensors to numpy.
+
+    :param num_nodes: default the largest id in `input` and `nodes` + 1
+    :return: a bool tensor of the same shape as `input`
+    """
+    input, nodes = torch.as_tensor(input), torch.as_tensor(nodes, device=input.device)
+    if input.numel() == 0 or nodes.numel() == 0:
+        return torch.zeros_like(input, dtype=torch.bool)
+    if num_nodes is None:
+        num_nodes = int(max(input.max(), nodes.max())) + 1
+    return node_mask(nodes, num_nodes)[input]
+
+
+def induced_subgraph(edge_index_dict: dict, nodes_dict: dict, num_nodes_dict: dict, relabel=True):
+    """
+    The edges of every metapath whose head and tail nodes are both in `nodes_dict`, with one mask gather per edge. All
+    ops run on the device of the edge indices.
+
+    :param edge_index_dict: Dict of <metapath>:<tensor size (2, num_edges)>
+    :param nodes_dict: Dict of <node_type>:<1-D tensor of node ids to keep>. Node types not in `nodes_dict` are not
+        filtered, and keep their original ids.
+    :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+    :param relabel: If True, node ids of the node types in `nodes_dict` are relabeled to their position in
+        `nodes_dict[node_type]`.
+    :return: edge_index_dict, edge_id_dict: the induced edge_index of each metapath, and the indices of its edges in
+        the original edge_index
+    """
+    masks, relabel_maps = {}, {}
+    for node_type, nodes in nodes_dict.items():
+        nodes = torch.as_tensor(nodes, dtype=torch.long)
+        masks[node_type] = node_mask(nodes, num_nodes_dict[node_type])
+        if relabel:
+            relabel_maps[node_type] = torch.full((num_nodes_dict[node_type],), -1, dtype=torch.long,
+                                                 device=nodes.device)
+            relabel_maps[node_type][nodes] = torch.arange(nodes.numel(), device=nodes.device)
+
+    new_edge_index_dict, edge_id_dict = {}, {}
+    for metapath, edge_index in edge_index_dict.items():
+        head_type, tail_type = metapath[0], metapath[-1]
+        mask = torch.ones(edge_index.size(1), dtype=torch.bool, device=edge_index.device)
+        if head_type in masks:
+            mask &= masks[head_type].to(edge_index.device)[edge_index[0]]
+        if tail_type in masks:
+            mask &= masks[tail_type].to(edge_index.device)[edge_index[1]]
+
+        edge_id = mask.nonzero().view(-1)
+        edge_index = edge_index[:, edge_id]
+        if relabel and (head_type in relabel_maps or tail_type in relabel_maps):
+            if head_type in relabel_maps:
+                edge_index[0] = relabel_maps[head_type].to(edge_index.device)[edge_index[0]]
+            if tail_type in relabel_maps:
+                edge_index[1] = relabel_maps[tail_type].to(edge_index.device)[edge_index[1]]
+
+        new_edge_index_dict[metapath] = edge_index
+        edge_id_dict[metapath] = edge_id
+    return new_edge_index_dict, edge_id_dict
+
+
+def unique_rows(rows: torch.Tensor, return_index=False, return_inverse=False, return_counts=False):
+    """
+    Unique rows of an integer tensor, e.g. edges (head, tail) or triples (head, relation, tail), in the lexicographic
+    order of `torch.unique(rows, dim=0)`. Each row is packed into a single int64 key with a mixed radix of the column
+    sizes, so the rows are deduplicated with a 1-D `torch.unique` on the device of `rows`. Falls back to
+    `torch.unique(rows, dim=0)` if the keys would overflow int64.
+
+    :param rows: integer tensor of shape (num_rows, num_columns), with non-negative values
+    :param return_index: whether to also return the index of the first occurrence of each unique row in `rows`
+    :param return_inverse: whether to also return the index of each row of `rows` in the unique rows
+    :param return_counts: whether to also return the number of occurrences of each unique row
+    :return: unique, (index), (inverse), (counts)
+    """
+    if rows.size(0) == 0:
+        empty = torch.empty(0, dtype=torch.long, device=rows.device)
+        outputs = [rows] + [empty for flag in [return_index, return_inverse, return_counts] if flag]
+        return tuple(outputs) if len(outputs) > 1 else rows
+
+    sizes = rows.max(0).values.to(torch.long) + 1
+    if float(torch.prod(sizes.to(torch.float64))) < 2 ** 63:
+        radix = torch.ones_like(sizes)
+        radix[:-1] = torch.flip(torch.cumprod(torch.flip(sizes[1:], dims=[0]), dim=0), dims=[0])
+        keys = (rows.to(torch.long) * radix).sum(1)
+        unique_keys, inverse, counts = torch.unique(keys, return_inverse=True, return_counts=True)
+        unique = torch.stack([(unique_keys // radix[i]) % sizes[i] for i in range(rows.size(1))], dim=1).to(rows.dtype)
+    else:
+        unique, inverse, counts = torch.unique(rows, dim=0, return_inverse=True, return_counts=True)
+
+    outputs = [unique]
+    if return_index:
+        index = torch.full((unique.size(0),), rows.size(0), dtype=torch.long, device=rows.device)
+        outputs.append(index.scatter_reduce_(0, inverse, torch.arange(rows.size(0), device=rows.device),
+                                             reduce="amin"))
+    if return_inverse:
+        outputs.append(inverse)
+    if return_counts:
+        outputs.append(counts)
+    return tuple(outputs) if len(outputs) > 1 else unique
+
+
+def nonduplicate_mask(rows: torch.Tensor) -> torch.Tensor:
+    """
+    A boolean mask over `rows` which is True at the first occurrence of each unique row, i.e. the torch equivalent of
+    `~pd.DataFrame(rows).duplicated()`.
+    """
+    mask = torch.zeros(rows.size(0), dtype=torch.bool, device=rows.device)
+    if rows.size(0) > 0:
+        _, index = unique_rows(rows, return_index=True)
+        mask[index] = True
+    return mask
+
+
+def to_device(value, device):
+    """
+    Move the tensors in `value`, also when nested in dicts, lists and tuples, to `device`. Other objects with a `to()`
+    method taking a device (e.g. torch_sparse.SparseTensor) are moved too, while numpy arrays are left as is.
+
+    :return: a copy of the containers in `value` with the moved tensors
+    """
+    if isinstance(value, torch.Tensor):
+        return value.to(device)
+    elif isinstance(value, dict):
+        return value.__class__((k, to_device(v, device)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return value.__class__(to_device(v, device) for v in value)
+    elif isinstance(value, SparseTensor):
+        return value.to(device)
+    return value
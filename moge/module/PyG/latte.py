@@ -1,11 +1,12 @@
 import copy
+import os
+
 import numpy as np
 import pandas as pd
 import torch
 from torch import nn as nn
 
 import torch.nn.functional as F
-from torch_geometric.nn import MessagePassing
 from torch_geometric.nn.inits import glorot
 from torch_geometric.utils import softmax
 import torch_sparse
@@ -13,13 +14,15 @@ from torch_sparse.tensor import SparseTensor
 from torch_sparse.matmul import matmul
 import pytorch_lightning as pl
 
+from moge.module.embedding import HybridEmbedding
+from moge.module.recorder import RelationWeightRecorder
 from moge.module.sampling import negative_sample, negative_sample_head_tail
 from moge.module.utils import preprocess_input
 
 class LATTE(nn.Module):
     def __init__(self, t_order: int, embedding_dim: int, in_channels_dict: dict, num_nodes_dict: dict, metapaths: list,
                  activation: str = "relu", attn_heads=1, attn_activation="sharpening", attn_dropout=0.5,
-                 use_proximity=True, neg_sampling_ratio=2.0):
+                 use_proximity=True, neg_sampling_ratio=2.0, embedding_cache_size=500000, embedding_lr=0.01):
         super(LATTE, self).__init__()
         self.metapaths = metapaths
         self.node_types = list(num_nodes_dict.keys())
@@ -36,6 +39,7 @@ class LATTE(nn.Module):
                           metapaths=t_order_metapaths, activation=activation, attn_heads=attn_heads,
                           attn_activation=attn_activation, attn_dropout=attn_dropout, use_proximity=use_proximity,
                           neg_sampling_ratio=neg_sampling_ratio,
+                          embedding_cache_size=embedding_cache_size, embedding_lr=embedding_lr,
                           first=True if t == 0 else False,
                           embeddings=layers[0].embeddings if t > 0 else None))
             t_order_metapaths = LATTE.join_metapaths(t_order_metapaths, metapaths)
@@ -97,6 +101,15 @@ class LATTE(nn.Module):
 
         return output_dict
 
+    def set_metapath_joins(self, metapath_joins):
+        """
+        Use the higher-order metapath adjacencies precomputed on the full graph, instead of joining the batch's
+        edge_index_dict's at every forward pass. The higher-order neighborhoods then come from the full graph rather than
+        from the sampled batch, and all composite adjacencies are held in memory.
+        :param metapath_joins (MetapathJoins): Precomputed with the same `metapaths` and a `t_order` >= self.t_order
+        """
+        self.metapath_joins = metapath_joins
+
     def forward(self, X: dict, edge_index_dict: dict, global_node_idx: dict, save_betas=False):
         """
         This
@@ -104,7 +117,8 @@ class LATTE(nn.Module):
         :param global_node_idx: Dict of <node_type>:<int tensor size (batch_size,)>
         :param edge_index_dict: Dict of <metapath>:<tensor size (2, num_edge_index)>
         :param save_betas: whether to save _beta values for batch
-        :return embedding_output, proximity_loss, edge_pred_dict:
+        :return embedding_output, proximity_loss, proximity_edges: proximity_edges contains the first-order edges and
+            their predicted scores if use_proximity, else None.
         """
         # device = global_node_idx[list(global_node_idx.keys())[0]].device
         proximity_loss = torch.tensor(0.0, device=self.layers[0].device) if self.use_proximity else None
@@ -112,13 +126,17 @@ class LATTE(nn.Module):
         h_layers = {node_type: [] for node_type in global_node_idx}
         for t in range(self.t_order):
             if t == 0:
-                h_dict, t_loss, edge_pred_dict = self.layers[t].forward(x_l=X, x_r=X,
-                                                                        edge_index_dict=edge_index_dict,
-                                                                        global_node_idx=global_node_idx,
-                                                                        save_betas=save_betas)
+                h_dict, t_loss, proximity_edges = self.layers[t].forward(x_l=X, x_r=X,
+                                                                         edge_index_dict=edge_index_dict,
+                                                                         global_node_idx=global_node_idx,
+                                                                         save_betas=save_betas)
                 next_edge_index_dict = edge_index_dict
             else:
-                next_edge_index_dict = LATTE.join_edge_indexes(next_edge_index_dict, edge_index_dict, global_node_idx)
+                if getattr(self, "metapath_joins", None) is not None:
+                    next_edge_index_dict = self.metapath_joins.get_edge_index_dict(t, edge_index_dict, global_node_idx)
+                else:
+                    next_edge_index_dict = LATTE.join_edge_indexes(next_edge_index_dict, edge_index_dict,
+                                                                   global_node_idx)
                 h_dict, t_loss, _ = self.layers[t].forward(x_l=h_dict, x_r=X,
                                                            edge_index_dict=next_edge_index_dict,
                                                            global_node_idx=global_node_idx,
@@ -133,7 +151,102 @@ class LATTE(nn.Module):
         concat_out = {node_type: torch.cat(h_list, dim=1) for node_type, h_list in h_layers.items() \
                       if len(h_list) > 0}
 
-        return concat_out, proximity_loss, edge_pred_dict
+        return concat_out, proximity_loss, proximity_edges
+
+    @torch.no_grad()
+    def inference(self, X: dict, edge_index_dict: dict, num_nodes_dict: dict, node_types: list, chunk_size=10000):
+        """
+        Layer-wise inference of the embeddings of all nodes of `node_types` with their full neighborhoods. The output of a
+        node at order t only depends on its own output at order t-1 and on the input features of its (t+1)-order
+        metapath neighbors, so each order is computed once for all nodes, in chunks of `chunk_size` head nodes, instead
+        of once per sampled batch the node is in.
+
+        :param X: Dict of <node_type>:<tensor size (num_nodes, in_channels)> of all nodes, or a NodeFeatureStore
+        :param edge_index_dict: Dict of <metapath>:<Tensor(2, num_edges)> of the full graph, with type-specific node index
+        :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+        :param node_types: node types to compute the embeddings of, e.g. [head_node_type]
+        :param chunk_size: number of head nodes computed at a time
+        :return: Dict of <node_type>:<tensor size (num_nodes, embedding_dim)> on CPU
+        """
+        device = self.layers[0].conv[self.layers[0].node_types[0]].weight.device
+        metapath_joins = getattr(self, "metapath_joins", None)
+        if self.t_order > 1 and metapath_joins is None:
+            # Joined once on the full graph of `edge_index_dict`, and reused by the next inference calls with it
+            if getattr(self, "_inference_joins", (None, None))[0] != id(edge_index_dict):
+                self._inference_joins = (id(edge_index_dict),
+                                         MetapathJoins(edge_index_dict=edge_index_dict, num_nodes_dict=num_nodes_dict,
+                                                       metapaths=self.metapaths, t_order=self.t_order))
+            metapath_joins = self._inference_joins[1]
+
+        h_layers = {node_type: [] for node_type in node_types}
+        for t, layer in enumerate(self.layers):
+            adj_dict = {}
+            for metapath in layer.metapaths:
+                if t > 0 and metapath in metapath_joins.adj_dict:
+                    adj_dict[metapath] = metapath_joins.adj_dict[metapath]
+                elif t == 0 and metapath in edge_index_dict:
+                    edge_index, _ = LATTE.get_edge_index_values(edge_index_dict[metapath])
+                    if edge_index is None: continue
+                    adj_dict[metapath] = SparseTensor(row=edge_index[0], col=edge_index[1],
+                                                      sparse_sizes=(num_nodes_dict[metapath[0]],
+                                                                    num_nodes_dict[metapath[-1]]))
+
+            for node_type in node_types:
+                h_layers[node_type].append(torch.zeros((num_nodes_dict[node_type], layer.embedding_dim)))
+                for start in range(0, num_nodes_dict[node_type], chunk_size):
+                    heads = torch.arange(start, min(start + chunk_size, num_nodes_dict[node_type]))
+                    global_node_idx, edge_index_dict_chunk = self.get_inference_batch(
+                        heads, node_type, adj_dict=adj_dict, metapaths=layer.get_head_relations(node_type))
+
+                    x_r = {ntype: X[ntype][nids].to(device) for ntype, nids in global_node_idx.items() if ntype in X}
+                    if t == 0:
+                        x_l = x_r
+                    else:
+                        # Only the head node_type's outputs are computed, so the other node types' x_l are unused
+                        x_l = {ntype: h_layers[ntype][t - 1][nids].to(device) if ntype == node_type else \
+                            torch.zeros((nids.size(0), layer.embedding_dim), device=device) \
+                               for ntype, nids in global_node_idx.items()}
+
+                    h_dict, _, _ = layer.forward(x_l=x_l, x_r=x_r,
+                                                 edge_index_dict={metapath: edge_index.to(device) \
+                                                                  for metapath, edge_index in
+                                                                  edge_index_dict_chunk.items()},
+                                                 global_node_idx={ntype: nids.to(device) \
+                                                                  for ntype, nids in global_node_idx.items()},
+                                                 node_types=[node_type], return_loss=False)
+                    h_layers[node_type][t][heads] = h_dict[node_type][:heads.size(0)].cpu()
+
+        return {node_type: torch.cat(h_list, dim=1) for node_type, h_list in h_layers.items()}
+
+    @staticmethod
+    def get_inference_batch(heads: torch.Tensor, head_type: str, adj_dict: dict, metapaths: list):
+        """
+        Select the full neighborhoods of `heads` in each of `metapaths`.
+        :return: global_node_idx, where the heads are the first nodes of `head_type`, and edge_index_dict in batch index
+        """
+        cols_dict, tails_dict = {}, {}
+        for metapath in metapaths:
+            if metapath not in adj_dict: continue
+            row, col, _ = adj_dict[metapath].index_select(0, heads).coo()
+            cols_dict[metapath] = (row, col)
+            tails_dict.setdefault(metapath[-1], []).append(col)
+
+        # The heads are the first nodes of their node type, followed by the other tail nodes
+        global_node_idx = {head_type: heads}
+        for node_type, cols in tails_dict.items():
+            cols = torch.cat(cols).unique()
+            if node_type == head_type:
+                global_node_idx[node_type] = torch.cat([heads, cols[~torch.isin(cols, heads)]])
+            else:
+                global_node_idx[node_type] = cols
+
+        edge_index_dict = {}
+        for metapath, (row, col) in cols_dict.items():
+            nids = global_node_idx[metapath[-1]]
+            order = torch.argsort(nids)
+            local_col = order[torch.searchsorted(nids[order], col)]
+            edge_index_dict[metapath] = torch.stack([row, local_col], dim=0)
+        return global_node_idx, edge_index_dict
 
     def get_attn_activation_weights(self, t):
         return dict(zip(self.layers[t].metapaths, self.layers[t].alpha_activation.detach().numpy().tolist()))
@@ -141,12 +254,41 @@ class LATTE(nn.Module):
     def get_relation_weights(self, t):
         return self.layers[t].get_relation_weights()
 
+    def set_attn_recorders(self, num_nodes_dict: dict, sample_rate=1.0, seed=0):
+        """
+        Record the relation weights of every layer into device buffers at each eval forward pass, instead of saving
+        DataFrames of the batch's weights (see `RelationWeightRecorder`).
+        """
+        for layer in self.layers:
+            layer.attn_recorder = RelationWeightRecorder(
+                num_nodes_dict=num_nodes_dict,
+                relations_dict={node_type: layer.get_head_relations(node_type, True) + [node_type] \
+                                for node_type in layer.node_types},
+                sample_rate=sample_rate, seed=seed)
+
+    def reset_attn_recorders(self):
+        """
+        Clear the nodes recorded by each layer, e.g. at the start of an eval epoch.
+        """
+        for layer in self.layers:
+            if layer.attn_recorder is None: continue
+            layer.attn_recorder.reset()
+
+    def flush_attn_weights(self, path: str, blocking=False):
+        """
+        Write the relation weights recorded by each layer to `path`/t={t}/ in the background.
+        """
+        for t, layer in enumerate(self.layers):
+            if layer.attn_recorder is None: continue
+            layer.attn_recorder.flush(os.path.join(path, f"t={t}"), blocking=blocking)
+
 
-class LATTEConv(MessagePassing, pl.LightningModule):
+class LATTEConv(pl.LightningModule):
     def __init__(self, embedding_dim: int, in_channels_dict: {str: int}, num_nodes_dict: {str: int}, metapaths: list,
                  activation: str = "relu", attn_heads=4, attn_activation="sharpening", attn_dropout=0.2,
-                 use_proximity=False, neg_sampling_ratio=1.0, first=True, embeddings=None) -> None:
-        super(LATTEConv, self).__init__(aggr="add", flow="target_to_source", node_dim=0)
+                 use_proximity=False, neg_sampling_ratio=1.0, first=True, embeddings=None,
+                 embedding_cache_size=500000, embedding_lr=0.01) -> None:
+        super(LATTEConv, self).__init__()
         self.first = first
         self.node_types = list(num_nodes_dict.keys())
         self.metapaths = list(metapaths)
@@ -206,20 +348,25 @@ class LATTEConv(MessagePassing, pl.LightningModule):
         non_attr_node_types = (num_nodes_dict.keys() - in_channels_dict.keys())
         if first and len(non_attr_node_types) > 0:
             if embedding_dim > 256 or sum([v for k, v in self.num_nodes_dict.items()]) > 1000000:
-                print("INFO: Embedding.device = 'cpu'")
-                self.embeddings = {node_type: nn.Embedding(num_embeddings=self.num_nodes_dict[node_type],
-                                                           embedding_dim=embedding_dim,
-                                                           sparse=True).cpu() for node_type in non_attr_node_types}
+                print(f"INFO: HybridEmbedding with {embedding_cache_size} cached rows on device")
+                self.embeddings = nn.ModuleDict(
+                    {node_type: HybridEmbedding(num_embeddings=self.num_nodes_dict[node_type],
+                                                embedding_dim=embedding_dim,
+                                                cache_size=embedding_cache_size,
+                                                lr=embedding_lr) for node_type in non_attr_node_types})
             else:
                 self.embeddings = nn.ModuleDict(
                     {node_type: nn.Embedding(num_embeddings=self.num_nodes_dict[node_type],
                                              embedding_dim=embedding_dim,
                                              sparse=False) for node_type in non_attr_node_types})
         elif embeddings is not None:
-            self.embeddings = embeddings
+            # Shared with the first layer without registering them as a submodule, so that they are saved once in the
+            # state_dict, from the first layer
+            object.__setattr__(self, "embeddings", embeddings)
         else:
             self.embeddings = None
 
+        self.attn_recorder = None
         self.reset_parameters()
 
     def reset_parameters(self):
@@ -240,14 +387,18 @@ class LATTEConv(MessagePassing, pl.LightningModule):
             for node_type in self.embeddings:
                 self.embeddings[node_type].reset_parameters()
 
-    def forward(self, x_l, edge_index_dict, global_node_idx, x_r=None, save_betas=False):
+    def forward(self, x_l, edge_index_dict, global_node_idx, x_r=None, save_betas=False, node_types=None,
+                return_loss=True, proximity_edges=None):
         """
 
         :param x_l: a dict of node attributes indexed node_type
         :param global_node_idx: A dict of index values indexed by node_type in this mini-batch sampling
         :param edge_index_dict: Sparse adjacency matrices for each metapath relation. A dict of edge_index indexed by metapath
         :param x_r: Context embedding of the previous order, required for t >= 2. Default: None (if first order). A dict of (node_type: tensor)
-        :return: output_emb, loss
+        :param node_types: the node types to compute output embeddings for. Default None, for all in global_node_idx.
+        :param return_loss: whether to compute the proximity loss, if use_proximity
+        :param proximity_edges: the ProximityEdges of `edge_index_dict`. Default None, to build them if use_proximity.
+        :return: output_emb, loss, proximity_edges
         """
         # H_t = W_t * x
         l_dict = self.get_h_dict(x_l, global_node_idx, left_right="left")
@@ -255,17 +406,23 @@ class LATTEConv(MessagePassing, pl.LightningModule):
 
         # Predict relations attention coefficients
         beta = self.get_beta_weights(x_dict=x_l, h_dict=l_dict, h_prev=l_dict, global_node_idx=global_node_idx)
-        # Save beta weights from testing samples
-        if not self.training: self.save_relation_weights(beta, global_node_idx)
+        # Record beta weights from eval samples
+        if not self.training and self.attn_recorder is not None:
+            self.attn_recorder.update(beta if node_types is None else {node_type: beta[node_type] \
+                                                                       for node_type in node_types}, global_node_idx)
+        elif not self.training and save_betas:
+            self.save_relation_weights(beta, global_node_idx)
 
         # Compute node-level attention coefficients
         alpha_l, alpha_r = self.get_alphas(edge_index_dict, l_dict, r_dict)
 
-        # For each metapath in a node_type, use GAT message passing to aggregate h_j neighbors
+        # For each node_type, aggregate the h_j neighbors of all its metapaths with GAT attention
+        r_concat, r_offsets = self.concat_node_embeddings(r_dict)
         out = {}
-        for node_type in global_node_idx:
+        for node_type in (global_node_idx if node_types is None else node_types):
             out[node_type] = self.agg_relation_neighbors(node_type=node_type, alpha_l=alpha_l, alpha_r=alpha_r,
-                                                         l_dict=l_dict, r_dict=r_dict, edge_index_dict=edge_index_dict,
+                                                         l_dict=l_dict, r_dict=r_concat, r_offsets=r_offsets,
+                                                         edge_index_dict=edge_index_dict,
                                                          global_node_idx=global_node_idx)
             out[node_type][:, -1] = l_dict[node_type]
             # Soft-select the relation-specific embeddings by a weighted average with beta[node_type]
@@ -274,46 +431,78 @@ class LATTEConv(MessagePassing, pl.LightningModule):
             # Apply \sigma activation to all embeddings
             out[node_type] = self.embedding_activation(out[node_type])
 
+        proximity_loss = None
+        if self.use_proximity and return_loss:
+            if proximity_edges is None:
+                proximity_edges = ProximityEdges(edge_index_dict, global_node_idx,
+                                                 neg_sampling_ratio=self.neg_sampling_ratio)
+            proximity_loss, proximity_edges = self.proximity_loss(proximity_edges, alpha_l=alpha_l, alpha_r=alpha_r)
+        return out, proximity_loss, proximity_edges
 
-        proximity_loss, edge_pred_dict = None, None
-        if self.use_proximity:
-            proximity_loss, edge_pred_dict = self.proximity_loss(edge_index_dict,
-                                                                 alpha_l=alpha_l, alpha_r=alpha_r,
-                                                                 global_node_idx=global_node_idx)
-        return out, proximity_loss, edge_pred_dict
-
-    def agg_relation_neighbors(self, node_type, alpha_l, alpha_r, l_dict, r_dict, edge_index_dict, global_node_idx):
-        # Initialize embeddings, size: (num_nodes, num_relations, embedding_dim)
-        emb_relations = torch.zeros(
-            size=(global_node_idx[node_type].size(0),
-                  self.num_head_relations(node_type),
-                  self.embedding_dim)).type_as(self.conv[node_type].weight)
+    def agg_relation_neighbors(self, node_type, alpha_l, alpha_r, l_dict, r_dict, edge_index_dict, global_node_idx,
+                               r_offsets=None):
+        """
+        Aggregate the tail node embeddings of every metapath with head `node_type` in a single pass. The edges of all
+        the head relations are concatenated with their relation index, so that the attention softmax over each (head
+        node, relation) segment and the weighted scatter-sum are computed once for all relations, instead of with one
+        `propagate()` per metapath.
+
+        :param r_dict: Dict of <node_type>:<tensor size (num_nodes, embedding_dim)>, or a tensor of the concatenated
+            r_dict embeddings if `r_offsets` is given.
+        :param r_offsets: Dict of <node_type>:<offset of the node_type's rows in r_dict>. Default None.
+        :return: emb_relations, size: (num_nodes, num_relations, embedding_dim). The last relation is left to zeros.
+        """
+        num_nodes, num_relations = global_node_idx[node_type].size(0), self.num_head_relations(node_type)
+        if r_offsets is None:
+            r_dict, r_offsets = self.concat_node_embeddings(r_dict)
 
+        heads, tails, alphas, relations, metapath_idx = [], [], [], [], []
         for i, metapath in enumerate(self.get_head_relations(node_type)):
-            if metapath not in edge_index_dict or edge_index_dict[metapath] == None: continue
-            head, tail = metapath[0], metapath[-1]
-            num_node_head, num_node_tail = len(global_node_idx[head]), len(global_node_idx[tail])
-
-            edge_index, values = LATTE.get_edge_index_values(edge_index_dict[metapath])
+            if metapath not in edge_index_dict or edge_index_dict[metapath] is None: continue
+            edge_index, _ = LATTE.get_edge_index_values(edge_index_dict[metapath])
             if edge_index is None: continue
-            # Propapate flows from target nodes to source nodes
-            out = self.propagate(
-                edge_index=edge_index,
-                x=(r_dict[tail], l_dict[head]),
-                alpha=(alpha_r[metapath], alpha_l[metapath]),
-                size=(num_node_tail, num_node_head),
-                metapath_idx=self.metapaths.index(metapath))
-            emb_relations[:, i] = out
-
-        return emb_relations
-
-    def message(self, x_j, alpha_j, alpha_i, index, ptr, size_i, metapath_idx):
-        alpha = alpha_j if alpha_i is None else alpha_j + alpha_i
-        # alpha = self.attn_q[metapath_idx].forward(torch.cat([alpha_i, alpha_j], dim=1))
-        alpha = self.attn_activation(alpha, metapath_idx)
-        alpha = softmax(alpha, index=index, ptr=ptr, num_nodes=size_i)
+
+            heads.append(edge_index[0])
+            tails.append(edge_index[1] + r_offsets[metapath[-1]])
+            alphas.append(alpha_l[metapath][edge_index[0]] + alpha_r[metapath][edge_index[1]])
+            relations.append(i)
+            metapath_idx.append(self.metapaths.index(metapath))
+
+        # Accumulate in at least fp32 when the embeddings are in half precision
+        emb_relations = r_dict.new_zeros((num_nodes * num_relations, self.embedding_dim),
+                                         dtype=torch.promote_types(r_dict.dtype, torch.float))
+        if len(heads) == 0:
+            return emb_relations.view(num_nodes, num_relations, self.embedding_dim).to(r_dict.dtype)
+
+        num_edges = torch.tensor([edge_index.size(0) for edge_index in heads], device=r_dict.device)
+        relations = torch.tensor(relations, device=r_dict.device).repeat_interleave(num_edges)
+        # Index of the (head node, relation) segment of each edge
+        index = torch.cat(heads, dim=0) * num_relations + relations
+
+        alpha = torch.cat(alphas, dim=0)
+        if isinstance(self.alpha_activation, torch.Tensor):
+            metapath_idx = torch.tensor(metapath_idx, device=r_dict.device).repeat_interleave(num_edges)
+            alpha = self.alpha_activation[metapath_idx].unsqueeze(-1) * alpha
+        else:
+            alpha = self.attn_activation(alpha, metapath_id=None)
+        alpha = softmax(alpha.to(emb_relations.dtype), index=index, num_nodes=num_nodes * num_relations)
         alpha = F.dropout(alpha, p=self.attn_dropout, training=self.training)
-        return x_j * alpha
+
+        x_j = r_dict[torch.cat(tails, dim=0)]
+        emb_relations.index_add_(0, index, (x_j * alpha.to(x_j.dtype)).to(emb_relations.dtype))
+        return emb_relations.view(num_nodes, num_relations, self.embedding_dim).to(r_dict.dtype)
+
+    @staticmethod
+    def concat_node_embeddings(h_dict):
+        """
+        Concatenate the embeddings of all node types, so that the rows of several node types can be gathered at once.
+        :return: tensor size (sum of num_nodes, embedding_dim), Dict of <node_type>:<row offset>
+        """
+        offsets, offset = {}, 0
+        for node_type, h in h_dict.items():
+            offsets[node_type] = offset
+            offset += h.size(0)
+        return torch.cat(list(h_dict.values()), dim=0), offsets
 
     def get_h_dict(self, input, global_node_idx, left_right="left"):
         h_dict = {}
@@ -324,7 +513,7 @@ class LATTEConv(MessagePassing, pl.LightningModule):
                 elif left_right == "right":
                     h_dict[node_type] = self.linear_r[node_type].forward(input[node_type])
             else:
-                h_dict[node_type] = self.embeddings[node_type].weight[global_node_idx[node_type]] \
+                h_dict[node_type] = self.embeddings[node_type].forward(global_node_idx[node_type]) \
                     .to(self.conv[node_type].weight.device)
         return h_dict
 
@@ -352,7 +541,7 @@ class LATTEConv(MessagePassing, pl.LightningModule):
             else:
                 beta[node_type] = self.conv[node_type].forward(h_prev[node_type].unsqueeze(-1))
 
-            beta[node_type] = torch.softmax(beta[node_type], dim=1)
+            beta[node_type] = torch.softmax(beta[node_type], dim=1, dtype=torch.float).to(beta[node_type].dtype)
         return beta
 
     def predict_scores(self, edge_index, alpha_l, alpha_r, metapath, logits=False):
@@ -368,53 +557,74 @@ class LATTEConv(MessagePassing, pl.LightningModule):
         else:
             return F.sigmoid(e_pred)
 
-    def proximity_loss(self, edge_index_dict, alpha_l, alpha_r, global_node_idx):
+    def proximity_loss(self, proximity_edges, alpha_l, alpha_r):
         """
-        For each relation/metapath type given in `edge_index_dict`, this function both predict link scores and computes
-        the NCE loss for both positive and negative (sampled) links. For each relation type in `edge_index_dict`, if the
-        negative metapath is not included, then the function automatically samples for random negative edges. And, if it
-        is included, then computes the NCE loss over the given negative edges. This function returns the scores of the
-        predicted positive and negative edges.
-
-        :param edge_index_dict (dict): Dict of <relation/metapath>: <Tensor(2, num_edges)>
-        :param alpha_l (dict): Dict of <node_type>:<alpha_l tensor>
-        :param alpha_r (dict): Dict of <node_type>:<alpha_r tensor>
-        :param global_node_idx (dict): Dict of <node_type>:<Tensor(node_idx,)>
-        :return loss, edge_pred_dict: NCE loss. edge_pred_dict will contain both positive relations of shape (num_edges,) and negative relations of shape (num_edges*num_neg_edges, )
+        For each relation/metapath type in `proximity_edges`, this function both predict link scores and computes
+        the NCE loss for both positive and negative (given or sampled) links. The scores of all the metapaths' edges are
+        computed with a single gather from the concatenated alpha_l and alpha_r, and the loss is averaged over the edges
+        of each (metapath, positive or negative) segment. The predicted scores are saved in `proximity_edges`.
+
+        :param proximity_edges (ProximityEdges): the positive and negative edges of the batch
+        :param alpha_l (dict): Dict of <metapath>:<alpha_l tensor>
+        :param alpha_r (dict): Dict of <metapath>:<alpha_r tensor>
+        :return loss, proximity_edges: NCE loss. proximity_edges.pos_pred_dict contains the positive scores of shape
+            (num_edges,) and proximity_edges.neg_pred_dict the negative scores of shape (num_edges*num_neg_edges, )
         """
-        loss = torch.tensor(0.0, dtype=torch.float, device=self.conv[self.node_types[0]].weight.device)
-        edge_pred_dict = {}
-        for metapath, edge_index in edge_index_dict.items():
-            # KL Divergence over observed positive edges or negative edges (if included)
-            if isinstance(edge_index, tuple):  # Weighted edges
-                edge_index, values = edge_index
+        device = self.conv[self.node_types[0]].weight.device
+        metapaths = [metapath for metapath in proximity_edges.get_metapaths() if metapath in alpha_l]
+
+        # Segments of (metapath, negative, edge_index, values)
+        segments = []
+        for metapath in metapaths:
+            if metapath in proximity_edges.pos_dict:
+                edge_index, values = proximity_edges.pos_dict[metapath]
+                if edge_index.size(1) > 0:
+                    segments.append((metapath, False, edge_index, values))
+            neg_edge_index = proximity_edges.get_negative(metapath)
+            if neg_edge_index is not None and neg_edge_index.size(1) > 0:
+                segments.append((metapath, True, neg_edge_index, None))
+
+        loss = torch.tensor(0.0, dtype=torch.float, device=device)
+        if len(segments) == 0:
+            return loss, proximity_edges
+
+        alpha_l_concat, l_offsets = self.concat_node_embeddings({metapath: alpha_l[metapath] for metapath in metapaths})
+        alpha_r_concat, r_offsets = self.concat_node_embeddings({metapath: alpha_r[metapath] for metapath in metapaths})
+        heads = torch.cat([edge_index[0] + l_offsets[metapath] for metapath, _, edge_index, _ in segments])
+        tails = torch.cat([edge_index[1] + r_offsets[metapath] for metapath, _, edge_index, _ in segments])
+        num_edges = [edge_index.size(1) for _, _, edge_index, _ in segments]
+        num_edges_tensor = torch.tensor(num_edges, device=device)
+
+        # Scores and losses are computed in fp32 under mixed precision
+        e_pred_logits = (alpha_l_concat[heads] + alpha_r_concat[tails]).float()
+        if isinstance(self.alpha_activation, torch.Tensor):
+            metapath_idx = torch.tensor([self.metapaths.index(metapath) for metapath, _, _, _ in segments],
+                                        device=device).repeat_interleave(num_edges_tensor)
+            e_pred_logits = self.alpha_activation[metapath_idx].unsqueeze(-1) * e_pred_logits
+        else:
+            e_pred_logits = self.attn_activation(e_pred_logits, metapath_id=None)
+        e_pred_logits = e_pred_logits.squeeze(-1)
+
+        # KL Divergence over observed positive edges, and negative edges
+        sign = torch.tensor([-1.0 if negative else 1.0 for _, negative, _, _ in segments],
+                            device=device).repeat_interleave(num_edges_tensor)
+        weights = torch.cat([values.to(e_pred_logits.dtype) if values is not None else \
+                                 torch.ones(edge_index.size(1), dtype=e_pred_logits.dtype, device=device) \
+                             for _, _, edge_index, values in segments])
+        edge_loss = -weights * F.logsigmoid(sign * e_pred_logits)
+        segment_idx = torch.arange(len(segments), device=device).repeat_interleave(num_edges_tensor)
+        segment_loss = torch.zeros(len(segments), dtype=edge_loss.dtype, device=device) \
+            .index_add_(0, segment_idx, edge_loss)
+        loss = loss + (segment_loss / num_edges_tensor).sum()
+
+        for (metapath, negative, _, _), e_pred in zip(segments, F.sigmoid(e_pred_logits.detach()).split(num_edges)):
+            if negative:
+                proximity_edges.neg_pred_dict[metapath] = e_pred
             else:
-                values = 1.0
-            if edge_index is None: continue
-
-            if not is_negative(metapath):
-                e_pred_logits = self.predict_scores(edge_index, alpha_l, alpha_r, metapath, logits=True)
-                loss += -torch.mean(values * F.logsigmoid(e_pred_logits), dim=-1)
-            elif is_negative(metapath):
-                e_pred_logits = self.predict_scores(edge_index, alpha_l, alpha_r, untag_negative(metapath), logits=True)
-                loss += -torch.mean(F.logsigmoid(-e_pred_logits), dim=-1)
-
-            edge_pred_dict[metapath] = F.sigmoid(e_pred_logits.detach())
+                proximity_edges.pos_pred_dict[metapath] = e_pred
 
-            # Only need to sample for negative edges if negative metapath is not included
-            if not is_negative(metapath) and tag_negative(metapath) not in edge_index_dict:
-                neg_edge_index = negative_sample(edge_index,
-                                                 M=global_node_idx[metapath[0]].size(0),
-                                                 N=global_node_idx[metapath[-1]].size(0),
-                                                 n_sample_per_edge=self.neg_sampling_ratio)
-                if neg_edge_index is None or neg_edge_index.size(1) <= 1: continue
-
-                e_neg_logits = self.predict_scores(neg_edge_index, alpha_l, alpha_r, metapath, logits=True)
-                loss += -torch.mean(F.logsigmoid(-e_neg_logits), dim=-1)
-                edge_pred_dict[tag_negative(metapath)] = F.sigmoid(e_neg_logits.detach())
-
-        loss = torch.true_divide(loss, max(len(edge_index_dict) * 2, 1))
-        return loss, edge_pred_dict
+        loss = torch.true_divide(loss, max(proximity_edges.num_relations * 2, 1))
+        return loss, proximity_edges
 
     def embedding_activation(self, embeddings):
         if self.activation == "sigmoid":
@@ -458,12 +668,12 @@ class LATTEConv(MessagePassing, pl.LightningModule):
         self._beta_std = {}
         for node_type in beta:
             with torch.no_grad():
-                self._betas[node_type] = pd.DataFrame(beta[node_type].squeeze(-1).cpu().numpy(),
+                self._betas[node_type] = pd.DataFrame(beta[node_type].squeeze(-1).float().cpu().numpy(),
                                                       columns=self.get_head_relations(node_type, True) + [node_type, ],
                                                       index=global_node_idx[node_type].cpu().numpy())
 
-                _beta_avg = np.around(beta[node_type].mean(dim=0).squeeze(-1).cpu().numpy(), decimals=3)
-                _beta_std = np.around(beta[node_type].std(dim=0).squeeze(-1).cpu().numpy(), decimals=2)
+                _beta_avg = np.around(beta[node_type].float().mean(dim=0).squeeze(-1).cpu().numpy(), decimals=3)
+                _beta_std = np.around(beta[node_type].float().std(dim=0).squeeze(-1).cpu().numpy(), decimals=2)
                 self._beta_avg[node_type] = {metapath: _beta_avg[i] for i, metapath in
                                              enumerate(self.get_head_relations(node_type, True) + [node_type])}
                 self._beta_std[node_type] = {metapath: _beta_std[i] for i, metapath in
@@ -477,7 +687,7 @@ class LATTEConv(MessagePassing, pl.LightningModule):
         if not hasattr(self, "_beta_std"):
             self._beta_std = {}
 
-        betas = attn_weights.sum(1)
+        betas = attn_weights.float().sum(1)
         with torch.no_grad():
             self._betas[node_type] = pd.DataFrame(betas.cpu().numpy(),
                                                   columns=self.get_head_relations(node_type, True) + [node_type, ],
@@ -495,11 +705,146 @@ class LATTEConv(MessagePassing, pl.LightningModule):
         Get the mean and std of relation attention weights for all nodes
         :return:
         """
+        if self.attn_recorder is not None:
+            return self.attn_recorder.get_relation_weights()
         return {(metapath if "." in metapath or len(metapath) > 1 else node_type): (avg, std) \
                 for node_type in self._beta_avg for (metapath, avg), (relation_b, std) in
                 zip(self._beta_avg[node_type].items(), self._beta_std[node_type].items())}
 
 
+class ProximityEdges(object):
+    def __init__(self, edge_index_dict: dict, global_node_idx: dict, neg_sampling_ratio: float):
+        """
+        The positive and negative edges of each metapath in a batch for the proximity loss, and their predicted scores.
+        Negative edges given in `edge_index_dict` under a tag_negative()'ed metapath are stored under their metapath,
+        and the negative edges of the other metapaths are sampled once at their first use.
+
+        :param edge_index_dict: Dict of <metapath>:<Tensor(2, num_edges) or (edge_index, values)>, which may include
+            negative edges under tag_negative(metapath)
+        :param global_node_idx: Dict of <node_type>:<Tensor(node_idx,)>
+        :param neg_sampling_ratio: number of sampled negative edges per positive edge
+        """
+        self.global_node_idx = global_node_idx
+        self.neg_sampling_ratio = neg_sampling_ratio
+        self.num_relations = len(edge_index_dict)
+
+        self.pos_dict, self.neg_dict = {}, {}
+        for metapath, edge_index in edge_index_dict.items():
+            values = None
+            if isinstance(edge_index, tuple):  # Weighted edges
+                edge_index, values = edge_index
+            if edge_index is None: continue
+
+            if is_negative(metapath):
+                self.neg_dict[untag_negative(metapath)] = edge_index
+            else:
+                self.pos_dict[metapath] = (edge_index, values)
+
+        self.pos_pred_dict, self.neg_pred_dict = {}, {}
+
+    def get_metapaths(self) -> list:
+        return list(self.pos_dict.keys()) + [metapath for metapath in self.neg_dict if metapath not in self.pos_dict]
+
+    def get_negative(self, metapath):
+        """
+        :return: the given or sampled negative edge_index of `metapath`, or None if too few can be sampled
+        """
+        if metapath not in self.neg_dict:
+            neg_edge_index = negative_sample(self.pos_dict[metapath][0],
+                                             M=self.global_node_idx[metapath[0]].size(0),
+                                             N=self.global_node_idx[metapath[-1]].size(0),
+                                             n_sample_per_edge=self.neg_sampling_ratio)
+            self.neg_dict[metapath] = neg_edge_index if neg_edge_index.size(1) > 1 else None
+        return self.neg_dict[metapath]
+
+
+class MetapathJoins:
+    def __init__(self, edge_index_dict: dict, num_nodes_dict: dict, metapaths: list, t_order: int):
+        """
+        Materializes the degree-normalized composite adjacency (see `adamic_adar()`) of every higher-order metapath up to
+        `t_order` once on the full graph, and stores them as SparseTensor's. At each forward pass, LATTE then only slices
+        the rows and columns of the batch nodes and samples edges from them, instead of recomputing the sparse products
+        between the batch's edge_index_dict's.
+
+        :param edge_index_dict: Dict of <metapath>:<Tensor(2, num_edges)> of the full graph, with type-specific node index
+        :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+        :param metapaths: List of the first-order metapaths used in LATTE
+        :param t_order: The highest order of metapaths to materialize
+        """
+        self.num_nodes_dict = num_nodes_dict
+        self.adj_dict = {}
+        self.hops_dict = {}
+        self.t_order_metapaths = {}
+
+        first_order = {}
+        for metapath in metapaths:
+            if is_negative(metapath) or metapath not in edge_index_dict: continue
+            edge_index, values = LATTE.get_edge_index_values(edge_index_dict[metapath])
+            if edge_index is None: continue
+            first_order[metapath] = (edge_index, values)
+            self.hops_dict[metapath] = [metapath]
+
+        prev_order = first_order
+        for t in range(1, t_order):
+            next_order = {}
+            for metapath_a, (edge_index_a, values_a) in prev_order.items():
+                for metapath_b, (edge_index_b, values_b) in first_order.items():
+                    if metapath_a[-1] != metapath_b[0]: continue
+
+                    new_metapath = metapath_a + metapath_b[1:]
+                    new_edge_index, new_values = adamic_adar(indexA=edge_index_a, valueA=values_a,
+                                                             indexB=edge_index_b, valueB=values_b,
+                                                             m=num_nodes_dict[metapath_a[0]],
+                                                             k=num_nodes_dict[metapath_a[-1]],
+                                                             n=num_nodes_dict[metapath_b[-1]],
+                                                             coalesced=True, sampling=False)
+                    if new_values.numel() == 0: continue
+
+                    next_order[new_metapath] = (new_edge_index, new_values)
+                    self.hops_dict[new_metapath] = self.hops_dict[metapath_a] + [metapath_b]
+                    self.adj_dict[new_metapath] = SparseTensor(row=new_edge_index[0], col=new_edge_index[1],
+                                                               value=new_values,
+                                                               sparse_sizes=(num_nodes_dict[new_metapath[0]],
+                                                                             num_nodes_dict[new_metapath[-1]]))
+
+            self.t_order_metapaths[t] = list(next_order.keys())
+            prev_order = next_order
+
+    def get_edge_index_dict(self, t: int, edge_index_dict: dict, global_node_idx: dict) -> dict:
+        """
+        Slice the (t+1)-order metapath adjacencies to the batch nodes and sample as many edges as the smallest number of
+        batch edges among each hop's relation.
+
+        :param t: the LATTE layer index, where t=1 selects the second-order metapaths
+        :param edge_index_dict: Dict of <metapath>:<Tensor(2, num_edges)> of first-order relations in the batch
+        :param global_node_idx: Dict of <node_type>:<Tensor(node_idx,)>
+        :return: Dict of <metapath>:<(edge_index, values)> in batch index
+        """
+        output_dict = {}
+        for metapath in self.t_order_metapaths.get(t, []):
+            head, tail = metapath[0], metapath[-1]
+            if head not in global_node_idx or tail not in global_node_idx: continue
+            hop_edge_indexes = [LATTE.get_edge_index_values(edge_index_dict.get(hop, None))[0] \
+                                for hop in self.hops_dict[metapath]]
+            if any(edge_index is None for edge_index in hop_edge_indexes): continue
+            num_samples = min(edge_index.size(1) for edge_index in hop_edge_indexes)
+
+            adj = self.adj_dict[metapath]
+            device = global_node_idx[head].device
+            adj = adj.index_select(0, global_node_idx[head].to(adj.device())) \
+                .index_select(1, global_node_idx[tail].to(adj.device()))
+            row, col, values = adj.coo()
+            if values.numel() == 0: continue
+
+            if values.numel() > num_samples:
+                idx = torch.multinomial(values, num_samples=num_samples, replacement=False)
+                row, col, values = row[idx], col[idx], values[idx]
+
+            output_dict[metapath] = (torch.stack([row, col], dim=0).to(device), values.to(device))
+
+        return output_dict
+
+
 def tag_negative(metapath):
     if isinstance(metapath, tuple):
         return metapath + ("neg",)
@@ -4,7 +4,7 @@ import torch
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 
 from moge.generator import HeteroNetDataset
-from moge.module.PyG.latte import LATTE, untag_negative, is_negative
+from moge.module.PyG.latte import LATTE
 from ..trainer import NodeClfMetrics
 
 
@@ -27,26 +27,28 @@ class LATTELinkPredictor(LinkPredMetrics):
                            in_channels_dict=dataset.node_attr_shape, num_nodes_dict=dataset.num_nodes_dict,
                            metapaths=dataset.get_metapaths(), attn_heads=hparams.attn_heads,
                            attn_activation=hparams.attn_activation, attn_dropout=hparams.attn_dropout,
-                           use_proximity=True, neg_sampling_ratio=hparams.neg_sampling_ratio)
+                           use_proximity=True, neg_sampling_ratio=hparams.neg_sampling_ratio,
+                           embedding_cache_size=getattr(hparams, "embedding_cache_size", 500000),
+                           embedding_lr=getattr(hparams, "embedding_lr", 0.01))
         hparams.embedding_dim = hparams.embedding_dim * hparams.t_order
 
     def forward(self, input: dict, **kwargs):
-        embeddings, proximity_loss, edge_pred_dict = self.latte.forward(input["x_dict"],
-                                                                        edge_index_dict=input["edge_index_dict"],
-                                                                        global_node_idx=input["global_node_index"],
-                                                                        **kwargs)
-        return embeddings, proximity_loss, edge_pred_dict
+        embeddings, proximity_loss, proximity_edges = self.latte.forward(input["x_dict"],
+                                                                         edge_index_dict=input["edge_index_dict"],
+                                                                         global_node_idx=input["global_node_index"],
+                                                                         **kwargs)
+        return embeddings, proximity_loss, proximity_edges
 
-    def get_e_pos_neg(self, edge_pred_dict, training=True):
+    def get_e_pos_neg(self, proximity_edges, training=True):
         """
         Align e_pos and e_neg to shape (num_edge, ) and (num_edge, num_nodes_neg). Ignores reverse edges
-        :param edge_pred_dict:
+        :param proximity_edges (ProximityEdges):
         :return:
         """
-        e_pos = torch.cat([e_pred for metapath, e_pred in edge_pred_dict.items() \
-                           if not is_negative(metapath) and metapath in self.dataset.metapaths], dim=0)
-        e_neg = torch.cat([e_pred for metapath, e_pred in edge_pred_dict.items() if
-                           is_negative(metapath) and untag_negative(metapath) in self.dataset.metapaths], dim=0)
+        e_pos = torch.cat([e_pred for metapath, e_pred in proximity_edges.pos_pred_dict.items() \
+                           if metapath in self.dataset.metapaths], dim=0)
+        e_neg = torch.cat([e_pred for metapath, e_pred in proximity_edges.neg_pred_dict.items() \
+                           if metapath in self.dataset.metapaths], dim=0)
 
         if training:
             num_nodes_neg = int(self.hparams.neg_sampling_ratio)
@@ -67,8 +69,8 @@ class LATTELinkPredictor(LinkPredMetrics):
     def training_step(self, batch, batch_nb):
         X, _, _ = batch
         # print("X", {k: v.shape for k, v in X.items()})
-        _, loss, edge_pred_dict = self.forward(X)
-        e_pos, e_neg = self.get_e_pos_neg(edge_pred_dict, training=True)
+        _, loss, proximity_edges = self.forward(X)
+        e_pos, e_neg = self.get_e_pos_neg(proximity_edges, training=True)
         self.train_metrics.update_metrics(e_pos, e_neg, weights=None)
 
         outputs = {'loss': loss}
@@ -77,16 +79,16 @@ class LATTELinkPredictor(LinkPredMetrics):
     def validation_step(self, batch, batch_nb):
         X, _, _ = batch
         # print("X", {k: v.shape for k, v in X["edge_index_dict"].items()})
-        _, loss, edge_pred_dict = self.forward(X)
-        e_pos, e_neg = self.get_e_pos_neg(edge_pred_dict, training=False)
+        _, loss, proximity_edges = self.forward(X)
+        e_pos, e_neg = self.get_e_pos_neg(proximity_edges, training=False)
         self.valid_metrics.update_metrics(e_pos, e_neg, weights=None)
 
         return {"val_loss": loss}
 
     def test_step(self, batch, batch_nb):
         X, _, _ = batch
-        y_hat, loss, edge_pred_dict = self.forward(X)
-        e_pos, e_neg = self.get_e_pos_neg(edge_pred_dict, training=False)
+        y_hat, loss, proximity_edges = self.forward(X)
+        e_pos, e_neg = self.get_e_pos_neg(proximity_edges, training=False)
         self.test_metrics.update_metrics(e_pos, e_neg, weights=None)
 
         return {"test_loss": loss}
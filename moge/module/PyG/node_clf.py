@@ -1,5 +1,6 @@
 import itertools
 import multiprocessing
+import os
 
 import pandas as pd
 import pytorch_lightning as pl
@@ -12,10 +13,11 @@ from sklearn.metrics import precision_recall_fscore_support
 from sklearn.multiclass import OneVsRestClassifier
 from torch.nn import functional as F
 from torch.optim.lr_scheduler import ReduceLROnPlateau
+from torch.utils.data import DataLoader
 from torch_geometric.nn import MetaPath2Vec as Metapath2vec
 
 from moge.generator import HeteroNetDataset
-from moge.module.PyG.latte import LATTE
+from moge.module.PyG.latte import LATTE, MetapathJoins
 from moge.module.classifier import DenseClassification
 from moge.module.losses import ClassificationLoss
 from moge.module.metrics import Metrics
@@ -38,8 +40,20 @@ class LATTENodeClassifier(NodeClfMetrics):
                            metapaths=dataset.get_metapaths(), activation=hparams.activation,
                            attn_heads=hparams.attn_heads, attn_activation=hparams.attn_activation,
                            attn_dropout=hparams.attn_dropout, use_proximity=hparams.use_proximity,
-                           neg_sampling_ratio=hparams.neg_sampling_ratio)
+                           neg_sampling_ratio=hparams.neg_sampling_ratio,
+                           embedding_cache_size=getattr(hparams, "embedding_cache_size", 500000),
+                           embedding_lr=getattr(hparams, "embedding_lr", 0.01))
+        # Full-graph metapath joins would leak paths through held-out nodes in the inductive setting
+        if hparams.t_order > 1 and getattr(hparams, "precompute_joins", False) \
+                and not dataset.inductive:
+            self.latte.set_metapath_joins(MetapathJoins(edge_index_dict=dataset.edge_index_dict,
+                                                        num_nodes_dict=dataset.num_nodes_dict,
+                                                        metapaths=self.latte.metapaths, t_order=hparams.t_order))
+        if getattr(hparams, "attn_record_rate", 0) > 0:
+            self.latte.set_attn_recorders(num_nodes_dict=dataset.num_nodes_dict, sample_rate=hparams.attn_record_rate)
         hparams.embedding_dim = hparams.embedding_dim * hparams.t_order
+        hparams.layerwise_inference = getattr(hparams, "layerwise_inference", False)
+        hparams.inference_chunk_size = getattr(hparams, "inference_chunk_size", 10000)
 
         self.classifier = DenseClassification(hparams)
         # self.classifier = MulticlassClassification(num_feature=hparams.embedding_dim,
@@ -81,6 +95,9 @@ class LATTENodeClassifier(NodeClfMetrics):
         return outputs
 
     def validation_step(self, batch, batch_nb):
+        if self.hparams.layerwise_inference:
+            return {"val_loss": self.inference_step(batch, metrics=self.valid_metrics)}
+
         X, y, weights = batch
         y_hat, proximity_loss = self.forward(X)
 
@@ -100,6 +117,9 @@ class LATTENodeClassifier(NodeClfMetrics):
         return {"val_loss": val_loss}
 
     def test_step(self, batch, batch_nb):
+        if self.hparams.layerwise_inference:
+            return {"test_loss": self.inference_step(batch, metrics=self.test_metrics)}
+
         X, y, weights = batch
         y_hat, proximity_loss = self.forward(X, save_betas=True)
         if isinstance(y, dict) and len(y) > 1:
@@ -117,12 +137,57 @@ class LATTENodeClassifier(NodeClfMetrics):
 
         return {"test_loss": test_loss}
 
+    def inference_step(self, node_idx, metrics):
+        """
+        Classify the `head_node_type` nodes `node_idx` with their embeddings from `LATTE.inference()`, which are computed
+        on the full graph at the first batch of the epoch.
+        """
+        if getattr(self, "_embeddings", None) is None:
+            self._embeddings = self.latte.inference(X=getattr(self.dataset, "x_dict", {}),
+                                                    edge_index_dict=self.dataset.edge_index_dict,
+                                                    num_nodes_dict=self.dataset.num_nodes_dict,
+                                                    node_types=[self.head_node_type],
+                                                    chunk_size=self.hparams.inference_chunk_size)[self.head_node_type]
+
+        node_idx = node_idx.cpu()
+        y_hat = self.classifier.forward(self._embeddings[node_idx].to(self.device))
+        y = self.dataset.y_dict[self.head_node_type][node_idx.to(self.dataset.y_dict[self.head_node_type].device)] \
+            .squeeze(-1).to(self.device)
+        weights = (y != -1).to(torch.float) if y.dim() == 1 else None
+
+        y_hat, y = filter_samples(Y_hat=y_hat, Y=y, weights=weights)
+        metrics.update_metrics(y_hat, y, weights=None)
+        return self.criterion.forward(y_hat, y)
+
+    def on_validation_epoch_start(self):
+        # The relation weights recorded at the last eval epoch are readable with get_relation_weights() until here
+        self.latte.reset_attn_recorders()
+
+    def on_test_epoch_start(self):
+        self.latte.reset_attn_recorders()
+
+    def validation_epoch_end(self, outputs):
+        self._embeddings = None
+        self.flush_attn_weights(f"epoch={self.current_epoch}")
+        return super().validation_epoch_end(outputs)
+
+    def test_epoch_end(self, outputs):
+        self._embeddings = None
+        self.flush_attn_weights("test")
+        return super().test_epoch_end(outputs)
+
+    def flush_attn_weights(self, name):
+        if getattr(self.hparams, "attn_record_dir", None) is None: return
+        self.latte.flush_attn_weights(os.path.join(os.path.expanduser(self.hparams.attn_record_dir), name))
+
     def train_dataloader(self):
         return self.dataset.train_dataloader(collate_fn=self.collate_fn,
                                              batch_size=self.hparams.batch_size,
                                              num_workers=int(0.4 * multiprocessing.cpu_count()))
 
     def val_dataloader(self, batch_size=None):
+        if self.hparams.layerwise_inference:
+            return DataLoader(self.dataset.validation_idx, batch_size=self.hparams.batch_size, shuffle=False)
         return self.dataset.valid_dataloader(collate_fn=self.collate_fn,
                                              batch_size=self.hparams.batch_size,
                                              num_workers=max(1, int(0.1 * multiprocessing.cpu_count())))
@@ -133,6 +198,8 @@ class LATTENodeClassifier(NodeClfMetrics):
                                                 num_workers=max(1, int(0.1 * multiprocessing.cpu_count())))
 
     def test_dataloader(self, batch_size=None):
+        if self.hparams.layerwise_inference:
+            return DataLoader(self.dataset.testing_idx, batch_size=self.hparams.batch_size, shuffle=False)
         return self.dataset.test_dataloader(collate_fn=self.collate_fn,
                                             batch_size=self.hparams.batch_size,
                                             num_workers=max(1, int(0.1 * multiprocessing.cpu_count())))
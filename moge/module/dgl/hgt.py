@@ -97,8 +97,9 @@ class HGTLayer(nn.Module):
                   This implementation will do softmax only on edges belong to the same relation type, instead of for all of the edges.
         '''
         # print(nodes.ntype, nodes.data.keys(), nodes.mailbox)
-        att = F.softmax(nodes.mailbox['a'], dim=1)
-        h = torch.sum(att.unsqueeze(dim=-1) * nodes.mailbox['v'], dim=1)
+        # Softmax and sum in fp32 under mixed precision, then cast back to the dtype of the messages
+        att = F.softmax(nodes.mailbox['a'], dim=1, dtype=torch.float)
+        h = torch.sum(att.unsqueeze(dim=-1) * nodes.mailbox['v'].float(), dim=1).to(nodes.mailbox['v'].dtype)
         return {'t': h.view(-1, self.out_dim)}
 
     def apply_node_func(self, nodes: NodeBatch):
@@ -274,7 +274,9 @@ class LATTEConv(nn.Module):
         emb_relations = torch.zeros(
             size=(global_node_idx[node_type].size(0),
                   self.num_head_relations(node_type),
-                  self.embedding_dim)).type_as(self.conv[node_type].weight)
+                  self.embedding_dim),
+            dtype=torch.promote_types(self.conv[node_type].weight.dtype, torch.float),
+            device=self.conv[node_type].weight.device)
 
         for i, metapath in enumerate(self.get_head_relations(node_type)):
             if metapath not in edge_index_dict or edge_index_dict[metapath] == None: continue
@@ -292,7 +294,7 @@ class LATTEConv(nn.Module):
                 metapath_idx=self.metapaths.index(metapath))
             emb_relations[:, i] = out
 
-        return emb_relations
+        return emb_relations.to(l_dict[node_type].dtype)
 
     def edge_attention(self, edges: EdgeBatch):
         srctype, etype, dsttype = edges.canonical_etype
@@ -310,17 +312,18 @@ class LATTEConv(nn.Module):
                   This implementation will do softmax only on edges belong to the same relation type, instead of for all of the edges.
         '''
         # print(nodes.ntype, nodes.data.keys(), nodes.mailbox)
-        att = F.softmax(nodes.mailbox['a'], dim=1)
-        h = torch.sum(att.unsqueeze(dim=-1) * nodes.mailbox['v'], dim=1)
+        # Softmax and sum in fp32 under mixed precision, then cast back to the dtype of the messages
+        att = F.softmax(nodes.mailbox['a'], dim=1, dtype=torch.float)
+        h = torch.sum(att.unsqueeze(dim=-1) * nodes.mailbox['v'].float(), dim=1).to(nodes.mailbox['v'].dtype)
         return {'t': h.view(-1, self.out_dim)}
 
     def message(self, x_j, alpha_j, alpha_i, index, ptr, size_i, metapath_idx):
         alpha = alpha_j if alpha_i is None else alpha_j + alpha_i
         # alpha = self.attn_q[metapath_idx].forward(torch.cat([alpha_i, alpha_j], dim=1))
         alpha = self.attn_activation(alpha, metapath_idx)
-        alpha = softmax(alpha, index=index, ptr=ptr, num_nodes=size_i)
+        alpha = softmax(alpha.float(), index=index, ptr=ptr, num_nodes=size_i)
         alpha = F.dropout(alpha, p=self.attn_dropout, training=self.training)
-        return x_j * alpha
+        return x_j * alpha.to(x_j.dtype)
 
     def get_h_dict(self, input, global_node_idx):
         h_dict = {}
@@ -356,7 +359,7 @@ class LATTEConv(nn.Module):
             else:
                 beta[node_type] = self.conv[node_type].forward(h_prev[node_type].unsqueeze(-1))
 
-            beta[node_type] = torch.softmax(beta[node_type], dim=1)
+            beta[node_type] = torch.softmax(beta[node_type], dim=1, dtype=torch.float).to(beta[node_type].dtype)
         return beta
 
     def predict_scores(self, edge_index, alpha_l, alpha_r, metapath, logits=False):
@@ -462,12 +465,12 @@ class LATTEConv(nn.Module):
         self._beta_std = {}
         for node_type in beta:
             with torch.no_grad():
-                self._betas[node_type] = pd.DataFrame(beta[node_type].squeeze(-1).cpu().numpy(),
+                self._betas[node_type] = pd.DataFrame(beta[node_type].squeeze(-1).float().cpu().numpy(),
                                                       columns=self.get_head_relations(node_type, True) + [node_type, ],
                                                       index=global_node_idx[node_type].cpu().numpy())
 
-                _beta_avg = np.around(beta[node_type].mean(dim=0).squeeze(-1).cpu().numpy(), decimals=3)
-                _beta_std = np.around(beta[node_type].std(dim=0).squeeze(-1).cpu().numpy(), decimals=2)
+                _beta_avg = np.around(beta[node_type].float().mean(dim=0).squeeze(-1).cpu().numpy(), decimals=3)
+                _beta_std = np.around(beta[node_type].float().std(dim=0).squeeze(-1).cpu().numpy(), decimals=2)
                 self._beta_avg[node_type] = {metapath: _beta_avg[i] for i, metapath in
                                              enumerate(self.get_head_relations(node_type, True) + [node_type])}
                 self._beta_std[node_type] = {metapath: _beta_std[i] for i, metapath in
@@ -481,7 +484,7 @@ class LATTEConv(nn.Module):
         if not hasattr(self, "_beta_std"):
             self._beta_std = {}
 
-        betas = attn_weights.sum(1)
+        betas = attn_weights.float().sum(1)
         with torch.no_grad():
             self._betas[node_type] = pd.DataFrame(betas.cpu().numpy(),
                                                   columns=self.get_head_relations(node_type, True) + [node_type, ],
@@ -0,0 +1,296 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torch import nn as nn
+
+
+class HybridEmbedding(nn.Module):
+    def __init__(self, num_embeddings: int, embedding_dim: int, cache_size=500000, lr=0.01, eps=1e-10,
+                 decay_steps=100, path=None):
+        """
+        An embedding table whose master copy is kept in CPU memory (or memory-mapped at `path`), with a cache of
+        the most frequently used rows on the module's device. Missing rows are loaded to the cache at lookup,
+        evicting the least frequently used rows not in the batch, whose values are written back to the master table
+        in a background thread. Access counts are halved every `decay_steps` lookups, so that the cache follows the
+        recently hot rows.
+
+        The rows are trained with a row-wise Adagrad update, so the table is never part of the dense optimizer's
+        parameters and only the rows of the batches are touched. The backward pass of the lookup only accumulates the
+        gradients of the rows, which are applied by `step()` after the model's optimizer step (see
+        `NodeClfMetrics.optimizer_step()`), so that gradient accumulation and clipping also apply to them.
+
+        :param num_embeddings: number of rows
+        :param embedding_dim: size of each row
+        :param cache_size: number of rows cached on the device. The cache is grown if a batch has more unique rows.
+        :param lr: learning rate of the row-wise Adagrad update
+        :param eps: Adagrad epsilon
+        :param decay_steps: number of lookups between each decay of the access counts
+        :param path: default None. If given, the master table and optimizer state are memory-mapped .npy files in
+            this directory, and an existing table there is reused.
+        """
+        super(HybridEmbedding, self).__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.lr = lr
+        self.eps = eps
+        self.decay_steps = decay_steps
+        self.path = path
+
+        if path is not None:
+            self.memmaps = self.open_master(path, num_embeddings, embedding_dim)
+            self.weight_master, self.state_master = [torch.from_numpy(array) for array in self.memmaps]
+        else:
+            self.memmaps = None
+            self.weight_master = torch.empty((num_embeddings, embedding_dim))
+            self.state_master = torch.zeros(num_embeddings)
+
+        cache_size = min(cache_size, num_embeddings)
+        self.register_buffer("cache_weight", torch.zeros((cache_size, embedding_dim)), persistent=False)
+        self.register_buffer("cache_state", torch.zeros(cache_size), persistent=False)
+        self.register_buffer("cache_keys", torch.full((cache_size,), -1, dtype=torch.long), persistent=False)
+        self.register_buffer("cache_counts", torch.zeros(cache_size), persistent=False)
+        # Cache slot of each row, or -1
+        self.register_buffer("slots", torch.full((num_embeddings,), -1, dtype=torch.long), persistent=False)
+
+        self.steps = 0
+        # Gradients accumulated by backward passes since the last step()
+        self.grad_ids, self.grads = [], []
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+
+        if path is None or not os.path.exists(os.path.join(path, "initialized")):
+            self.reset_parameters()
+
+    @staticmethod
+    def open_master(path, num_embeddings, embedding_dim):
+        os.makedirs(path, exist_ok=True)
+        files = [os.path.join(path, "weight.npy"), os.path.join(path, "state.npy")]
+        if all(os.path.exists(file) for file in files):
+            weight, state = [np.load(file, mmap_mode="r+") for file in files]
+            if weight.shape != (num_embeddings, embedding_dim):
+                raise Exception(f"The embedding table at {path} has shape {weight.shape}, "
+                                f"not {(num_embeddings, embedding_dim)}")
+        else:
+            weight = np.lib.format.open_memmap(files[0], mode="w+", dtype=np.float32,
+                                               shape=(num_embeddings, embedding_dim))
+            state = np.lib.format.open_memmap(files[1], mode="w+", dtype=np.float32, shape=(num_embeddings,))
+        return weight, state
+
+    def reset_parameters(self):
+        self.wait()
+        self.weight_master.normal_()
+        self.state_master.zero_()
+        self.clear_cache()
+        if self.path is not None:
+            open(os.path.join(self.path, "initialized"), "w").close()
+
+    def clear_cache(self):
+        self.slots.fill_(-1)
+        self.cache_keys.fill_(-1)
+        self.cache_counts.zero_()
+
+    @property
+    def device(self):
+        return self.cache_weight.device
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        """
+        :param input: tensor of row indices
+        :return: tensor of size (*input.shape, embedding_dim) on the module's device
+        """
+        input = input.to(self.device)
+        ids, inverse = torch.unique(input.view(-1), return_inverse=True)
+        slots = self.load_rows(ids)
+
+        self.cache_counts[slots] += 1
+        self.steps += 1
+        if self.steps % self.decay_steps == 0:
+            self.cache_counts.mul_(0.5)
+
+        if self.training and torch.is_grad_enabled():
+            anchor = torch.empty(0, device=self.device, requires_grad=True)
+            output = _CachedLookup.apply(anchor, self, ids, slots, inverse)
+        else:
+            output = self.cache_weight[slots[inverse]]
+        return output.view(*input.shape, self.embedding_dim)
+
+    def load_rows(self, ids: torch.Tensor) -> torch.Tensor:
+        """
+        Load the rows `ids` missing from the cache.
+        :return: the cache slots of `ids`
+        """
+        slots = self.slots[ids]
+        missing = slots < 0
+        missing_ids = ids[missing]
+        if missing_ids.numel() == 0:
+            return slots
+
+        if ids.numel() > self.cache_weight.size(0):
+            self.grow_cache(ids.numel())
+
+        # Evict the free or least frequently used slots which are not in the batch
+        scores = self.cache_counts.clone()
+        scores[self.cache_keys < 0] = -1
+        scores[slots[~missing]] = float("inf")
+        victims = torch.topk(scores, k=missing_ids.numel(), largest=False).indices
+
+        # Rows evicted by previous batches must be written back before reading them from the master table, but the
+        # rows evicted by this batch are written in the background
+        pending, self.futures = self.futures, []
+        evicted = self.cache_keys[victims] >= 0
+        if evicted.any():
+            evicted_slots, evicted_ids = victims[evicted], self.cache_keys[victims[evicted]]
+            self.write_rows(evicted_ids, self.cache_weight[evicted_slots], self.cache_state[evicted_slots])
+            self.slots[evicted_ids] = -1
+
+        for future in pending:
+            future.result()
+        missing_ids_cpu = missing_ids.cpu()
+        weight, state = self.weight_master[missing_ids_cpu], self.state_master[missing_ids_cpu]
+        if self.device.type == "cuda":
+            weight, state = weight.pin_memory(), state.pin_memory()
+        self.cache_weight[victims] = weight.to(self.device, non_blocking=True)
+        self.cache_state[victims] = state.to(self.device, non_blocking=True)
+        self.cache_keys[victims] = missing_ids
+        self.cache_counts[victims] = 0
+        self.slots[missing_ids] = victims
+
+        slots[missing] = victims
+        return slots
+
+    def write_rows(self, ids: torch.Tensor, weight: torch.Tensor, state: torch.Tensor):
+        def write(ids, weight, state):
+            ids = ids.cpu()
+            self.weight_master[ids] = weight.cpu()
+            self.state_master[ids] = state.cpu()
+
+        # `weight` and `state` are gathered copies, so the cache slots can be overwritten before the write is done
+        self.futures.append(self.executor.submit(write, ids, weight, state))
+
+    def wait(self):
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def grow_cache(self, cache_size: int):
+        cache_size = min(max(cache_size, int(1.5 * self.cache_weight.size(0))), self.num_embeddings)
+        print(f"WARNING: HybridEmbedding cache grown from {self.cache_weight.size(0)} to {cache_size} rows")
+        num_new = cache_size - self.cache_weight.size(0)
+        self.cache_weight = torch.cat([self.cache_weight, self.cache_weight.new_zeros((num_new, self.embedding_dim))])
+        self.cache_state = torch.cat([self.cache_state, self.cache_state.new_zeros(num_new)])
+        self.cache_keys = torch.cat([self.cache_keys, self.cache_keys.new_full((num_new,), -1)])
+        self.cache_counts = torch.cat([self.cache_counts, self.cache_counts.new_zeros(num_new)])
+
+    @torch.no_grad()
+    def apply_gradients(self, ids: torch.Tensor, grad: torch.Tensor):
+        """
+        Row-wise Adagrad update of the rows `ids` with `grad` of size (len(ids), embedding_dim). Rows which were
+        evicted since their lookup are updated in the master table.
+        """
+        slots = self.slots[ids]
+        cached = slots >= 0
+        if not cached.all():
+            self.wait()
+            evicted_ids, evicted_grad = ids[~cached].cpu(), grad[~cached].cpu()
+            self.state_master[evicted_ids] += evicted_grad.pow(2).mean(dim=1)
+            std = self.state_master[evicted_ids].sqrt().add_(self.eps)
+            self.weight_master[evicted_ids] -= self.lr * evicted_grad / std.unsqueeze(1)
+            slots, grad = slots[cached], grad[cached]
+
+        self.cache_state[slots] += grad.pow(2).mean(dim=1)
+        std = self.cache_state[slots].sqrt().add_(self.eps)
+        self.cache_weight[slots] -= self.lr * grad / std.unsqueeze(1)
+
+    def accumulate_gradients(self, ids: torch.Tensor, grad: torch.Tensor):
+        self.grad_ids.append(ids)
+        self.grads.append(grad)
+
+    def zero_grad(self):
+        self.grad_ids, self.grads = [], []
+
+    def pending_gradients(self):
+        """
+        :return: ids, grad: the rows with gradients accumulated since the last `step()` and their summed gradients, or
+            None, None
+        """
+        if len(self.grad_ids) == 0:
+            return None, None
+        ids, inverse = torch.unique(torch.cat(self.grad_ids), return_inverse=True)
+        grad = self.cache_weight.new_zeros((ids.size(0), self.embedding_dim)).index_add_(0, inverse,
+                                                                                           torch.cat(self.grads))
+        return ids, grad
+
+    @torch.no_grad()
+    def step(self, max_norm: float = None, grad_scale=1.0) -> bool:
+        """
+        Apply the gradients accumulated since the last step, then clear them. Gradients with non-finite values are
+        skipped, like the optimizer step of a GradScaler.
+
+        :param max_norm: default None. If given, the gradients are clipped to this total norm.
+        :param grad_scale: the loss scale of mixed precision training, which the gradients are divided by
+        :return: whether any gradients were applied
+        """
+        ids, grad = self.pending_gradients()
+        self.zero_grad()
+        if ids is None:
+            return False
+
+        if grad_scale != 1.0:
+            grad.div_(grad_scale)
+        if not torch.isfinite(grad).all():
+            print("WARNING: skipped HybridEmbedding step with non-finite gradients")
+            return False
+
+        if max_norm:
+            grad.mul_((max_norm / (grad.norm() + 1e-6)).clamp(max=1.0))
+        self.apply_gradients(ids, grad)
+        return True
+
+    def flush(self):
+        """
+        Write all the cached rows back to the master table, e.g. before saving it.
+        """
+        cached = self.cache_keys >= 0
+        self.write_rows(self.cache_keys[cached], self.cache_weight[cached], self.cache_state[cached])
+        self.wait()
+        if self.memmaps is not None:
+            for array in self.memmaps:
+                array.flush()
+
+    @property
+    def weight(self) -> torch.Tensor:
+        """
+        The full table on CPU, with the cached rows written back.
+        """
+        self.flush()
+        return self.weight_master
+
+    def get_extra_state(self):
+        self.flush()
+        return {"weight": self.weight_master.clone(), "state": self.state_master.clone()}
+
+    def set_extra_state(self, state):
+        self.wait()
+        self.weight_master.copy_(state["weight"])
+        self.state_master.copy_(state["state"])
+        self.clear_cache()
+
+    def extra_repr(self):
+        return f"{self.num_embeddings}, {self.embedding_dim}, cache_size={self.cache_weight.size(0)}"
+
+
+class _CachedLookup(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, anchor, module: HybridEmbedding, ids, slots, inverse):
+        ctx.module = module
+        ctx.save_for_backward(ids, inverse)
+        return module.cache_weight[slots[inverse]]
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        ids, inverse = ctx.saved_tensors
+        grad = grad_output.new_zeros((ids.size(0), grad_output.size(1))).index_add_(0, inverse, grad_output)
+        ctx.module.accumulate_gradients(ids, grad.to(ctx.module.cache_weight.dtype))
+        return None, None, None, None, None
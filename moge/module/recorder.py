@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import torch
+
+from moge.generator.splits import hash_uniform
+
+
+class RelationWeightRecorder(object):
+    def __init__(self, num_nodes_dict: dict, relations_dict: dict, sample_rate=1.0, seed=0, dtype=torch.float):
+        """
+        Records the relation attention weights (beta) of a LATTE layer for each node, into buffers of size
+        (num_sampled_nodes, num_relations) with one row per sampled node. Buffers are allocated on the device of the
+        first recorded batch, and `update()` only launches scatter ops without synchronizing the device. `flush()` writes
+        the recorded rows to disk in a background thread.
+
+        :param num_nodes_dict: Dict of <node_type>:<number of nodes>
+        :param relations_dict: Dict of <node_type>:<list of the names of its beta columns>
+        :param sample_rate: fraction of the nodes to record. The same nodes are recorded at every epoch, since nodes
+            are sampled by a hash of their global node index. If < 1, the buffers only have rows for the sampled nodes,
+            which are looked up by a binary search in their sorted global node index.
+        :param seed: seed of the node sampling hash
+        :param dtype: dtype of the buffers
+        """
+        self.num_nodes_dict = num_nodes_dict
+        self.relations_dict = relations_dict
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self.dtype = dtype
+
+        self.weights = {}
+        self.recorded = {}
+        # Sorted global node index of the sampled nodes, i.e. of the buffer rows, if sample_rate < 1
+        self.node_ids = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+
+    def get_sampled_nodes(self, num_nodes: int, chunk_size=2 ** 22) -> torch.Tensor:
+        """
+        :return: the sorted global node index of the nodes recorded out of `num_nodes`, hashed in chunks on CPU
+        """
+        sampled = []
+        for start in range(0, num_nodes, chunk_size):
+            ids = torch.arange(start, min(start + chunk_size, num_nodes))
+            sampled.append(ids[hash_uniform(ids, seed=self.seed) < self.sample_rate])
+        return torch.cat(sampled) if len(sampled) else torch.empty(0, dtype=torch.long)
+
+    def get_buffers(self, node_type, device):
+        if node_type not in self.weights:
+            num_rows = self.num_nodes_dict[node_type]
+            if self.sample_rate < 1.0:
+                self.node_ids[node_type] = self.get_sampled_nodes(num_rows).to(device)
+                num_rows = self.node_ids[node_type].size(0)
+            self.weights[node_type] = torch.zeros((num_rows, len(self.relations_dict[node_type])),
+                                                  dtype=self.dtype, device=device)
+            self.recorded[node_type] = torch.zeros(num_rows, dtype=torch.bool, device=device)
+        return self.weights[node_type], self.recorded[node_type]
+
+    def get_node_idx(self, node_type, rows: torch.Tensor) -> torch.Tensor:
+        """
+        :return: the global node index of the buffer `rows` of `node_type`
+        """
+        return self.node_ids[node_type][rows] if node_type in self.node_ids else rows
+
+    @torch.no_grad()
+    def update(self, beta: dict, global_node_idx: dict):
+        """
+        :param beta: Dict of <node_type>:<tensor size (batch_size, num_relations, 1)>
+        :param global_node_idx: Dict of <node_type>:<tensor size (batch_size,)>
+        """
+        for node_type, node_beta in beta.items():
+            if node_type not in self.relations_dict: continue
+            weights, recorded = self.get_buffers(node_type, device=node_beta.device)
+            node_idx = global_node_idx[node_type].to(node_beta.device)
+            node_beta = node_beta.view(node_idx.size(0), -1)
+
+            if self.sample_rate < 1.0:
+                mask = hash_uniform(node_idx, seed=self.seed) < self.sample_rate
+                node_idx, node_beta = node_idx[mask], node_beta[mask]
+                # The sampled nodes of the batch are all in node_ids, since they're selected by the same hash
+                rows = torch.searchsorted(self.node_ids[node_type], node_idx)
+            else:
+                rows = node_idx
+
+            weights.index_copy_(0, rows, node_beta.to(weights.dtype))
+            recorded[rows] = True
+
+    def reset(self):
+        for node_type in self.recorded:
+            self.recorded[node_type].fill_(False)
+
+    def flush(self, path: str, blocking=False):
+        """
+        Write the weights of the nodes recorded since the last `reset()` to `path`, as one `{node_type}.npz` per node
+        type with a "node_idx" column and one column per relation. The buffers are copied on device before the write, so
+        that recording can resume right away, and they stay readable by `get_relation_weights()` until reset.
+
+        :param path: directory to write to
+        :param blocking: whether to wait for the write to finish
+        """
+        snapshot = {node_type: (self.weights[node_type].clone(), self.recorded[node_type].clone()) \
+                    for node_type in self.weights}
+        self.futures.append(self.executor.submit(self._write, path, snapshot))
+        if blocking:
+            self.wait()
+
+    def _write(self, path: str, snapshot: dict):
+        os.makedirs(path, exist_ok=True)
+        for node_type, (weights, recorded) in snapshot.items():
+            rows = recorded.nonzero().view(-1)
+            weights = weights[rows].float().cpu().numpy()
+            node_idx = self.get_node_idx(node_type, rows)
+            columns = {relation: weights[:, i] for i, relation in enumerate(self.relations_dict[node_type])}
+            np.savez(os.path.join(path, f"{node_type}.npz"), node_idx=node_idx.cpu().numpy(), **columns)
+
+    def wait(self):
+        """
+        Wait for the pending writes to finish, raising their exceptions if any.
+        """
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def to_dataframe(self, node_type) -> pd.DataFrame:
+        """
+        :return: a DataFrame of the recorded weights of `node_type`, indexed by the global node index
+        """
+        if node_type not in self.weights:
+            return pd.DataFrame(columns=self.relations_dict[node_type])
+        rows = self.recorded[node_type].nonzero().view(-1)
+        return pd.DataFrame(self.weights[node_type][rows].float().cpu().numpy(),
+                            columns=self.relations_dict[node_type],
+                            index=self.get_node_idx(node_type, rows).cpu().numpy())
+
+    def get_relation_weights(self) -> dict:
+        """
+        :return: Dict of <relation>:<(mean, std) of its weights over the recorded nodes>
+        """
+        output = {}
+        for node_type in self.weights:
+            node_weights = self.weights[node_type][self.recorded[node_type]].float()
+            if node_weights.size(0) == 0: continue
+            avg = np.around(node_weights.mean(dim=0).cpu().numpy(), decimals=3)
+            std = np.around(node_weights.std(dim=0).cpu().numpy(), decimals=2)
+            for i, relation in enumerate(self.relations_dict[node_type]):
+                output[relation] = (avg[i], std[i])
+        return output
+
+    @staticmethod
+    def load(path: str) -> dict:
+        """
+        Load the weights written by `flush()`.
+        :return: Dict of <node_type>:<DataFrame indexed by the global node index>
+        """
+        output = {}
+        for file in sorted(os.listdir(path)):
+            if not file.endswith(".npz"): continue
+            with np.load(os.path.join(path, file)) as columns:
+                output[file[:-len(".npz")]] = pd.DataFrame({key: columns[key] for key in columns.files \
+                                                            if key != "node_idx"}, index=columns["node_idx"])
+        return output
@@ -1,29 +1,63 @@
-import random
-
-import numpy as np
 import torch
 
 
-def negative_sample(edge_index, M: int, N: int, n_sample_per_edge: int):
+def edge_keys(edge_index, N: int):
+    """
+    Encode each edge (i, j) as a 64-bit key N * i + j.
+    :param edge_index: Tensor of shape (2, num_edges)
+    :param N: Number of tail nodes
+    :return: Tensor of shape (num_edges,) of dtype torch.long
+    """
+    return edge_index[0].to(torch.long) * N + edge_index[1].to(torch.long)
+
+
+def isin_sorted(keys, sorted_keys):
+    """
+    Membership test of `keys` in `sorted_keys` with a binary search, on the device of the tensors.
+    :param keys: Tensor of keys to test
+    :param sorted_keys: 1-D Tensor of unique keys in ascending order, e.g. from `Tensor.unique()`
+    :return: A bool Tensor of the same shape as `keys`
+    """
+    if sorted_keys.numel() == 0:
+        return torch.zeros_like(keys, dtype=torch.bool)
+
+    idx = torch.searchsorted(sorted_keys, keys).clamp_(max=sorted_keys.numel() - 1)
+    return sorted_keys[idx] == keys
+
+
+def negative_sample(edge_index, M: int, N: int, n_sample_per_edge: int, strict=True):
+    """
+    Sample random (head, tail) pairs in the range of (M, N) that are not in `edge_index`. The positive edges are encoded
+    as sorted 64-bit keys and all sampling and membership tests run on the device of `edge_index`.
+
+    :param edge_index: Tensor of shape (2, num_edges) of positive edges
+    :param M: Number of head nodes of the metapath
+    :param N: Number of tail nodes of the metapath
+    :param n_sample_per_edge: Number of negative edges to sample per positive edge
+    :param strict: If True, resample the pairs that collide with positive edges until none remain. If False, colliding
+        pairs are dropped after a single pass, so fewer negative edges may be returned.
+    :return: neg_edge_index, a Tensor of shape (2, num_neg_samples)
+    """
     num_neg_samples = edge_index.size(1) * n_sample_per_edge
     num_neg_samples = int(min(num_neg_samples, M * N - edge_index.size(1)))
-    rng = range(M * N)
-    idx = (edge_index[0] * N + edge_index[1]).to('cpu')  # idx = N * i + j
+    if num_neg_samples <= 0:
+        return torch.empty((2, 0), dtype=torch.long, device=edge_index.device)
 
-    perm = torch.tensor(random.sample(rng, num_neg_samples))
-    mask = torch.from_numpy(np.isin(perm, idx)).to(torch.bool)
-    rest = mask.nonzero().view(-1)
-    while rest.numel() > 0:  # pragma: no cover
-        tmp = torch.tensor(random.sample(rng, rest.size(0)))
-        mask = torch.from_numpy(np.isin(tmp, idx)).to(torch.bool)
-        perm[rest] = tmp
-        rest = rest[mask.nonzero().view(-1)]
+    pos_keys = edge_keys(edge_index, N).unique()
 
-    row = perm // N
-    col = perm % N
-    neg_edge_index = torch.stack([row, col], dim=0).long()
+    neg_keys = torch.randint(0, M * N, (num_neg_samples,), dtype=torch.long, device=edge_index.device)
+    mask = isin_sorted(neg_keys, pos_keys)
+    if strict:
+        rest = mask.nonzero().view(-1)
+        while rest.numel() > 0:  # pragma: no cover
+            tmp = torch.randint(0, M * N, (rest.size(0),), dtype=torch.long, device=edge_index.device)
+            neg_keys[rest] = tmp
+            rest = rest[isin_sorted(tmp, pos_keys)]
+    else:
+        neg_keys = neg_keys[~mask]
 
-    return neg_edge_index.to(edge_index.device)
+    neg_edge_index = torch.stack([neg_keys // N, neg_keys % N], dim=0)
+    return neg_edge_index
 
 
 def negative_sample_head_tail(edge_index, M: int, N: int, n_sample_per_edge: int):
@@ -37,10 +71,10 @@ def negative_sample_head_tail(edge_index, M: int, N: int, n_sample_per_edge: int
     """
     K = int(min(n_sample_per_edge, (M * N) / edge_index.size(1))) // 2
 
-    sampled_tails = torch.randint(0, N, (edge_index[0].size(0) * K,), dtype=torch.long)
-    sampled_heads = torch.randint(0, M, (edge_index[1].size(0) * K,), dtype=torch.long)
-    neg_tail_batch = torch.stack((edge_index[0].cpu().repeat_interleave(K), sampled_tails))
-    neg_head_batch = torch.stack((sampled_heads, edge_index[1].cpu().repeat_interleave(K)))
+    sampled_tails = torch.randint(0, N, (edge_index[0].size(0) * K,), dtype=torch.long, device=edge_index.device)
+    sampled_heads = torch.randint(0, M, (edge_index[1].size(0) * K,), dtype=torch.long, device=edge_index.device)
+    neg_tail_batch = torch.stack((edge_index[0].repeat_interleave(K), sampled_tails))
+    neg_head_batch = torch.stack((sampled_heads, edge_index[1].repeat_interleave(K)))
 
     neg_edge_index = torch.cat((neg_tail_batch, neg_head_batch), dim=1)
-    return neg_edge_index.to(edge_index.device)
+    return neg_edge_index
@@ -474,7 +474,7 @@ class SiameseGraphEmbedding(ImportedGraphEmbedding, BaseEstimator):
             self.process_embeddings(variable_length, batch_size=self.batch_size, minlen=minlen)
 
         if node_list is not None:
-            idx = [self.node_list.index(node) for node in node_list if node in self.node_list]
+            idx = [self.node_index.index[node] for node in node_list if node in self.node_index]
             return self._X[idx, :]
         else:
             return self._X
@@ -536,8 +536,8 @@ class SiameseGraphEmbedding(ImportedGraphEmbedding, BaseEstimator):
 
     def get_edge_weight(self, i, j, edge_type='d'):
         if not type(i) == int or type(j) == int:
-            i_idx = self.node_list.index(i)
-            j_idx = self.node_list.index(j)
+            i_idx = self.node_index.index[i]
+            j_idx = self.node_index.index[j]
 
         return self.get_reconstructed_adj(edge_type=edge_type)[i_idx, j_idx]
 
@@ -1,3 +1,4 @@
+import os
 from abc import ABCMeta
 from multiprocessing import cpu_count, Pool
 
@@ -9,7 +10,9 @@ from sklearn.decomposition import PCA
 from sklearn.metrics import pairwise_distances
 
 from moge.evaluation.clustering import _get_top_enrichr_term, chunkIt
-from moge.evaluation.utils import get_scalefree_fit_score, largest_indices
+from moge.evaluation.utils import get_scalefree_fit_score, largest_indices, blocked_top_k, blocked_column_logsumexp
+from moge.network.base import NodeIndex, NodeIndexMixin
+from moge.utils.embedding_store import EmbeddingStore
 
 
 class BaseGraphEmbedding:
@@ -84,7 +87,7 @@ class BaseGraphEmbedding:
         pass
 
 
-class ImportedGraphEmbedding(BaseGraphEmbedding):
+class ImportedGraphEmbedding(NodeIndexMixin, BaseGraphEmbedding):
     __metaclass__ = ABCMeta
 
     def __init__(self, d, method_name="ImportedGraphEmbedding"):
@@ -128,8 +131,8 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
         '''
         if node_list is None:
             return self._X
-        elif set(node_list) <= set(self.node_list):
-            idx = [self.node_list.index(node) for node in node_list]
+        elif all(node in self.node_index for node in node_list):
+            idx = self.node_index.get_index(node_list)
             return self._X[idx, :]
         else:
             raise Exception("node_list contains a node not included in trained embeddings")
@@ -145,9 +148,20 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
         '''
         raise NotImplementedError()
 
-    def save_embeddings(self, file_path):
+    def save_embeddings(self, file_path, binary=False, dtype="float32"):
+        """
+        :param file_path: path of the word2vec-style text file, or the directory of the EmbeddingStore if `binary`
+        :param binary: whether to save to a binary, memory-mapped EmbeddingStore
+        :param dtype: one of {"float32", "float16"}, the dtype of the EmbeddingStore
+        """
         embs = self.get_embeddings()
         assert len(self.node_list) == embs.shape[0]
+        if binary:
+            store = EmbeddingStore.create(file_path, dim=embs.shape[1], dtype=dtype, overwrite=True)
+            store.append(self.node_list, embs)
+            print("Saved at", file_path)
+            return
+
         fout = open(file_path, 'w')
         fout.write("{} {}\n".format(len(self.node_list), self.embedding_d))
         for i in range(len(self.node_list)):
@@ -156,8 +170,28 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
         fout.close()
         print("Saved at", file_path)
 
-    def import_embedding(self, file, node_list):
+    def import_embedding(self, file, node_list, binary=None):
+        """
+        :param file: path of the word2vec-style text file, or the directory of an EmbeddingStore
+        :param node_list: the nodes to import, in order. Nodes not in the embedding file are skipped.
+        :param binary: whether `file` is an EmbeddingStore. Default is True if `file` is a directory.
+        """
         self.imported = True
+        if binary is None:
+            binary = os.path.isdir(file)
+        if binary:
+            # Only read the rows of the nodes in node_list from the memory-map
+            store = EmbeddingStore(file)
+            self.node_list = [node for node in node_list if node in store]
+            self._X = store.get_embeddings(self.node_list)
+            self.embedding_d = store.dim
+            if self.get_method_name() == "rna2rna":
+                self.embedding_s = self._X[:, 0: int(self.embedding_d / 2)]
+                self.embedding_t = self._X[:, int(self.embedding_d / 2): int(self.embedding_d)]
+
+            print(self.get_method_name(), "imported", self._X.shape)
+            return
+
         with open(file, "r") as fin:
             node_num, size = [int(x) for x in fin.readline().strip().split()]
             vectors = {}
@@ -253,11 +287,11 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
 
     def _select_adj_indices(self, adj, node_list_A, node_list_B=None):
         if node_list_B is None:
-            idx = [self.node_list.index(node) for node in node_list_A]
+            idx = self.node_index.get_index(node_list_A)
             return adj[idx, :][:, idx]
         else:
-            idx_A = [self.node_list.index(node) for node in node_list_A]
-            idx_B = [self.node_list.index(node) for node in node_list_B]
+            idx_A = self.node_index.get_index(node_list_A)
+            idx_B = self.node_index.get_index(node_list_B)
             return adj[idx_A, :][:, idx_B]
 
     @DeprecationWarning
@@ -301,7 +335,7 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
         return exps/np.sum(exps, axis=0)
 
     def get_top_k_predicted_edges(self, edge_type, top_k, node_list=None, node_list_B=None, training_network=None,
-                                  databases=None):
+                                  databases=None, block_size=None):
         nodes = self.node_list
         if node_list is not None and node_list_B is not None:
             nodes = [n for n in nodes if n in node_list or n in node_list_B]
@@ -310,6 +344,13 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
         elif node_list is not None:
             nodes = [n for n in nodes if n in node_list]
 
+        if self.supports_streaming_top_k():
+            if node_list_B is None:
+                nodes_A = nodes_B = nodes
+            return self.get_top_k_predicted_edges_streaming(edge_type, top_k, nodes, nodes_A, nodes_B,
+                                                            training_network=training_network, databases=databases,
+                                                            block_size=block_size)
+
         if node_list_B is not None:
             estimated_adj = self.get_reconstructed_adj(edge_type=edge_type, node_l=nodes_A,
                                                        node_l_b=nodes_B)  # (node_list_A, node_list_B)
@@ -321,8 +362,9 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
             training_adj = training_network.get_adjacency_matrix(edge_types=[edge_type], node_list=nodes,
                                                                  databases=databases)
             if node_list_B is not None:
-                idx_A = [nodes.index(node) for node in nodes_A]
-                idx_B = [nodes.index(node) for node in nodes_B]
+                nodes_index = NodeIndex(nodes)
+                idx_A = nodes_index.get_index(nodes_A)
+                idx_B = nodes_index.get_index(nodes_B)
                 training_adj = training_adj[idx_A, :][:, idx_B]
             assert estimated_adj.shape == training_adj.shape, "estimated_adj {} != training_adj {}".format(
                 estimated_adj.shape, training_adj.shape)
@@ -338,6 +380,53 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
 
         return top_k_pred_edges
 
+    def supports_streaming_top_k(self):
+        """
+        Whether the top-k predicted edges can be scored blockwise from the embeddings, without the dense reconstructed
+        adjacency. Not the case for subclasses which override `get_reconstructed_adj()`, or if the dense adjacency is
+        already cached.
+        """
+        return not hasattr(self, "reconstructed_adj") and \
+               self._method_name in {"LINE", "node2vec", "BioVec", "HOPE", "SDNE"} and \
+               type(self).get_reconstructed_adj is ImportedGraphEmbedding.get_reconstructed_adj
+
+    def get_top_k_predicted_edges_streaming(self, edge_type, top_k, nodes, nodes_A, nodes_B, training_network=None,
+                                            databases=None, block_size=None):
+        """
+        Same results as the dense path of `get_top_k_predicted_edges()`, but scores one block of rows of the
+        reconstructed adjacency at a time with `blocked_top_k()`, so memory stays O(block_size * len(nodes_B)). The
+        ranking is identical to the dense reconstructed adjacency, but HOPE scores are the raw dot products instead of
+        being min-max interpolated over the full matrix.
+        """
+        idx_A = self.node_index.get_index(nodes_A)
+        idx_B = self.node_index.get_index(nodes_B)
+
+        exclude_adj = None
+        if training_network is not None:
+            exclude_adj = training_network.get_adjacency_matrix(edge_types=[edge_type], node_list=nodes,
+                                                                databases=databases)
+            if nodes_A is not nodes:
+                nodes_index = NodeIndex(nodes)
+                exclude_adj = exclude_adj[nodes_index.get_index(nodes_A), :][:, nodes_index.get_index(nodes_B)]
+
+        col_bias = None
+        if self._method_name in {"LINE", "node2vec", "BioVec"}:
+            X_A, X_B, metric = self._X[idx_A], self._X[idx_B], "dot"
+            # Softmax over axis 0 of the full reconstructed adjacency
+            col_bias = -blocked_column_logsumexp(self._X, X_B, block_size=block_size)
+        elif self._method_name == "HOPE":
+            half_d = int(self.embedding_d / 2)
+            X_A, X_B, metric = self._X[idx_A, 0:half_d], self._X[idx_B, half_d:self.embedding_d], "dot"
+        elif self._method_name == "SDNE":
+            X_A, X_B, metric = self._X[idx_A], self._X[idx_B], "euclidean"
+
+        rows, cols, scores = blocked_top_k(X_A, X_B, top_k, metric=metric, exclude_adj=exclude_adj,
+                                           ids_A=idx_A, ids_B=idx_B, col_bias=col_bias, block_size=block_size)
+        if self._method_name in {"LINE", "node2vec", "BioVec", "SDNE"}:
+            scores = np.exp(scores)
+
+        return [(nodes_A[i], nodes_B[j], score) for i, j, score in zip(rows, cols, scores)]
+
     def get_bipartite_adj(self, node_list_A, node_list_B):
         nodes_A = [n for n in self.node_list if n in node_list_A]
         nodes_B = [n for n in self.node_list if n in node_list_B]
@@ -345,8 +434,9 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
 
         estimated_adj = self.get_reconstructed_adj(node_l=nodes)
         assert len(nodes) == estimated_adj.shape[0]
-        nodes_A_idx = [nodes.index(node) for node in nodes_A if node in nodes]
-        nodes_B_idx = [nodes.index(node) for node in nodes_B if node in nodes]
+        nodes_index = NodeIndex(nodes)
+        nodes_A_idx = nodes_index.get_index(nodes_A)
+        nodes_B_idx = nodes_index.get_index(nodes_B)
         bipartite_adj = estimated_adj[nodes_A_idx, :][:, nodes_B_idx]
         return bipartite_adj
 
@@ -367,12 +457,15 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
         :return y_pred: [n_pairs]
         """
         estimated_adj = self.get_reconstructed_adj()
-        node_set = set(self.node_list)
-        # node_set_in_X = set(node for pair in X for node in pair)
+        X = np.asarray(X)
 
         estimated_adj[0, 0] = 0.0
-        X_u_inx = [self.node_list.index(u) if (u in node_set and v in node_set) else 0 for u, v in X]
-        X_v_inx = [self.node_list.index(v) if (u in node_set and v in node_set) else 0 for u, v in X]
+        X_u_inx = self.node_index.get_index(X[:, 0], missing=-1)
+        X_v_inx = self.node_index.get_index(X[:, 1], missing=-1)
+        # Pairs with a node not in the embeddings are predicted as estimated_adj[0, 0]
+        missing = (X_u_inx < 0) | (X_v_inx < 0)
+        X_u_inx[missing] = 0
+        X_v_inx[missing] = 0
         y_pred = estimated_adj[X_u_inx, X_v_inx]
         y_pred = np.array(y_pred, dtype=np.float).reshape((-1, 1))
         assert y_pred.shape[0] == X.shape[0]
@@ -398,7 +491,7 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
             self.kmeans = kmeans
 
         if node_list is not None and set(node_list) <= set(self.node_list):
-            idx = [self.node_list.index(node) for node in node_list]
+            idx = self.node_index.get_index(node_list)
             y_pred = np.array(y_pred)[idx]
         else:
             assert node_list == self.node_list
@@ -409,13 +502,13 @@ class ImportedGraphEmbedding(BaseGraphEmbedding):
         return [self.node_list[node_index] for node_index in np.where(self.kmeans.labels_ == cluster)[0]]
 
     def get_cluster_neighbors(self, node):
-        return self.get_cluster_members(self.kmeans.labels_[self.node_list.index(node)])
+        return self.get_cluster_members(self.kmeans.labels_[self.node_index.index[node]])
 
     def get_cluster_assignment(self, node_list=None):
         y_pred = self.kmeans.labels_
         assert y_pred.shape[0] == len(self.node_list)
         if node_list is not None and set(node_list) <= set(self.node_list) and node_list != self.node_list:
-            idx = [self.node_list.index(node) for node in node_list]
+            idx = self.node_index.get_index(node_list)
             y_pred = y_pred[idx]
 
         return y_pred.tolist()
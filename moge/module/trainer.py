@@ -4,6 +4,7 @@ import pandas as pd
 import pytorch_lightning as pl
 import torch
 
+from .embedding import HybridEmbedding
 from .metrics import Metrics
 
 
@@ -222,6 +223,25 @@ class NodeClfMetrics(pl.LightningModule):
         self.log_dict(logs, prog_bar=logs)
         return None
 
+    def optimizer_step(self, *args, **kwargs):
+        """
+        After the optimizer step, apply the gradients accumulated by the HybridEmbedding tables, which are not
+        parameters of the optimizer, clipped with the Trainer's `gradient_clip_val`. With native 16-bit precision, the
+        gradients are unscaled by the GradScaler's scale, and are discarded if the GradScaler skipped the step.
+        """
+        scaler = getattr(self.trainer, "scaler", None)
+        grad_scale = scaler.get_scale() if scaler is not None and scaler.is_enabled() else 1.0
+        super().optimizer_step(*args, **kwargs)
+        # The GradScaler only decreases its scale after finding inf or NaN gradients
+        skipped = grad_scale != 1.0 and scaler.get_scale() < grad_scale
+
+        for module in self.modules():
+            if not isinstance(module, HybridEmbedding): continue
+            if skipped:
+                module.zero_grad()
+            else:
+                module.step(max_norm=getattr(self.trainer, "gradient_clip_val", None), grad_scale=grad_scale)
+
     def print_pred_class_counts(self, y_hat, y, multilabel, n_top_class=8):
         if multilabel:
             y_pred_dict = pd.Series(y_hat.sum(1).detach().cpu().type(torch.int).numpy()).value_counts().to_dict()
@@ -0,0 +1,134 @@
+import networkx as nx
+import numpy as np
+import scipy.sparse as sps
+
+
+class AdjacencyStore(object):
+    def __init__(self, graph: nx.Graph, node_index):
+        """
+        The edges of a networkx graph between the nodes of a NodeIndex, kept as position arrays (rows, cols, weights) with
+        the edges' "type" and "database" attributes. CSR matrices of the full graph are built once per edge filter and
+        cached, so slicing an adjacency for a list of nodes is a sparse row/column gather instead of a networkx walk.
+        Edges to nodes outside of the NodeIndex are not stored.
+
+        :param graph: a nx.Graph or nx.DiGraph. Undirected edges are stored in both directions.
+        :param node_index: a NodeIndex of the network's node_list
+        """
+        self.graph = graph
+        self.node_index = node_index
+        self.directed = graph.is_directed()
+
+        self.rows, self.cols, self.weights, self.types, self.databases = self._get_edge_arrays(graph.edges(data=True))
+        self.num_edges = graph.number_of_edges()
+        self._csr_cache = {}
+
+    def is_valid(self, graph: nx.Graph, node_index):
+        """
+        Whether the store is up to date with `graph` and `node_index`. Edges added to or removed from the graph without
+        calling `add_edges()` or `remove_edges()` are detected by a change in the number of edges.
+        """
+        return self.graph is graph and self.node_index is node_index and self.num_edges == graph.number_of_edges()
+
+    def _get_edge_arrays(self, edges):
+        rows, cols, weights, types, databases = [], [], [], [], []
+        for u, v, d in edges:
+            if u not in self.node_index or v not in self.node_index:
+                continue
+            rows.append(self.node_index.index[u])
+            cols.append(self.node_index.index[v])
+            weights.append(d.get("weight", 1))
+            types.append(d.get("type", None))
+            databases.append(d.get("database", None))
+
+        rows, cols = np.array(rows, dtype=int), np.array(cols, dtype=int)
+        weights = np.array(weights, dtype=float)
+        types, databases = np.array(types, dtype="O"), np.array(databases, dtype="O")
+
+        if not self.directed:
+            # Store the reverse direction of undirected edges, except self-loops
+            rev = rows != cols
+            rows, cols = np.concatenate([rows, cols[rev]]), np.concatenate([cols, rows[rev]])
+            weights = np.concatenate([weights, weights[rev]])
+            types, databases = np.concatenate([types, types[rev]]), np.concatenate([databases, databases[rev]])
+
+        return rows, cols, weights, types, databases
+
+    def _edge_keys(self, rows, cols):
+        return rows.astype(np.int64) * len(self.node_index) + cols.astype(np.int64)
+
+    def _drop_edges(self, rows, cols):
+        keys = self._edge_keys(rows, cols)
+        if not self.directed:
+            keys = np.concatenate([keys, self._edge_keys(cols, rows)])
+        mask = ~np.isin(self._edge_keys(self.rows, self.cols), keys)
+
+        self.rows, self.cols, self.weights = self.rows[mask], self.cols[mask], self.weights[mask]
+        self.types, self.databases = self.types[mask], self.databases[mask]
+
+    def add_edges(self, edgelist):
+        """
+        Update the store with edges which were just added to (or updated in) the graph.
+        :param edgelist: a list of tuples whose first two elements are the nodes of the edge
+        """
+        edges = [(e[0], e[1], self.graph.get_edge_data(e[0], e[1])) for e in edgelist]
+        rows, cols, weights, types, databases = self._get_edge_arrays(edges)
+        self._drop_edges(rows, cols)
+
+        self.rows, self.cols = np.concatenate([self.rows, rows]), np.concatenate([self.cols, cols])
+        self.weights = np.concatenate([self.weights, weights])
+        self.types, self.databases = np.concatenate([self.types, types]), np.concatenate([self.databases, databases])
+
+        self.num_edges = self.graph.number_of_edges()
+        self._csr_cache = {}
+
+    def remove_edges(self, edgelist):
+        """
+        Update the store with edges which were just removed from the graph.
+        :param edgelist: a list of tuples whose first two elements are the nodes of the edge
+        """
+        edgelist = [(e[0], e[1]) for e in edgelist if e[0] in self.node_index and e[1] in self.node_index]
+        if len(edgelist) > 0:
+            self._drop_edges(self.node_index.get_index([u for u, v in edgelist]),
+                             self.node_index.get_index([v for u, v in edgelist]))
+
+        self.num_edges = self.graph.number_of_edges()
+        self._csr_cache = {}
+
+    def get_csr(self, edge_types=None, databases=None) -> sps.csr_matrix:
+        """
+        The CSR adjacency of the whole node_list. If filtered by `edge_types` or `databases`, only edges with a
+        matching "type" or "database" attribute are kept and the matrix is binary, as a graph built from the filtered
+        edgelist would be. Otherwise, the matrix contains the edges' "weight".
+
+        :param edge_types: a collection of edge types, or None
+        :param databases: a collection of databases, or None
+        """
+        key = (tuple(edge_types) if edge_types is not None else None,
+               tuple(databases) if databases is not None else None)
+        if key in self._csr_cache:
+            return self._csr_cache[key]
+
+        mask = np.ones(self.rows.shape[0], dtype=bool)
+        if edge_types is not None:
+            mask &= self._match_attr(self.types, edge_types)
+        if databases is not None:
+            mask &= self._match_attr(self.databases, databases)
+
+        weights = self.weights[mask] if edge_types is None and databases is None else np.ones(mask.sum())
+        csr = sps.csr_matrix((weights, (self.rows[mask], self.cols[mask])),
+                             shape=(len(self.node_index), len(self.node_index)))
+        self._csr_cache[key] = csr
+        return csr
+
+    @staticmethod
+    def _match_attr(values, accepted):
+        # Compare each unique attribute value once instead of each edge
+        uniques = {value for value in set(values.tolist()) if value is not None and value in accepted}
+        return np.isin(values, list(uniques)) if len(uniques) > 0 else np.zeros(values.shape[0], dtype=bool)
+
+    def get_adjacency_matrix(self, idx, edge_types=None, databases=None) -> sps.csr_matrix:
+        """
+        :param idx: an int array of node positions to slice the rows and columns with
+        :return: a CSR adjacency of shape (len(idx), len(idx))
+        """
+        return self.get_csr(edge_types=edge_types, databases=databases)[idx, :][:, idx]
@@ -1,10 +1,84 @@
 from abc import abstractmethod
 from collections import OrderedDict
 
+import networkx as nx
 import numpy as np
 
+from moge.network.adjacency import AdjacencyStore
 
-class Network(object):
+
+class NodeIndex(object):
+    def __init__(self, node_list: list) -> None:
+        """
+        A name -> position and position -> name mapping of a node list, built once so that each lookup is O(1) instead of
+        the O(n) of `node_list.index(node)`.
+        :param node_list (list): a list of node names
+        """
+        self.node_list = node_list
+        self.size = len(node_list)
+        self.index = {node: i for i, node in enumerate(node_list)}
+        self.nodes = np.array(node_list, dtype="O")
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def is_valid(self, node_list: list):
+        """
+        Whether this index is still up to date with `node_list`, i.e. it's the same list object which wasn't resized.
+        """
+        return self.node_list is node_list and self.size == len(node_list)
+
+    def get_index(self, nodes, missing=None) -> np.ndarray:
+        """
+        Bulk lookup of the positions of `nodes`.
+        :param nodes: a list or array of node names
+        :param missing: the position returned for a node not in the index. If None, raise a KeyError.
+        :return: an int array of positions
+        """
+        if missing is None:
+            return np.array([self.index[node] for node in nodes], dtype=int)
+        else:
+            return np.array([self.index.get(node, missing) for node in nodes], dtype=int)
+
+    def get_nodes(self, idx) -> list:
+        """
+        Bulk lookup of the node names at the positions `idx`.
+        """
+        return self.nodes[np.asarray(idx, dtype=int)].tolist()
+
+
+class NodeIndexMixin(object):
+    """
+    Provides a `node_index` which is rebuilt lazily whenever `node_list` is reassigned or resized.
+    """
+
+    @property
+    def node_list(self) -> list:
+        return self._node_list
+
+    @node_list.setter
+    def node_list(self, node_list: list):
+        self._node_list = node_list
+        self._node_index = None
+
+    @property
+    def node_index(self) -> NodeIndex:
+        node_index = getattr(self, "_node_index", None)
+        if node_index is None or not node_index.is_valid(self._node_list):
+            node_index = self._node_index = NodeIndex(self._node_list)
+        return node_index
+
+    def __setstate__(self, state):
+        # Pickles from before `node_list` became a property
+        if "node_list" in state:
+            state["_node_list"] = state.pop("node_list")
+        self.__dict__.update(state)
+
+
+class Network(NodeIndexMixin):
     def __init__(self, networks: list) -> None:
         """
         A class that manages multiple graphs and the nodes between those graphs. Inheriting this class will run .process_network() and get_node_list()
@@ -79,11 +153,31 @@ class Network(object):
     def remove_edges_from(self, edgelist, **kwargs):
         raise NotImplementedError
 
+    def get_adjacency_store(self, key, graph: nx.Graph, build=True) -> AdjacencyStore:
+        """
+        Returns the cached AdjacencyStore of `graph`, rebuilding it if it is out of date with the graph's edges or with
+        the node_list.
+        :param key: the key of the graph, e.g. the layer or edge direction
+        :param graph: the networkx graph
+        :param build: whether to build the store if it doesn't exist or is out of date. If False, return None instead.
+        """
+        if not hasattr(self, "adj_stores"):
+            self.adj_stores = {}
+
+        store = self.adj_stores.get(key, None)
+        if store is not None and not store.is_valid(graph, self.node_index):
+            self.adj_stores.pop(key)
+            store = None
+
+        if store is None and build:
+            store = self.adj_stores[key] = AdjacencyStore(graph, self.node_index)
+        return store
+
     def slice_adj(self, adj, nodes_A, nodes_B=None):
         if nodes_B is None:
-            idx = [self.node_list.index(node) for node in nodes_A]
+            idx = self.node_index.get_index(nodes_A)
             return adj[idx, :][:, idx]
         else:
-            idx_A = [self.node_list.index(node) for node in nodes_A]
-            idx_B = [self.node_list.index(node) for node in nodes_B]
+            idx_A = self.node_index.get_index(nodes_A)
+            idx_B = self.node_index.get_index(nodes_B)
             return adj[idx_A, :][:, idx_B]
@@ -22,7 +22,6 @@ class HeteroNetwork(AttributedNetwork, TrainTestSplit):
         """
         self.multiomics = multiomics
         self.node_types = node_types
-        self.layers_adj = {}
 
         networks = {}
         for src_etype_dst, GraphClass in layers.items():
@@ -82,7 +81,11 @@ class HeteroNetwork(AttributedNetwork, TrainTestSplit):
     def add_edges(self, edgelist, layer: (str, str, str), database, **kwargs):
         source = layer[0]
         target = layer[-1]
+        edgelist = list(edgelist)
+        store = self.get_adjacency_store(layer, self.networks[layer], build=False)
         self.networks[layer].add_edges_from(edgelist, source=source, target=target, database=database, **kwargs)
+        if store is not None:
+            store.add_edges(edgelist)
         print(len(edgelist), "edges added to self.networks[{}]".format(layer))
 
     def get_adjacency_matrix(self, edge_types: (str, str), node_list=None, method="GAT", output="dense"):
@@ -110,18 +113,11 @@ class HeteroNetwork(AttributedNetwork, TrainTestSplit):
         return adj
 
     def get_layer_adjacency_matrix(self, edge_type, node_list=None, method="GAT", output="csr"):
-        if edge_type in self.layers_adj:
-            adjacency_matrix = self.layers_adj[edge_type]
-
-        # Get adjacency and caches the matrix
-        else:
-            adjacency_matrix = nx.adjacency_matrix(self.networks[edge_type],
-                                                   nodelist=self.node_list)
-            # if method == "GAT":
-            #     adjacency_matrix = adjacency_matrix + sps.csr_matrix(
-            #         np.eye(adjacency_matrix.shape[0]))  # Add self-loops
-
-            self.layers_adj[edge_type] = adjacency_matrix
+        # The store's CSR adjacency is cached until edges are added to the layer
+        adjacency_matrix = self.get_adjacency_store(edge_type, self.networks[edge_type]).get_csr()
+        # if method == "GAT":
+        #     adjacency_matrix = adjacency_matrix + sps.csr_matrix(
+        #         np.eye(adjacency_matrix.shape[0]))  # Add self-loops
 
         if node_list is None or node_list == self.node_list:
             pass
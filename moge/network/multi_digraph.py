@@ -56,17 +56,26 @@ class MultiDigraphNetwork(AttributedNetwork, TrainTestSplit):
         self.node_to_modality = pd.Series(self.node_to_modality)
 
     def add_edges(self, edgelist, directed, **kwargs):
+        edgelist = list(edgelist)
+        store = self.get_adjacency_store(directed, self.G if directed else self.G_u, build=False)
         if directed:
             self.G.add_edges_from(edgelist, type="d", **kwargs)
         else:
             self.G_u.add_edges_from(edgelist, type="u", **kwargs)
+        if store is not None:
+            store.add_edges(edgelist)
         print(len(edgelist), "edges added.")
 
     def import_edgelist_file(self, file, directed):
+        store = self.get_adjacency_store(directed, self.G if directed else self.G_u, build=False)
         if directed:
-            self.G.add_edges_from(nx.read_edgelist(file, data=True, create_using=nx.DiGraph()).edges(data=True))
+            edgelist = nx.read_edgelist(file, data=True, create_using=nx.DiGraph()).edges(data=True)
+            self.G.add_edges_from(edgelist)
         else:
-            self.G_u.add_edges_from(nx.read_edgelist(file, data=True, create_using=nx.Graph()).edges(data=True))
+            edgelist = nx.read_edgelist(file, data=True, create_using=nx.Graph()).edges(data=True)
+            self.G_u.add_edges_from(edgelist)
+        if store is not None:
+            store.add_edges(edgelist)
 
     def get_adjacency_matrix(self, edge_types: list, node_list=None, databases=None, sample_negative=0.0, method="GAT",
                              output="csr"):
@@ -90,20 +99,23 @@ class MultiDigraphNetwork(AttributedNetwork, TrainTestSplit):
             elif "u" == edge_types or "u_n" == edge_types:
                 is_directed = False
 
-        if databases is not None and is_directed:
-            edge_list = [(u, v) for u, v, d in self.G.edges(nbunch=node_list, data=True) if
-                         'database' in d and d['database'] in databases]
-            adj = nx.adjacency_matrix(nx.DiGraph(incoming_graph_data=edge_list), nodelist=node_list)
-        elif is_directed:
-            adj = nx.adjacency_matrix(self.G.subgraph(nodes=node_list), nodelist=node_list)
-            if sample_negative:
-                adj = self.sample_random_negative_edges(adj.astype(float), negative_sampling_ratio=sample_negative)
-        elif not is_directed and (("u" in edge_types and "u_n" in edge_types) or "u" in edge_types):
-            adj = nx.adjacency_matrix(self.G_u.subgraph(nodes=node_list), nodelist=node_list)
-        elif not is_directed and ("u_n" == edge_types or "u_n" in edge_types):
-            edge_list = [(u, v) for u, v, d in self.G_u.edges(nbunch=node_list, data=True) if
-                         d['type'] in edge_types]
-            adj = nx.adjacency_matrix(nx.Graph(incoming_graph_data=edge_list), nodelist=node_list)
+        idx = self.node_index.get_index(node_list, missing=-1)
+        if (idx < 0).any():
+            # Nodes outside of self.node_list are not in the adjacency store
+            adj = self.get_adjacency_matrix_nx(edge_types, node_list, databases=databases, is_directed=is_directed)
+        else:
+            store = self.get_adjacency_store(is_directed, self.G if is_directed else self.G_u)
+            if databases is not None and is_directed:
+                adj = store.get_adjacency_matrix(idx, databases=databases)
+            elif is_directed:
+                adj = store.get_adjacency_matrix(idx)
+            elif not is_directed and (("u" in edge_types and "u_n" in edge_types) or "u" in edge_types):
+                adj = store.get_adjacency_matrix(idx)
+            elif not is_directed and ("u_n" == edge_types or "u_n" in edge_types):
+                adj = store.get_adjacency_matrix(idx, edge_types=edge_types)
+
+        if is_directed and databases is None and sample_negative:
+            adj = self.sample_random_negative_edges(adj.astype(float), negative_sampling_ratio=sample_negative)
 
         # if method == "GAT":
         #     adj = adj + sps.csr_matrix(np.eye(adj.shape[0]))  # Add self-loops
@@ -118,6 +130,21 @@ class MultiDigraphNetwork(AttributedNetwork, TrainTestSplit):
         else:
             raise Exception("Output must be one of {csr, coo, dense}")
 
+    def get_adjacency_matrix_nx(self, edge_types, node_list, databases=None, is_directed=True):
+        if databases is not None and is_directed:
+            edge_list = [(u, v) for u, v, d in self.G.edges(nbunch=node_list, data=True) if
+                         'database' in d and d['database'] in databases]
+            adj = nx.adjacency_matrix(nx.DiGraph(incoming_graph_data=edge_list), nodelist=node_list)
+        elif is_directed:
+            adj = nx.adjacency_matrix(self.G.subgraph(nodes=node_list), nodelist=node_list)
+        elif not is_directed and (("u" in edge_types and "u_n" in edge_types) or "u" in edge_types):
+            adj = nx.adjacency_matrix(self.G_u.subgraph(nodes=node_list), nodelist=node_list)
+        elif not is_directed and ("u_n" == edge_types or "u_n" in edge_types):
+            edge_list = [(u, v) for u, v, d in self.G_u.edges(nbunch=node_list, data=True) if
+                         d['type'] in edge_types]
+            adj = nx.adjacency_matrix(nx.Graph(incoming_graph_data=edge_list), nodelist=node_list)
+        return adj
+
     def get_graph_laplacian(self, edge_types: list, node_list=None, databases=None):
         """
         Returns an adjacency matrix from edges with type specified in :param edge_types: and nodes specified in
@@ -202,7 +229,10 @@ class MultiDigraphNetwork(AttributedNetwork, TrainTestSplit):
         edges_ebunch = sample_edges(nodes_A, nodes_B, n_edges=n_edges, edge_type="u_n")
 
         print("Number of negative sampled edges between", modalities, "added:", len(edges_ebunch))
+        store = self.get_adjacency_store(UNDIRECTED, self.G_u, build=False)
         self.G_u.add_edges_from(edges_ebunch)
+        if store is not None:
+            store.add_edges(edges_ebunch)
 
     def get_subgraph(self, modalities=["MicroRNA", "LncRNA", "MessengerRNA"], edge_type="d"):
         if modalities == None:
@@ -221,10 +251,14 @@ class MultiDigraphNetwork(AttributedNetwork, TrainTestSplit):
         self.G = self.get_subgraph(self.modalities).copy()
 
     def remove_edges_from(self, edgelist, is_directed):
+        edgelist = list(edgelist)
+        store = self.get_adjacency_store(is_directed, self.G if is_directed else self.G_u, build=False)
         if is_directed:
             self.G.remove_edges_from(edgelist)
         else:
             self.G_u.remove_edges_from(edgelist)
+        if store is not None:
+            store.remove_edges(edgelist)
 
     def get_non_zero_degree_nodes(self, is_directed):
         if is_directed:
@@ -1,3 +1,8 @@
+import hashlib
+import json
+import os
+from multiprocessing import cpu_count, Pool
+
 import numpy as np
 import pandas as pd
 from Bio import pairwise2
@@ -89,7 +94,7 @@ def compute_expression_correlation(multiomics: MultiOmics, modalities, node_list
 
 
 def gower_distance(X: pd.DataFrame, agg_func=None, correlation_dist=None, multiprocessing=True, n_jobs=-2,
-                   verbose=False):
+                   sequence_kwargs=None, verbose=False):
     """
     This function expects a pandas dataframe as input
     The data frame is to contain the features along the columns. Based on these features a
@@ -99,6 +104,8 @@ def gower_distance(X: pd.DataFrame, agg_func=None, correlation_dist=None, multip
     Distance metrics used for:
     Nominal variables: Dice distance (https://en.wikipedia.org/wiki/S%C3%B8rensen%E2%80%93Dice_coefficient)
     Numeric variables: Manhattan distance normalized by the range of the variable (https://en.wikipedia.org/wiki/Taxicab_geometry)
+    Sequence variables: Global alignment score, computed with `seq_global_alignment_pdist()` which is passed the
+    `sequence_kwargs` dict, e.g. {"checkpoint_dir": ..., "kmer_size": ...}
     """
     individual_variable_dists = []
     if multiprocessing:
@@ -132,7 +139,8 @@ def gower_distance(X: pd.DataFrame, agg_func=None, correlation_dist=None, multip
         elif "sequence" in column:
             print(f"Global alignment seq score (maxlen={100})") if verbose else None
             # Note: If doesn't work, modify _pairwise_callable Line 1083  # X, Y = check_pairwise_arrays(X, Y)
-            feature_dist = pdist(feature.values.reshape((X.shape[0], -1)), seq_global_alignment_pairwise_score)
+            feature_dist = seq_global_alignment_pdist(feature.values, n_jobs=n_jobs if multiprocessing else 1,
+                                                      verbose=verbose, **(sequence_kwargs or {}))
             feature_dist = 1 - feature_dist  # Convert from similarity to dissimilarity
 
         elif column == "Location": # LNC Locations
@@ -202,3 +210,167 @@ def seq_global_alignment_pairwise_score(u, v, truncate=True, min_length=1000):
         return pairwise2.align.globalxx(u[0], v[0], score_only=True) / min(len(u[0]), len(v[0]))
     else:
         return np.nan
+
+
+def condensed_to_pairs(index, n):
+    """
+    Convert indices of a condensed distance matrix (as returned by scipy's pdist) of `n` observations to (i, j) pairs
+    with i < j.
+    """
+    index = np.asarray(index, dtype=np.float64)
+    i = n - 2 - np.floor(np.sqrt(-8 * index + 4 * n * (n - 1) - 7) / 2.0 - 0.5)
+    j = index + i + 1 - n * (n - 1) / 2.0 + (n - i) * ((n - i) - 1) / 2.0
+    return i.astype(np.int64), j.astype(np.int64)
+
+
+def kmer_minhash_signatures(sequences, kmer_size=5, num_perm=64, seed=0):
+    """
+    MinHash signatures of the k-mer sets of each sequence, where the fraction of equal signature values between two
+    sequences estimates the Jaccard similarity of their k-mer sets.
+
+    :param sequences: array of str, non-str values (e.g. NaN) get a signature of -1's
+    :return: uint64 array of shape (len(sequences), num_perm)
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 2 ** 62, size=num_perm, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+    b = rng.randint(0, 2 ** 62, size=num_perm, dtype=np.int64).astype(np.uint64)
+    powers = np.power(np.uint64(257), np.arange(kmer_size - 1, -1, -1, dtype=np.uint64))
+
+    signatures = np.full((len(sequences), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for idx, seq in enumerate(sequences):
+            if not isinstance(seq, str) or len(seq) < kmer_size:
+                continue
+            chars = np.frombuffer(seq.encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+            windows = np.lib.stride_tricks.sliding_window_view(chars, kmer_size)
+            kmers = np.unique((windows * powers).sum(axis=1))
+            signatures[idx] = (kmers[:, np.newaxis] * a[np.newaxis, :] + b[np.newaxis, :]).min(axis=0)
+
+    return signatures
+
+
+_SEQ_WORKER_STATE = {}
+
+
+def _init_seq_worker(sequences, signatures, min_jaccard, prefilter_fill):
+    _SEQ_WORKER_STATE.update(sequences=sequences, signatures=signatures, min_jaccard=min_jaccard,
+                             prefilter_fill=prefilter_fill)
+
+
+def _seq_alignment_chunk(chunk):
+    chunk_id, start, end = chunk
+    sequences, signatures = _SEQ_WORKER_STATE["sequences"], _SEQ_WORKER_STATE["signatures"]
+    rows, cols = condensed_to_pairs(np.arange(start, end), len(sequences))
+
+    scores = np.full(end - start, np.nan)
+    if signatures is not None:
+        jaccard = (signatures[rows] == signatures[cols]).mean(axis=1)
+        candidates = np.flatnonzero(jaccard >= _SEQ_WORKER_STATE["min_jaccard"])
+        # Pairs with a non-str sequence keep a NaN score
+        is_str = np.array([isinstance(seq, str) for seq in sequences[rows]]) & \
+                 np.array([isinstance(seq, str) for seq in sequences[cols]])
+        scores[is_str] = _SEQ_WORKER_STATE["prefilter_fill"]
+    else:
+        candidates = np.arange(end - start)
+
+    for k in candidates:
+        scores[k] = seq_global_alignment_pairwise_score([sequences[rows[k]]], [sequences[cols[k]]])
+
+    return chunk_id, scores
+
+
+def seq_global_alignment_pdist(sequences, n_jobs=-2, chunk_size=20000, checkpoint_dir=None, kmer_size=None,
+                               num_perm=64, min_jaccard=0.05, prefilter_fill=0.0, checkpoint_every=10,
+                               verbose=False):
+    """
+    Pairwise `seq_global_alignment_pairwise_score` of all sequences, as a condensed similarity matrix like scipy's
+    pdist. The pairs are split into chunks that are aligned in a process pool.
+
+    :param sequences: array of str sequences. Non-str values (e.g. NaN) have NaN scores.
+    :param n_jobs: number of processes, where -1 uses all cpus and -2 all but one
+    :param chunk_size: number of pairs per chunk
+    :param checkpoint_dir: if given, the scores and the finished chunks are saved to this directory, so that an
+        interrupted run resumes from the last checkpoint. The returned array is then memory-mapped from this directory.
+    :param kmer_size: if given, prefilter pairs by the MinHash estimate of the Jaccard similarity of their k-mers,
+        and only align the pairs with an estimate >= `min_jaccard`.
+    :param num_perm: number of MinHash permutations of the k-mer prefilter
+    :param min_jaccard: the Jaccard similarity threshold of the k-mer prefilter
+    :param prefilter_fill: the similarity score of pairs rejected by the prefilter
+    :param checkpoint_every: number of finished chunks between checkpoints
+    :return: array of shape (n * (n - 1) / 2,)
+    """
+    sequences = np.asarray(sequences, dtype="O").ravel()
+    n = len(sequences)
+    n_pairs = n * (n - 1) // 2
+    chunks = [(chunk_id, start, min(start + chunk_size, n_pairs)) \
+              for chunk_id, start in enumerate(range(0, n_pairs, chunk_size))]
+
+    signatures = kmer_minhash_signatures(sequences, kmer_size=kmer_size, num_perm=num_perm) \
+        if kmer_size is not None else None
+
+    if checkpoint_dir is not None:
+        scores, done = _load_seq_checkpoint(checkpoint_dir, sequences, n_pairs, len(chunks),
+                                            params=dict(chunk_size=chunk_size, kmer_size=kmer_size, num_perm=num_perm,
+                                                        min_jaccard=min_jaccard, prefilter_fill=prefilter_fill))
+    else:
+        scores, done = np.full(n_pairs, np.nan), np.zeros(len(chunks), dtype=bool)
+
+    todo = [chunk for chunk in chunks if not done[chunk[0]]]
+    print(f"Sequence alignment: {n_pairs} pairs in {len(chunks)} chunks, {len(todo)} remaining") if verbose else None
+
+    if n_jobs < 0:
+        n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+    init_args = (sequences, signatures, min_jaccard, prefilter_fill)
+
+    def _collect(results):
+        for finished, (chunk_id, chunk_scores) in enumerate(results, start=1):
+            _, start, end = chunks[chunk_id]
+            scores[start:end] = chunk_scores
+            done[chunk_id] = True
+            if checkpoint_dir is not None and finished % checkpoint_every == 0:
+                _save_seq_checkpoint(checkpoint_dir, scores, done)
+
+    if n_jobs == 1 or len(todo) <= 1:
+        _init_seq_worker(*init_args)
+        _collect(map(_seq_alignment_chunk, todo))
+    else:
+        with Pool(processes=n_jobs, initializer=_init_seq_worker, initargs=init_args) as pool:
+            _collect(pool.imap_unordered(_seq_alignment_chunk, todo))
+
+    if checkpoint_dir is not None:
+        _save_seq_checkpoint(checkpoint_dir, scores, done)
+    return scores
+
+
+def _load_seq_checkpoint(checkpoint_dir, sequences, n_pairs, n_chunks, params):
+    """
+    Open the scores memmap and the finished chunks of a checkpoint, or create new ones if the checkpoint is missing
+    or was made from different sequences or parameters.
+    """
+    key = hashlib.sha1(repr((sequences.tolist(), sorted(params.items()))).encode("utf-8")).hexdigest()
+    meta_path = os.path.join(checkpoint_dir, "meta.json")
+    scores_path = os.path.join(checkpoint_dir, "scores.npy")
+    done_path = os.path.join(checkpoint_dir, "done.npy")
+
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        if meta.get("key") == key and os.path.exists(scores_path) and os.path.exists(done_path):
+            return np.load(scores_path, mmap_mode="r+"), np.load(done_path)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    scores = np.lib.format.open_memmap(scores_path, mode="w+", dtype=np.float64, shape=(n_pairs,))
+    scores[:] = np.nan
+    done = np.zeros(n_chunks, dtype=bool)
+    _save_seq_checkpoint(checkpoint_dir, scores, done)
+    with open(meta_path, "w") as file:
+        json.dump({"key": key, "n_pairs": n_pairs, "n_chunks": n_chunks}, file)
+    return scores, done
+
+
+def _save_seq_checkpoint(checkpoint_dir, scores, done):
+    # Flush the scores before marking their chunks as done
+    scores.flush()
+    tmp_path = os.path.join(checkpoint_dir, "done.tmp.npy")
+    np.save(tmp_path, done)
+    os.replace(tmp_path, os.path.join(checkpoint_dir, "done.npy"))
@@ -0,0 +1,150 @@
+import json
+import os
+
+import numpy as np
+
+STORE_VERSION = 1
+HEADER_FILE = "header.json"
+NODES_FILE = "nodes.txt"
+MATRIX_FILE = "embeddings.bin"
+
+
+class EmbeddingStore:
+    def __init__(self, path: str):
+        """
+        Binary embedding store, a directory containing an index of node ids (one per line in `nodes.txt`), a contiguous
+        row-major float32/float16 matrix (`embeddings.bin`) opened with a read-only memory-map, and a `header.json` with
+        the dimension, dtype and number of nodes. Use `EmbeddingStore.create()` to make a new store.
+
+        :param path: the store directory
+        """
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE), "r") as file:
+            header = json.load(file)
+        if header.get("version", None) != STORE_VERSION:
+            raise Exception("Unsupported embedding store version {} at {}".format(header.get("version"), path))
+
+        self.dim = header["dim"]
+        self.dtype = np.dtype(header["dtype"])
+        self.num_nodes = header["num_nodes"]
+        self._node_list = None
+        self._nodes_file_clean = None
+        self._node_index = None
+        self._matrix = None
+
+    @classmethod
+    def create(cls, path: str, dim: int, dtype="float32", overwrite=False):
+        """
+        Create an empty store at `path`.
+
+        :param dim: embedding dimension
+        :param dtype: one of {"float32", "float16"}
+        :param overwrite: whether to replace an existing store at `path`
+        """
+        if np.dtype(dtype) not in {np.dtype("float32"), np.dtype("float16")}:
+            raise Exception("dtype must be one of {'float32', 'float16'}")
+        if os.path.exists(os.path.join(path, HEADER_FILE)) and not overwrite:
+            raise Exception("An embedding store already exists at {}".format(path))
+
+        os.makedirs(path, exist_ok=True)
+        open(os.path.join(path, NODES_FILE), "w").close()
+        open(os.path.join(path, MATRIX_FILE), "wb").close()
+        cls._write_header(path, dim=dim, dtype=np.dtype(dtype).name, num_nodes=0)
+        return cls(path)
+
+    @staticmethod
+    def _write_header(path, dim, dtype, num_nodes):
+        tmp_file = os.path.join(path, HEADER_FILE + ".tmp")
+        with open(tmp_file, "w") as file:
+            json.dump({"version": STORE_VERSION, "dim": dim, "dtype": dtype, "num_nodes": num_nodes}, file)
+        os.replace(tmp_file, os.path.join(path, HEADER_FILE))
+
+    def __len__(self):
+        return self.num_nodes
+
+    def __contains__(self, node):
+        return node in self.node_index
+
+    @property
+    def node_list(self) -> list:
+        if self._node_list is None:
+            with open(os.path.join(self.path, NODES_FILE), "r") as file:
+                lines = file.read().splitlines()
+            # Lines beyond `num_nodes` are left over from an interrupted append
+            self._nodes_file_clean = len(lines) == self.num_nodes
+            self._node_list = lines[:self.num_nodes]
+        return self._node_list
+
+    @property
+    def node_index(self) -> dict:
+        if self._node_index is None:
+            self._node_index = {node: i for i, node in enumerate(self.node_list)}
+        return self._node_index
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            if self.num_nodes == 0:
+                self._matrix = np.empty((0, self.dim), dtype=self.dtype)
+            else:
+                self._matrix = np.memmap(os.path.join(self.path, MATRIX_FILE), dtype=self.dtype, mode="r",
+                                         shape=(self.num_nodes, self.dim))
+        return self._matrix
+
+    def append(self, node_list: list, embeddings: np.ndarray):
+        """
+        Append the embeddings of new nodes at the end of the store. The rows are written before the header is updated,
+        so an interrupted append leaves the store at its previous size.
+
+        :param node_list: list of node ids, which must not already be in the store
+        :param embeddings: array of shape (len(node_list), dim)
+        """
+        embeddings = np.asarray(embeddings)
+        assert embeddings.shape == (len(node_list), self.dim), \
+            "embeddings shape {} != {}".format(embeddings.shape, (len(node_list), self.dim))
+        if len(set(node_list)) != len(node_list) or any(node in self.node_index for node in node_list):
+            raise Exception("node_list contains duplicate nodes or nodes already in the store")
+        if any("\n" in str(node) for node in node_list):
+            raise Exception("node ids must not contain newlines")
+
+        # Truncate leftovers of an interrupted append
+        with open(os.path.join(self.path, MATRIX_FILE), "r+b") as file:
+            file.truncate(self.num_nodes * self.dim * self.dtype.itemsize)
+            file.seek(0, os.SEEK_END)
+            file.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+        if self._nodes_file_clean:
+            with open(os.path.join(self.path, NODES_FILE), "a") as file:
+                file.write("".join("{}\n".format(node) for node in node_list))
+        else:
+            with open(os.path.join(self.path, NODES_FILE), "w") as file:
+                file.write("".join("{}\n".format(node) for node in self.node_list + list(node_list)))
+
+        self._write_header(self.path, dim=self.dim, dtype=self.dtype.name, num_nodes=self.num_nodes + len(node_list))
+        self.num_nodes += len(node_list)
+        self._node_list = self.node_list + [str(node) for node in node_list]
+        self._nodes_file_clean = True
+        self._node_index = None
+        self._matrix = None
+
+    def get_embeddings(self, node_list=None, dtype=np.float32) -> np.ndarray:
+        """
+        Load the embeddings of a subset of nodes, reading only their rows from the memory-map.
+
+        :param node_list: list of node ids, or None for all nodes
+        :param dtype: dtype of the returned array
+        :return: array of shape (len(node_list), dim)
+        """
+        if node_list is None:
+            return np.asarray(self.matrix, dtype=dtype)
+
+        missing = [node for node in node_list if node not in self.node_index]
+        if missing:
+            raise Exception("node_list contains {} nodes not in the embedding store, e.g. {}".format(
+                len(missing), missing[:5]))
+
+        idx = np.array([self.node_index[node] for node in node_list], dtype=np.int64)
+        # Read the rows in file order, then restore the order of node_list
+        order = np.argsort(idx, kind="stable")
+        embeddings = np.empty((len(idx), self.dim), dtype=dtype)
+        embeddings[order] = self.matrix[idx[order]]
+        return embeddings
@@ -0,0 +1,211 @@
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+
+sys.path.insert(0, "../MultiOmicsGraphEmbedding/")
+
+import numpy as np
+import torch
+
+from moge.generator import HeteroNeighborSampler, TripletSampler, EdgeSampler
+from moge.generator.synthetic import SyntheticNodeDataset, SyntheticTripletDataset, SyntheticEdgeDataset
+from moge.module.PyG.latte import LATTE
+from moge.module.sampling import negative_sample
+
+
+def timeit(func, repeats=10, warmup=2) -> dict:
+    """
+    Runs `func` `warmup` times, then times `repeats` runs.
+    :return: Dict of timing statistics in seconds
+    """
+    for _ in range(warmup):
+        func()
+
+    times = []
+    for _ in range(repeats):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        func()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+
+    times = np.array(times)
+    return {"mean": times.mean(), "std": times.std(), "median": np.median(times), "min": times.min(),
+            "max": times.max(), "repeats": repeats}
+
+
+def get_num_nodes_dict(hparams: Namespace) -> dict:
+    return {node_type: int(hparams.num_nodes * ratio) for node_type, ratio in
+            zip(["paper", "author", "field", "institution"][:hparams.num_node_types], [1.0, 0.8, 0.1, 0.02])}
+
+
+def get_batch_iloc(idx: torch.Tensor, batch_size: int, generator: torch.Generator) -> torch.Tensor:
+    return idx[torch.randperm(idx.numel(), generator=generator)[:batch_size]]
+
+
+def bench_neighbor_sampler(hparams: Namespace, generator: torch.Generator) -> (dict, HeteroNeighborSampler):
+    dataset = HeteroNeighborSampler(SyntheticNodeDataset(get_num_nodes_dict(hparams), avg_degree=hparams.avg_degree,
+                                                         in_channels=hparams.in_channels, seed=hparams.seed),
+                                    neighbor_sizes=[hparams.n_neighbors] * hparams.n_layers,
+                                    head_node_type="paper", add_reverse_metapaths=True, inductive=False)
+    results = {}
+    for mode in ["train", "valid"]:
+        idx = dataset.training_idx if mode == "train" else dataset.validation_idx
+        results[f"HeteroNeighborSampler.sample[{mode}]"] = timeit(
+            lambda: dataset.sample(get_batch_iloc(idx, hparams.batch_size, generator), mode=mode),
+            repeats=hparams.repeats, warmup=hparams.warmup)
+        results[f"HeteroNeighborSampler.sample_typed[{mode}]"] = timeit(
+            lambda: dataset.sample_typed(get_batch_iloc(idx, hparams.batch_size, generator), mode=mode),
+            repeats=hparams.repeats, warmup=hparams.warmup)
+    return results, dataset
+
+
+def bench_triplet_sampler(hparams: Namespace, generator: torch.Generator) -> dict:
+    dataset = TripletSampler(SyntheticTripletDataset(get_num_nodes_dict(hparams), avg_degree=hparams.avg_degree,
+                                                     num_neg=hparams.num_neg, seed=hparams.seed),
+                             head_node_type="paper", add_reverse_metapaths=True)
+    results = {}
+    for mode, idx in [("train", dataset.training_idx), ("valid", dataset.validation_idx)]:
+        results[f"TripletSampler.sample[{mode}]"] = timeit(
+            lambda: dataset.sample(get_batch_iloc(idx, hparams.batch_size, generator)),
+            repeats=hparams.repeats, warmup=hparams.warmup)
+    return results
+
+
+def bench_edge_sampler(hparams: Namespace, generator: torch.Generator) -> dict:
+    dataset = EdgeSampler(SyntheticEdgeDataset(hparams.num_nodes, avg_degree=hparams.avg_degree,
+                                               in_channels=hparams.in_channels, seed=hparams.seed),
+                          add_reverse_metapaths=False)
+    results = {}
+    for mode, idx in [("train", dataset.training_idx), ("valid", dataset.validation_idx)]:
+        results[f"EdgeSampler.sample[{mode}]"] = timeit(
+            lambda: dataset.sample(get_batch_iloc(idx, hparams.batch_size, generator)),
+            repeats=hparams.repeats, warmup=hparams.warmup)
+    return results
+
+
+def bench_latte(hparams: Namespace, dataset: HeteroNeighborSampler, generator: torch.Generator) -> dict:
+    device = torch.device("cuda" if torch.cuda.is_available() and hparams.num_gpus > 0 else "cpu")
+    X, _, _ = dataset.sample(get_batch_iloc(dataset.training_idx, hparams.batch_size, generator), mode="train")
+    X = {key: {k: v.to(device) for k, v in value.items()} for key, value in X.items()}
+
+    results = {}
+    for t_order in range(1, hparams.max_t_order + 1):
+        model = LATTE(t_order=t_order, embedding_dim=hparams.embedding_dim,
+                      in_channels_dict=dataset.node_attr_shape, num_nodes_dict=dataset.num_nodes_dict,
+                      metapaths=dataset.get_metapaths(), attn_heads=hparams.attn_heads,
+                      use_proximity=hparams.use_proximity).to(device)
+        model.train()
+        results[f"LATTE.forward[t_order={t_order}]"] = timeit(
+            lambda: model.forward(X=X["x_dict"], edge_index_dict=X["edge_index_dict"],
+                                  global_node_idx=X["global_node_index"]),
+            repeats=hparams.repeats, warmup=hparams.warmup)
+    return results
+
+
+def bench_negative_sample(hparams: Namespace, generator: torch.Generator) -> dict:
+    num_edges = int(hparams.num_nodes * hparams.avg_degree)
+    edge_index = torch.randint(0, hparams.num_nodes, (2, num_edges), generator=generator)
+    return {"negative_sample": timeit(
+        lambda: negative_sample(edge_index, M=hparams.num_nodes, N=hparams.num_nodes,
+                                n_sample_per_edge=int(hparams.neg_sampling_ratio)),
+        repeats=hparams.repeats, warmup=hparams.warmup)}
+
+
+def bench_nx_generator(hparams: Namespace) -> dict:
+    """
+    The nx generators need a MultiDigraphNetwork built from MultiOmics annotations and sequences, so this benchmark
+    loads a pickled SubgraphGenerator from `hparams.nx_generator`.
+    """
+    import pickle
+    with open(hparams.nx_generator, "rb") as file:
+        generator = pickle.load(file)
+
+    steps = iter(range(sys.maxsize))
+    return {f"{generator.__class__.__name__}.__getitem__": timeit(
+        lambda: generator.__getitem__(next(steps) % len(generator)),
+        repeats=hparams.repeats, warmup=hparams.warmup)}
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(hparams: Namespace) -> dict:
+    torch.manual_seed(hparams.seed)
+    generator = torch.Generator().manual_seed(hparams.seed)
+    benchmarks = hparams.benchmarks.split(",")
+
+    results = {}
+    if "sampler" in benchmarks or "latte" in benchmarks:
+        sampler_results, node_dataset = bench_neighbor_sampler(hparams, generator)
+        if "sampler" in benchmarks:
+            results.update(sampler_results)
+            results.update(bench_triplet_sampler(hparams, generator))
+            results.update(bench_edge_sampler(hparams, generator))
+        if "latte" in benchmarks:
+            results.update(bench_latte(hparams, node_dataset, generator))
+    if "negative_sample" in benchmarks:
+        results.update(bench_negative_sample(hparams, generator))
+    if "nx_generator" in benchmarks and hparams.nx_generator is not None:
+        results.update(bench_nx_generator(hparams))
+
+    for name, stats in results.items():
+        print(f"{name:<45} median {stats['median'] * 1000:10.2f} ms   mean {stats['mean'] * 1000:10.2f} ms "
+              f"+- {stats['std'] * 1000:.2f}")
+
+    report = {"commit": get_git_commit(),
+              "timestamp": datetime.datetime.now().isoformat(),
+              "platform": {"python": platform.python_version(), "machine": platform.machine(),
+                           "torch": torch.__version__, "cuda": torch.cuda.is_available(),
+                           "num_threads": torch.get_num_threads()},
+              "config": vars(hparams),
+              "results": results}
+
+    if hparams.output is not None:
+        with open(hparams.output, "w") as file:
+            json.dump(report, file, indent=2, default=float)
+        print("Saved at", hparams.output)
+    return report
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--benchmarks', type=str, default="sampler,latte,negative_sample,nx_generator",
+                        help="Comma separated list of {sampler, latte, negative_sample, nx_generator}")
+    parser.add_argument('--output', type=str, default="benchmark.json")
+    parser.add_argument('--num_gpus', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+
+    # Synthetic graph size
+    parser.add_argument('--num_nodes', type=int, default=100000)
+    parser.add_argument('--num_node_types', type=int, default=3)
+    parser.add_argument('--avg_degree', type=float, default=10.0)
+    parser.add_argument('--in_channels', type=int, default=128)
+    parser.add_argument('--num_neg', type=int, default=32)
+
+    # Sampler and model
+    parser.add_argument('-n', '--batch_size', type=int, default=2000)
+    parser.add_argument('--n_neighbors', type=int, default=20)
+    parser.add_argument('--n_layers', type=int, default=2)
+    parser.add_argument('-d', '--embedding_dim', type=int, default=128)
+    parser.add_argument('--max_t_order', type=int, default=3)
+    parser.add_argument('--attn_heads', type=int, default=4)
+    parser.add_argument('--use_proximity', type=bool, default=False)
+    parser.add_argument('--neg_sampling_ratio', type=float, default=5.0)
+
+    parser.add_argument('--nx_generator', type=str, default=None, help="Path to a pickled nx generator")
+
+    args = parser.parse_args()
+    run(args)
@@ -23,7 +23,6 @@ from run.utils import load_link_dataset
 
 def train(hparams):
     NUM_GPUS = hparams.num_gpus
-    USE_AMP = False  # True if NUM_GPUS > 1 else False
     MAX_EPOCHS = 50
 
     dataset = load_link_dataset(hparams.dataset, hparams=hparams)
@@ -41,8 +40,7 @@ def train(hparams):
         logger=wandb_logger,
         # regularizers=regularizers,
         weights_summary='top',
-        amp_level='O1' if USE_AMP else None,
-        precision=16 if USE_AMP else 32
+        precision=hparams.precision
     )
 
     trainer.fit(model)
@@ -53,11 +51,15 @@ if __name__ == "__main__":
     parser.add_argument('--num_gpus', type=int, default=4)
     # parametrize the network
     parser.add_argument('--dataset', type=str, default="ogbl-biokg")
+    parser.add_argument('--cache_dir', type=str, default=None)
     parser.add_argument('-d', '--embedding_dim', type=int, default=128)
     parser.add_argument('-t', '--t_order', type=int, default=1)
     parser.add_argument('-b', '--batch_size', type=int, default=32000)
     parser.add_argument('--n_neighbors_1', type=int, default=30, help="Not used - only for compatibility")
     parser.add_argument('--activation', type=str, default="relu")
+    parser.add_argument('--embedding_cache_size', type=int, default=500000,
+                        help="Rows of the featureless node embeddings cached on device, for large graphs")
+    parser.add_argument('--embedding_lr', type=float, default=0.01)
     parser.add_argument('--attn_heads', type=int, default=32)
     parser.add_argument('--attn_activation', type=str, default="sharpening")
     parser.add_argument('--attn_dropout', type=float, default=0.2)
@@ -74,6 +76,8 @@ if __name__ == "__main__":
     parser.add_argument('--loss_type', type=str, default="KL_DIVERGENCE")
     parser.add_argument('--lr', type=float, default=0.001)
     parser.add_argument('--weight_decay', type=float, default=1e-2)
+    parser.add_argument('--precision', type=int, default=32, choices=[16, 32],
+                        help="16 for native fp16 mixed precision on GPU")
 
     # add all the available options to the trainer
     # parser = pl.Trainer.add_argparse_args(parser)
@@ -28,7 +28,6 @@ from run.utils import load_node_dataset
 
 def train(hparams: Namespace):
     NUM_GPUS = hparams.num_gpus
-    USE_AMP = False  # True if NUM_GPUS > 1 else False
     MAX_EPOCHS = 50
 
     neighbor_sizes = [hparams.n_neighbors, ]
@@ -39,11 +38,16 @@ def train(hparams: Namespace):
 
     dataset = load_node_dataset(hparams.dataset, method="LATTE", hparams=hparams, train_ratio=None,
                                 dir_path=hparams.dir_path)
+    if hparams.split_seed is not None:
+        dataset.resample_splits(train_ratio=hparams.train_ratio, valid_ratio=hparams.valid_ratio,
+                                seed=hparams.split_seed, split_dir=hparams.split_dir)
+    if hparams.sampling_device is not None:
+        dataset.to(hparams.sampling_device)
 
     METRICS = ["precision", "recall", "f1", "accuracy" if dataset.multilabel else hparams.dataset, "top_k"]
     hparams.loss_type = "BCE" if dataset.multilabel else hparams.loss_type
     hparams.n_classes = dataset.n_classes
-    model = LATTENodeClassifier(hparams, dataset, collate_fn="neighbor_sampler", metrics=METRICS)
+    model = LATTENodeClassifier(hparams, dataset, collate_fn=hparams.collate_fn, metrics=METRICS)
 
     logger = WandbLogger(name=model.name(), tags=[dataset.name()], project="multiplex-comparison")
 
@@ -55,8 +59,7 @@ def train(hparams: Namespace):
         max_epochs=MAX_EPOCHS,
         # early_stop_callback=EarlyStopping(monitor='val_loss', patience=5, min_delta=0.001, strict=False),
         logger=logger,
-        amp_level='O1' if USE_AMP else None,
-        precision=16 if USE_AMP else 32
+        precision=hparams.precision
     )
 
     trainer.fit(model)
@@ -68,15 +71,33 @@ if __name__ == "__main__":
     # parametrize the network
     parser.add_argument('--dataset', type=str, default="ogbn-mag")
     parser.add_argument('--dir_path', type=str, default="~/Bioinformatics_ExternalData/OGB/")
+    parser.add_argument('--cache_dir', type=str, default=None)
+    parser.add_argument('--feature_dtype', type=str, default="float32", help="One of {float32, float16, int8}")
+    parser.add_argument('--split_seed', type=int, default=None,
+                        help="If given, resample stratified train/valid/test splits of the labeled nodes from this seed")
+    parser.add_argument('--train_ratio', type=float, default=0.8)
+    parser.add_argument('--valid_ratio', type=float, default=0.1)
+    parser.add_argument('--split_dir', type=str, default=None)
 
     parser.add_argument("-d", '--embedding_dim', type=int, default=128)
     parser.add_argument("-t", '--t_order', type=int, default=2)
     parser.add_argument('-n', '--batch_size', type=int, default=2000)
     parser.add_argument('--n_neighbors', type=int, default=20)
+    parser.add_argument('--collate_fn', type=str, default="neighbor_sampler",
+                        help="One of {neighbor_sampler, typed_neighbor_sampler}")
+    parser.add_argument('--sampling_device', type=str, default=None,
+                        help="If given, e.g. 'cuda:0', the graph is kept on this device and batches are sampled on it")
     parser.add_argument('--activation', type=str, default="relu")
+    parser.add_argument('--embedding_cache_size', type=int, default=500000,
+                        help="Rows of the featureless node embeddings cached on device, for large graphs")
+    parser.add_argument('--embedding_lr', type=float, default=0.01)
     parser.add_argument('--attn_heads', type=int, default=64)
     parser.add_argument('--attn_activation', type=str, default="LeakyReLU")
     parser.add_argument('--attn_dropout', type=float, default=0.2)
+    parser.add_argument('--attn_record_rate', type=float, default=0.0,
+                        help="Fraction of the nodes whose relation weights are recorded at eval, if > 0")
+    parser.add_argument('--attn_record_dir', type=str, default=None,
+                        help="Directory the recorded relation weights are written to at the end of each eval epoch")
 
     parser.add_argument('--nb_cls_dense_size', type=int, default=0)
     parser.add_argument('--nb_cls_dropout', type=float, default=0.3)
@@ -85,10 +106,18 @@ if __name__ == "__main__":
     parser.add_argument('--neg_sampling_ratio', type=float, default=5.0)
     parser.add_argument('--use_class_weights', type=bool, default=False)
     parser.add_argument('--use_reverse', type=bool, default=True)
+    parser.add_argument('--precompute_joins', type=bool, default=False,
+                        help="Join higher-order metapaths once on the full graph instead of per batch. Materializes "
+                             "every composite adjacency up to t_order in memory, which can exceed it on large graphs")
+    parser.add_argument('--layerwise_inference', type=bool, default=False,
+                        help="Evaluate with full-graph layer-wise inference instead of sampled batches")
+    parser.add_argument('--inference_chunk_size', type=int, default=10000)
 
     parser.add_argument('--loss_type', type=str, default="SOFTMAX_CROSS_ENTROPY")
     parser.add_argument('--lr', type=float, default=0.001)
     parser.add_argument('--weight_decay', type=float, default=1e-2)
+    parser.add_argument('--precision', type=int, default=32, choices=[16, 32],
+                        help="16 for native fp16 mixed precision on GPU")
     parser.add_argument('--gradient_clip_val', type=float, default=1.0)
     # add all the available options to the trainer
     # parser = pl.Trainer.add_argparse_args(parser)
@@ -4,20 +4,29 @@ from cogdl.datasets.gtn_data import ACM_GTNDataset, DBLP_GTNDataset, IMDB_GTNDat
 from cogdl.datasets.han_data import ACM_HANDataset, DBLP_HANDataset, IMDB_HANDataset
 from ogb.nodeproppred import PygNodePropPredDataset
 from ogb.linkproppred import PygLinkPropPredDataset
-import torch
 from torch_geometric.datasets import AMiner
 
 from moge.generator import HeteroNeighborSampler, TripletSampler, EdgeSampler
-from moge.module.utils import preprocess_input
+from moge.generator.feature_store import NodeFeatureStore
 
 def load_node_dataset(dataset, method, hparams, train_ratio=None, dir_path="~/Bioinformatics_ExternalData/OGB/"):
+    cache_dir = hparams.cache_dir if hasattr(hparams, "cache_dir") else None
+
     if "ogbn" in dataset:
         ogbn = PygNodePropPredDataset(name=dataset, root=dir_path)
         dataset = HeteroNeighborSampler(ogbn, neighbor_sizes=hparams.neighbor_sizes, directed=True, resample_train=None,
-                                        add_reverse_metapaths=hparams.use_reverse, inductive=hparams.inductive)
-        if os.path.exists(ogbn.processed_dir + "/features.pk"):
+                                        add_reverse_metapaths=hparams.use_reverse, inductive=hparams.inductive,
+                                        cache_dir=cache_dir)
+        # Convert features.pk once to a memory-mapped NodeFeatureStore, so only the rows of each batch are read
+        feature_dtype = hparams.feature_dtype if hasattr(hparams, "feature_dtype") else "float32"
+        features_path = os.path.join(ogbn.processed_dir, f"features_{feature_dtype}")
+        if not NodeFeatureStore.exists(features_path) and os.path.exists(ogbn.processed_dir + "/features.pk"):
             features = dill.load(open(ogbn.processed_dir + "/features.pk", 'rb'))
-            dataset.x_dict = preprocess_input(features, device="cpu", dtype=torch.float)
+            NodeFeatureStore.save(features_path, features, dtype=feature_dtype)
+            del features
+
+        if NodeFeatureStore.exists(features_path):
+            dataset.x_dict = NodeFeatureStore(features_path)
             print('added features')
         else:
             print("features.pk not found")
@@ -27,30 +36,35 @@ def load_node_dataset(dataset, method, hparams, train_ratio=None, dir_path="~/Bi
             dataset = HeteroNeighborSampler(ACM_HANDataset(), [25, 20], node_types=["P"],
                                             metapaths=["PAP", "PSP"] if "LATTE" in method else None,
                                             add_reverse_metapaths=True,
-                                            head_node_type="P", resample_train=train_ratio, inductive=hparams.inductive)
+                                            head_node_type="P", resample_train=train_ratio, inductive=hparams.inductive,
+                                            cache_dir=cache_dir)
         else:
             dataset = HeteroNeighborSampler(ACM_GTNDataset(), [25, 20], node_types=["P"],
                                             metapaths=["PAP", "PA_P", "PSP", "PS_P"] if "LATTE" in method else None,
                                             add_reverse_metapaths=False,
-                                            head_node_type="P", resample_train=train_ratio, inductive=hparams.inductive)
+                                            head_node_type="P", resample_train=train_ratio, inductive=hparams.inductive,
+                                            cache_dir=cache_dir)
 
     elif dataset == "DBLP":
         if method == "HAN":
             dataset = HeteroNeighborSampler(DBLP_HANDataset(), [25, 20],
                                             node_types=["A"], head_node_type="A", metapaths=None,
                                             add_reverse_metapaths=True,
-                                            resample_train=train_ratio, inductive=hparams.inductive)
+                                            resample_train=train_ratio, inductive=hparams.inductive,
+                                            cache_dir=cache_dir)
         elif "LATTE" in method:
             dataset = HeteroNeighborSampler(DBLP_HANDataset(), [25, 20],
                                             node_types=["A", "P", "C", "T"], head_node_type="A",
                                             metapaths=["AC", "AP", "AT"],
                                             add_reverse_metapaths=True,
-                                            resample_train=train_ratio, inductive=hparams.inductive)
+                                            resample_train=train_ratio, inductive=hparams.inductive,
+                                            cache_dir=cache_dir)
         else:
             dataset = HeteroNeighborSampler(DBLP_GTNDataset(), [25, 20], node_types=["A"], head_node_type="A",
                                             metapaths=["APA", "AP_A", "ACA", "AC_A"] if "LATTE" in method else None,
                                             add_reverse_metapaths=False,
-                                            resample_train=train_ratio, inductive=hparams.inductive)
+                                            resample_train=train_ratio, inductive=hparams.inductive,
+                                            cache_dir=cache_dir)
 
     elif dataset == "IMDB":
         if method == "HAN" or method == "MetaPath2Vec":
@@ -58,37 +72,42 @@ def load_node_dataset(dataset, method, hparams, train_ratio=None, dir_path="~/Bi
                                             metapaths=["MAM", "MDM", "MWM"] if "LATTE" in method else None,
                                             add_reverse_metapaths=True,
                                             head_node_type="M",
-                                            resample_train=train_ratio, inductive=hparams.inductive)
+                                            resample_train=train_ratio, inductive=hparams.inductive,
+                                            cache_dir=cache_dir)
         else:
             dataset = HeteroNeighborSampler(IMDB_GTNDataset(), neighbor_sizes=[25, 20], node_types=["M"],
                                             metapaths=["MDM", "MD_M", "MAM", "MA_M"] if "LATTE" in method else None,
                                             add_reverse_metapaths=False,
-                                            head_node_type="M", inductive=hparams.inductive)
+                                            head_node_type="M", inductive=hparams.inductive, cache_dir=cache_dir)
     elif dataset == "AMiner":
         dataset = HeteroNeighborSampler(AMiner("datasets/aminer"), [25, 20], node_types=None,
                                         metapaths=[('paper', 'written by', 'author'),
                                                    ('venue', 'published', 'paper')], head_node_type="author",
-                                        resample_train=train_ratio, inductive=hparams.inductive)
+                                        resample_train=train_ratio, inductive=hparams.inductive, cache_dir=cache_dir)
     elif dataset == "BlogCatalog":
         dataset = HeteroNeighborSampler("datasets/blogcatalog6k.mat", [25, 20], node_types=["user", "tag"],
-                                        head_node_type="user", resample_train=train_ratio, inductive=hparams.inductive)
+                                        head_node_type="user", resample_train=train_ratio, inductive=hparams.inductive,
+                                        cache_dir=cache_dir)
     else:
         raise Exception(f"dataset {dataset} not found")
     return dataset
 
 
 def load_link_dataset(name, hparams, path="~/Bioinformatics_ExternalData/OGB/"):
+    cache_dir = hparams.cache_dir if hasattr(hparams, "cache_dir") else None
+
     if "ogbl" in name:
         ogbl = PygLinkPropPredDataset(name=name, root=path)
 
         if isinstance(ogbl, PygLinkPropPredDataset) and not hasattr(ogbl[0], "edge_index_dict") \
                 and not hasattr(ogbl[0], "edge_reltype"):
-            dataset = EdgeSampler(ogbl, directed=True, add_reverse_metapaths=hparams.use_reverse)
+            dataset = EdgeSampler(ogbl, directed=True, add_reverse_metapaths=hparams.use_reverse,
+                                  cache_dir=cache_dir)
             print(dataset.node_types, dataset.metapaths)
         else:
             dataset = TripletSampler(ogbl, directed=True,
                                      head_node_type=None,
-                                     add_reverse_metapaths=hparams.use_reverse)
+                                     add_reverse_metapaths=hparams.use_reverse, cache_dir=cache_dir)
             print(dataset.node_types, dataset.metapaths)
     else:
         raise Exception(f"dataset {name} not found")
@@ -0,0 +1,104 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from moge.generator import cache
+from moge.generator.cache import get_cache_key, get_cache_path, is_mmap, load_state, save_state
+from moge.generator.network import HeteroNetDataset
+
+
+@pytest.fixture
+def get_state():
+    torch.manual_seed(0)
+    return {"num_nodes_dict": {"paper": 30, "author": 20},
+            "edge_index_dict": {("paper", "cites", "paper"): torch.randint(0, 30, (2, 50)),
+                                ("paper", "written_by", "author"): torch.randint(0, 20, (2, 40))},
+            "x_dict": {"paper": torch.randn(30, 8)},
+            "splits": [torch.arange(10), torch.arange(10, 20)],
+            "pair": (np.arange(5), "name"),
+            "node_degrees": np.random.rand(30),
+            "name": "ogbn-mag"}
+
+
+def assert_state_equal(loaded, state):
+    if isinstance(state, torch.Tensor):
+        assert isinstance(loaded, torch.Tensor) and torch.equal(loaded, state)
+    elif isinstance(state, np.ndarray):
+        assert isinstance(loaded, np.ndarray) and np.array_equal(loaded, state)
+    elif isinstance(state, dict):
+        assert type(loaded) == type(state) and list(loaded) == list(state)
+        for key in state:
+            assert_state_equal(loaded[key], state[key])
+    elif isinstance(state, (list, tuple)):
+        assert type(loaded) == type(state) and len(loaded) == len(state)
+        for loaded_value, value in zip(loaded, state):
+            assert_state_equal(loaded_value, value)
+    else:
+        assert loaded == state
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_state(tmp_path, get_state, mmap):
+    path = get_cache_path(str(tmp_path), name="ogbn-mag", key=get_cache_key("HeteroNetDataset", directed=True))
+    save_state(get_state, path)
+    # Written to a temporary directory, then renamed
+    assert os.listdir(str(tmp_path)) == [os.path.basename(path)]
+
+    loaded = load_state(path, mmap=mmap)
+    assert_state_equal(loaded, get_state)
+
+    x = loaded["x_dict"]["paper"]
+    assert is_mmap(x) == mmap
+    assert not is_mmap(get_state["x_dict"]["paper"])
+    if mmap:
+        # Copy-on-write, so writes to the loaded tensors never modify the cache
+        x[0] = 0
+        assert torch.equal(load_state(path)["x_dict"]["paper"], get_state["x_dict"]["paper"])
+
+
+def test_save_state_overwrite(tmp_path, get_state):
+    path = str(tmp_path / "dataset")
+    save_state({"name": "old", "x": torch.zeros(3)}, path)
+    os.makedirs(path + f".tmp{os.getpid()}")
+    save_state(get_state, path)
+
+    assert sorted(os.listdir(str(tmp_path))) == ["dataset"]
+    assert_state_equal(load_state(path), get_state)
+
+
+def test_load_state_version(tmp_path, get_state):
+    path = str(tmp_path / "dataset")
+    assert load_state(path) is None
+
+    save_state(get_state, path)
+    with open(os.path.join(path, cache.MANIFEST_FILE), "rb") as file:
+        manifest = pickle.load(file)
+    manifest["version"] = cache.CACHE_VERSION + 1
+    with open(os.path.join(path, cache.MANIFEST_FILE), "wb") as file:
+        pickle.dump(manifest, file)
+    assert load_state(path) is None
+
+    assert get_cache_key("a", b=1) != get_cache_key("a", b=2)
+    assert get_cache_key("a", b=1, c=2) == get_cache_key("a", c=2, b=1)
+
+
+def test_pickle_dataset(tmp_path):
+    x = torch.randn(1000, 64)
+    save_state({"x_dict": {"paper": x}, "training_idx": torch.arange(100)}, str(tmp_path / "dataset"))
+
+    dataset = HeteroNetDataset.__new__(HeteroNetDataset)
+    dataset.__dict__.update(load_state(str(tmp_path / "dataset")))
+    dataset.dataset, dataset._name = object(), "dataset"
+    dataset.validation_idx = torch.arange(100, 200)
+
+    # The memory-mapped tensors are pickled as references to their cache files, and the source dataset is left out
+    pickled = pickle.dumps(dataset)
+    assert len(pickled) < x.numel() * x.element_size() // 10
+    loaded = pickle.loads(pickled)
+    assert loaded.dataset is None and loaded.name() == "dataset"
+    assert is_mmap(loaded.x_dict["paper"]) and torch.equal(loaded.x_dict["paper"], x)
+    assert torch.equal(loaded.training_idx, torch.arange(100))
+    assert not is_mmap(loaded.validation_idx) and torch.equal(loaded.validation_idx, torch.arange(100, 200))
@@ -0,0 +1,86 @@
+import pytest
+import torch
+
+from moge.module.embedding import HybridEmbedding
+
+
+def adagrad_reference(weight, batches, lr, eps, steps_per_update):
+    """
+    Dense row-wise Adagrad, with the gradients of `steps_per_update` batches summed before each update.
+    """
+    weight, state = weight.clone(), torch.zeros(weight.size(0))
+    grad_sum = torch.zeros_like(weight)
+    for i, (idx, target) in enumerate(batches):
+        w = weight.clone().requires_grad_(True)
+        (w[idx] - target).pow(2).sum().backward()
+        grad_sum += w.grad
+
+        if (i + 1) % steps_per_update == 0:
+            rows = grad_sum.abs().sum(1) > 0
+            state[rows] += grad_sum[rows].pow(2).mean(1)
+            weight[rows] -= lr * grad_sum[rows] / (state[rows].sqrt() + eps).unsqueeze(1)
+            grad_sum.zero_()
+    return weight, state
+
+
+@pytest.mark.parametrize("num_embeddings,cache_size", [(20, 4), (30, 5)])
+def test_hybrid_embedding_adagrad(num_embeddings, cache_size):
+    torch.manual_seed(0)
+    embedding = HybridEmbedding(num_embeddings, 8, cache_size=cache_size, lr=0.1, decay_steps=3)
+    weight = embedding.weight.clone()
+
+    batches = [(torch.randint(0, num_embeddings, (torch.randint(2, 8, (1,)).item(),)), torch.randn(1, 8)) \
+               for _ in range(12)]
+    for i, (idx, target) in enumerate(batches):
+        (embedding(idx) - target).pow(2).sum().backward()
+        if (i + 1) % 3 == 0:
+            assert embedding.step()
+    assert not embedding.step()
+    # Batches with more unique rows than the cache grow it, and the others evict rows
+    assert embedding.cache_weight.size(0) > cache_size
+
+    expected_weight, expected_state = adagrad_reference(weight, batches, lr=0.1, eps=embedding.eps,
+                                                        steps_per_update=3)
+    assert torch.allclose(embedding.weight, expected_weight, atol=1e-5)
+    assert torch.allclose(embedding.state_master, expected_state, atol=1e-5)
+
+
+def test_hybrid_embedding_step_skipped():
+    torch.manual_seed(0)
+    embedding = HybridEmbedding(10, 4, cache_size=4)
+    weight = embedding.weight.clone()
+
+    embedding(torch.tensor([1, 2])).sum().mul(float("inf")).backward()
+    assert not embedding.step(grad_scale=2.0)
+    embedding(torch.tensor([1, 2])).sum().backward()
+    embedding.zero_grad()
+    assert not embedding.step()
+    assert torch.equal(embedding.weight, weight)
+
+    # Gradients are unscaled and clipped
+    embedding(torch.tensor([3])).sum().mul(1024.0).backward()
+    assert embedding.step(max_norm=1.0, grad_scale=1024.0)
+    assert not torch.equal(embedding.weight[3], weight[3])
+
+
+@pytest.mark.parametrize("path", [None, "table"])
+def test_hybrid_embedding_extra_state(tmp_path, path):
+    torch.manual_seed(0)
+    path = str(tmp_path / path) if path is not None else None
+    embedding = HybridEmbedding(20, 4, cache_size=4, path=path)
+    embedding(torch.tensor([0, 5, 7])).sum().backward()
+    embedding.step()
+
+    state_dict = embedding.state_dict()
+    loaded = HybridEmbedding(20, 4, cache_size=4)
+    loaded(torch.tensor([5, 9]))
+    loaded.load_state_dict(state_dict)
+
+    assert torch.equal(loaded.weight, embedding.weight)
+    assert torch.equal(loaded.state_master, embedding.state_master)
+    assert torch.equal(loaded(torch.tensor([7, 5])), embedding.weight[[7, 5]])
+
+    if path is not None:
+        # The memory-mapped table is reused
+        reopened = HybridEmbedding(20, 4, cache_size=4, path=path)
+        assert torch.equal(reopened.weight, embedding.weight)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from scipy.special import logsumexp
+
+from moge.evaluation.utils import blocked_top_k, blocked_column_logsumexp
+
+
+@pytest.fixture
+def get_embeddings():
+    rng = np.random.RandomState(0)
+    return rng.randn(23, 8).astype(np.float32), rng.randn(17, 8).astype(np.float32)
+
+
+def dense_scores(X_A, X_B, metric):
+    if metric == "cosine":
+        X_A = X_A / np.linalg.norm(X_A, axis=1, keepdims=True)
+        X_B = X_B / np.linalg.norm(X_B, axis=1, keepdims=True)
+    if metric == "euclidean":
+        return -np.linalg.norm(X_A[:, np.newaxis, :] - X_B[np.newaxis, :, :], axis=2)
+    return np.matmul(X_A, X_B.T)
+
+
+@pytest.mark.parametrize("metric", ["dot", "cosine", "euclidean"])
+def test_blocked_top_k(get_embeddings, metric):
+    X_A, X_B = get_embeddings
+    scores = dense_scores(X_A, X_B, metric)
+
+    rows, cols, top_scores = blocked_top_k(X_A, X_B, top_k=10, metric=metric, block_size=4)
+    expected = np.sort(scores.ravel())[::-1][:10]
+    assert np.allclose(top_scores, expected, atol=1e-4)
+    assert np.allclose(scores[rows, cols], top_scores, atol=1e-4)
+
+
+def test_blocked_top_k_per_row(get_embeddings):
+    X_A, X_B = get_embeddings
+    scores = dense_scores(X_A, X_B, "dot")
+
+    rows, cols, top_scores = blocked_top_k(X_A, X_B, top_k=3, per_row=True, block_size=5)
+    assert np.array_equal(rows, np.repeat(np.arange(X_A.shape[0]), 3))
+    assert np.allclose(top_scores.reshape(-1, 3), -np.sort(-scores, axis=1)[:, :3], atol=1e-4)
+
+
+def test_blocked_top_k_exclusions(get_embeddings):
+    X_A, X_B = get_embeddings
+    scores = dense_scores(X_A, X_B, "dot")
+    exclude_adj = sp.random(X_A.shape[0], X_B.shape[0], density=0.3, format="csr", random_state=0)
+    ids_A, ids_B = np.arange(X_A.shape[0]), np.arange(X_B.shape[0]) + 5
+
+    excluded = exclude_adj.toarray() != 0
+    self_pairs = np.intersect1d(ids_A, ids_B)
+    excluded[self_pairs, self_pairs - 5] = True
+    top_k = int((~excluded).sum())
+
+    rows, cols, top_scores = blocked_top_k(X_A, X_B, top_k=top_k + 10, exclude_adj=exclude_adj, ids_A=ids_A,
+                                           ids_B=ids_B, block_size=3)
+    assert rows.shape[0] == top_k
+    assert not excluded[rows, cols].any()
+    assert np.allclose(top_scores, np.sort(scores[~excluded])[::-1], atol=1e-4)
+
+
+def test_blocked_column_logsumexp(get_embeddings):
+    X_A, X_B = get_embeddings
+    scores = dense_scores(X_A, X_B, "dot")
+    assert np.allclose(blocked_column_logsumexp(X_A, X_B, block_size=4), logsumexp(scores, axis=0), atol=1e-4)
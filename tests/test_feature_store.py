@@ -0,0 +1,70 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from moge.generator.feature_store import NodeFeatureStore
+from moge.generator.network import HeteroNetDataset
+
+
+@pytest.fixture
+def get_x_dict():
+    torch.manual_seed(0)
+    x_dict = {"paper": torch.randn(50, 16), "author": torch.randn(30, 8)}
+    x_dict["paper"][3] = 0
+    return x_dict
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_feature_store_round_trip(tmp_path, get_x_dict, dtype):
+    store = NodeFeatureStore.save(str(tmp_path), get_x_dict, dtype=dtype, chunk_size=7)
+    assert NodeFeatureStore.exists(str(tmp_path))
+    assert set(store) == set(get_x_dict)
+
+    for node_type, x in get_x_dict.items():
+        assert store[node_type].shape == x.shape
+        x_store = store[node_type].to_tensor()
+        assert x_store.dtype == torch.float
+        if dtype == "float32":
+            assert torch.equal(x_store, x)
+        elif dtype == "float16":
+            assert torch.allclose(x_store, x, atol=1e-2)
+        else:
+            # Within half a quantization step of each row's max absolute value
+            step = x.abs().max(1, keepdim=True).values / 127
+            assert ((x_store - x).abs() <= step / 2 + 1e-6).all()
+
+
+def test_feature_store_indexing(tmp_path, get_x_dict):
+    store = NodeFeatureStore.save(str(tmp_path), get_x_dict, dtype="float32")
+    idx = torch.tensor([42, 3, 7, 42, 0])
+    assert torch.equal(store["paper"][idx], get_x_dict["paper"][idx])
+    assert torch.equal(store["paper"][np.array([1, 2])], get_x_dict["paper"][[1, 2]])
+    assert torch.equal(store["author"][5:10], get_x_dict["author"][5:10])
+
+    assert torch.equal(NodeFeatureStore(str(tmp_path), mmap=False).to_dict()["author"], get_x_dict["author"])
+    with pytest.raises(Exception):
+        NodeFeatureStore.save(str(tmp_path), get_x_dict)
+
+
+def test_dataset_to_device(tmp_path, get_x_dict):
+    dataset = HeteroNetDataset.__new__(HeteroNetDataset)
+    dataset.x_dict = NodeFeatureStore.save(str(tmp_path), get_x_dict, dtype="float32")
+
+    dataset.to("cpu")
+    assert isinstance(dataset.x_dict, dict)
+    for node_type, x in get_x_dict.items():
+        assert isinstance(dataset.x_dict[node_type], torch.Tensor)
+        assert torch.equal(dataset.x_dict[node_type], x)
+
+
+def test_feature_store_pickle(tmp_path, get_x_dict):
+    store = NodeFeatureStore.save(str(tmp_path), get_x_dict, dtype="int8")
+    idx = torch.tensor([4, 1, 4])
+    x = store["paper"][idx]
+
+    # The memory-mapped matrices are opened again after unpickling instead of being copied
+    pickled = pickle.dumps(store)
+    assert len(pickled) < get_x_dict["paper"].numel()
+    assert torch.equal(pickle.loads(pickled)["paper"][idx], x)
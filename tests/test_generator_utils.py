@@ -0,0 +1,92 @@
+import pytest
+import torch
+
+from moge.generator.utils import unique_rows, nonduplicate_mask, induced_subgraph, sample_csr_neighbors
+
+
+@pytest.fixture
+def get_csr():
+    torch.manual_seed(0)
+    num_rows, num_cols = 30, 20
+    edge_index = torch.stack([torch.randint(0, num_rows, (200,)), torch.randint(0, num_cols, (200,))]).unique(dim=1)
+    rowptr = torch.zeros(num_rows + 1, dtype=torch.long)
+    rowptr[1:] = torch.cumsum(torch.bincount(edge_index[0], minlength=num_rows), dim=0)
+    return rowptr, edge_index[1], edge_index
+
+
+@pytest.fixture
+def get_triples():
+    torch.manual_seed(0)
+    return torch.stack([torch.randint(0, 10, (200,)), torch.randint(0, 3, (200,)), torch.randint(0, 10, (200,))], dim=1)
+
+
+def test_unique_rows(get_triples):
+    expected, expected_inverse, expected_counts = torch.unique(get_triples, dim=0, return_inverse=True,
+                                                               return_counts=True)
+    unique, index, inverse, counts = unique_rows(get_triples, return_index=True, return_inverse=True,
+                                                 return_counts=True)
+    assert torch.equal(unique, expected)
+    assert torch.equal(inverse, expected_inverse)
+    assert torch.equal(counts, expected_counts)
+    assert torch.equal(get_triples[index], unique)
+    # First occurrences
+    assert all((get_triples[:i] != get_triples[i]).any(1).all() for i in index.tolist())
+
+
+def test_unique_rows_overflow():
+    rows = torch.tensor([[2 ** 40, 2 ** 40], [1, 2], [2 ** 40, 2 ** 40], [1, 3]])
+    unique, inverse = unique_rows(rows, return_inverse=True)
+    assert torch.equal(unique, torch.tensor([[1, 2], [1, 3], [2 ** 40, 2 ** 40]]))
+    assert inverse.tolist() == [2, 0, 2, 1]
+
+
+def test_unique_rows_empty():
+    rows = torch.empty((0, 2), dtype=torch.long)
+    unique, counts = unique_rows(rows, return_counts=True)
+    assert unique.shape == (0, 2) and counts.numel() == 0
+    assert nonduplicate_mask(rows).numel() == 0
+
+
+def test_nonduplicate_mask(get_triples):
+    seen = set()
+    expected = []
+    for row in map(tuple, get_triples.tolist()):
+        expected.append(row not in seen)
+        seen.add(row)
+    assert nonduplicate_mask(get_triples).tolist() == expected
+
+
+def test_induced_subgraph():
+    edge_index_dict = {("paper", "cites", "paper"): torch.tensor([[0, 1, 2, 3], [1, 2, 3, 0]]),
+                       ("paper", "written_by", "author"): torch.tensor([[0, 2, 3], [0, 1, 1]])}
+    nodes_dict = {"paper": torch.tensor([3, 0, 1])}
+    num_nodes_dict = {"paper": 4, "author": 2}
+
+    edge_index_dict, edge_id_dict = induced_subgraph(edge_index_dict, nodes_dict, num_nodes_dict)
+    assert edge_id_dict[("paper", "cites", "paper")].tolist() == [0, 3]
+    assert edge_index_dict[("paper", "cites", "paper")].tolist() == [[1, 0], [2, 1]]
+    # Authors are not filtered nor relabeled
+    assert edge_id_dict[("paper", "written_by", "author")].tolist() == [0, 2]
+    assert edge_index_dict[("paper", "written_by", "author")].tolist() == [[1, 0], [0, 1]]
+
+
+@pytest.mark.parametrize("num_neighbors", [3, -1])
+def test_sample_csr_neighbors(get_csr, num_neighbors):
+    rowptr, col, edge_index = get_csr
+    nodes = torch.tensor([0, 4, 7, 12, 25, 29])
+    heads, tails = sample_csr_neighbors(rowptr, col, nodes, num_neighbors)
+
+    edges = set(map(tuple, edge_index.t().tolist()))
+    sampled = list(zip(heads.tolist(), tails.tolist()))
+    assert set(heads.tolist()) <= set(nodes.tolist())
+    assert all(edge in edges for edge in sampled)
+    assert len(set(sampled)) == len(sampled)
+
+    for node in nodes.tolist():
+        neighbors = {tail for head, tail in edges if head == node}
+        node_sampled = {tail for head, tail in sampled if head == node}
+        if num_neighbors < 0 or len(neighbors) <= num_neighbors:
+            # Nodes with a degree of at most the fanout keep all their neighbors
+            assert node_sampled == neighbors
+        else:
+            assert 0 < len(node_sampled) <= num_neighbors
@@ -0,0 +1,213 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from torch_geometric.utils import softmax
+
+from moge.module.PyG.latte import LATTE, LATTEConv, MetapathJoins, ProximityEdges, tag_negative, is_negative, \
+    untag_negative
+
+num_nodes_dict = {"paper": 30, "author": 20, "field": 10}
+in_channels_dict = {"paper": 8, "author": 6}
+metapaths = [("paper", "cites", "paper"), ("paper", "written_by", "author"), ("paper", "has_topic", "field"),
+             ("author", "writes", "paper"), ("field", "topic_of", "paper")]
+
+
+@pytest.fixture
+def get_graph():
+    torch.manual_seed(0)
+    x_dict = {node_type: torch.randn(num_nodes_dict[node_type], in_channels) \
+              for node_type, in_channels in in_channels_dict.items()}
+    edge_index_dict = {metapath: torch.stack([torch.randint(0, num_nodes_dict[metapath[0]], (60,)),
+                                              torch.randint(0, num_nodes_dict[metapath[-1]], (60,))]) \
+                       for metapath in metapaths[:-1]}
+    global_node_idx = {node_type: torch.arange(num_nodes) for node_type, num_nodes in num_nodes_dict.items()}
+    return x_dict, edge_index_dict, global_node_idx
+
+
+@pytest.mark.parametrize("attn_activation", ["sharpening", "LeakyReLU"])
+def test_agg_relation_neighbors(get_graph, attn_activation):
+    x_dict, edge_index_dict, global_node_idx = get_graph
+    conv = LATTEConv(embedding_dim=16, in_channels_dict=in_channels_dict, num_nodes_dict=num_nodes_dict,
+                     metapaths=metapaths, attn_heads=4, attn_activation=attn_activation)
+    if attn_activation == "sharpening":
+        conv.alpha_activation.data = torch.rand(len(metapaths)) + 0.5
+    conv.eval()
+
+    l_dict = conv.get_h_dict(x_dict, global_node_idx, left_right="left")
+    r_dict = conv.get_h_dict(x_dict, global_node_idx, left_right="right")
+    alpha_l, alpha_r = conv.get_alphas(edge_index_dict, l_dict, r_dict)
+
+    for node_type, num_nodes in num_nodes_dict.items():
+        emb_relations = conv.agg_relation_neighbors(node_type, alpha_l, alpha_r, l_dict, r_dict, edge_index_dict,
+                                                    global_node_idx)
+        assert emb_relations.shape == (num_nodes, conv.num_head_relations(node_type), 16)
+
+        # Per-metapath reference, where messages flow from the tail nodes edge_index[1] to the head nodes edge_index[0]
+        expected = torch.zeros_like(emb_relations)
+        for i, metapath in enumerate(conv.get_head_relations(node_type)):
+            if metapath not in edge_index_dict: continue
+            head, tail = edge_index_dict[metapath]
+            alpha = conv.attn_activation(alpha_l[metapath][head] + alpha_r[metapath][tail],
+                                         metapath_id=conv.metapaths.index(metapath))
+            alpha = softmax(alpha, index=head, num_nodes=num_nodes)
+            expected[:, i] = torch.zeros(num_nodes, 16).index_add_(0, head, r_dict[metapath[-1]][tail] * alpha)
+
+        assert torch.allclose(emb_relations, expected, atol=1e-5)
+
+
+def proximity_loss_reference(conv, edge_index_dict, proximity_edges, alpha_l, alpha_r):
+    """
+    Per-metapath NCE loss with `predict_scores()`, over the same sampled negative edges as `proximity_edges`.
+    """
+    loss, pos_pred_dict, neg_pred_dict = 0.0, {}, {}
+    for metapath, edge_index in edge_index_dict.items():
+        values = 1.0
+        if isinstance(edge_index, tuple):
+            edge_index, values = edge_index
+
+        if not is_negative(metapath):
+            e_pred_logits = conv.predict_scores(edge_index, alpha_l, alpha_r, metapath, logits=True)
+            loss += -torch.mean(values * F.logsigmoid(e_pred_logits))
+            pos_pred_dict[metapath] = torch.sigmoid(e_pred_logits)
+        else:
+            e_neg_logits = conv.predict_scores(edge_index, alpha_l, alpha_r, untag_negative(metapath), logits=True)
+            loss += -torch.mean(F.logsigmoid(-e_neg_logits))
+            neg_pred_dict[untag_negative(metapath)] = torch.sigmoid(e_neg_logits)
+
+        if not is_negative(metapath) and tag_negative(metapath) not in edge_index_dict:
+            e_neg_logits = conv.predict_scores(proximity_edges.neg_dict[metapath], alpha_l, alpha_r, metapath,
+                                               logits=True)
+            loss += -torch.mean(F.logsigmoid(-e_neg_logits))
+            neg_pred_dict[metapath] = torch.sigmoid(e_neg_logits)
+
+    return loss / (len(edge_index_dict) * 2), pos_pred_dict, neg_pred_dict
+
+
+@pytest.mark.parametrize("attn_activation", ["sharpening", "LeakyReLU"])
+def test_proximity_loss(get_graph, attn_activation):
+    x_dict, edge_index_dict, global_node_idx = get_graph
+    conv = LATTEConv(embedding_dim=16, in_channels_dict=in_channels_dict, num_nodes_dict=num_nodes_dict,
+                     metapaths=metapaths, attn_heads=4, attn_activation=attn_activation)
+    if attn_activation == "sharpening":
+        conv.alpha_activation.data = torch.rand(len(metapaths)) + 0.5
+
+    # Given negatives tagged before their positive metapath, weighted edges, and sampled negatives for the others
+    given_neg = ("paper", "written_by", "author")
+    weighted = ("paper", "cites", "paper")
+    edge_index_dict = {tag_negative(given_neg): torch.stack([torch.randint(0, num_nodes_dict["paper"], (90,)),
+                                                             torch.randint(0, num_nodes_dict["author"], (90,))]),
+                       **{metapath: (edge_index, torch.rand(edge_index.size(1))) if metapath == weighted else edge_index \
+                          for metapath, edge_index in edge_index_dict.items()}}
+
+    l_dict = conv.get_h_dict(x_dict, global_node_idx, left_right="left")
+    r_dict = conv.get_h_dict(x_dict, global_node_idx, left_right="right")
+    alpha_l, alpha_r = conv.get_alphas(edge_index_dict, l_dict, r_dict)
+
+    proximity_edges = ProximityEdges(edge_index_dict, global_node_idx, neg_sampling_ratio=2.0)
+    loss, proximity_edges = conv.proximity_loss(proximity_edges, alpha_l=alpha_l, alpha_r=alpha_r)
+    expected_loss, pos_pred_dict, neg_pred_dict = proximity_loss_reference(conv, edge_index_dict, proximity_edges,
+                                                                           alpha_l, alpha_r)
+    assert torch.allclose(loss, expected_loss, atol=1e-6)
+
+    # Scores are stored in the order of the positive metapaths, so that concatenating them aligns each metapath's
+    # negative scores with its positive scores
+    positive_metapaths = [metapath for metapath in edge_index_dict if not is_negative(metapath)]
+    assert list(proximity_edges.pos_pred_dict) == positive_metapaths
+    assert list(proximity_edges.neg_pred_dict) == positive_metapaths
+    for metapath in positive_metapaths:
+        assert torch.allclose(proximity_edges.pos_pred_dict[metapath], pos_pred_dict[metapath], atol=1e-6)
+        assert torch.allclose(proximity_edges.neg_pred_dict[metapath], neg_pred_dict[metapath], atol=1e-6)
+        if metapath != given_neg:
+            assert proximity_edges.neg_pred_dict[metapath].numel() == 2 * pos_pred_dict[metapath].numel()
+
+    # Gradients flow to the attention weights
+    loss.backward()
+    assert conv.attn_l[0].weight.grad is not None
+
+
+class FullMetapathJoins(MetapathJoins):
+    def get_edge_index_dict(self, t, edge_index_dict, global_node_idx):
+        # All the edges of the joined metapaths, without sampling, for batches of all nodes
+        return {metapath: torch.stack(self.adj_dict[metapath].coo()[:2], dim=0) \
+                for metapath in self.t_order_metapaths.get(t, [])}
+
+
+@pytest.mark.parametrize("t_order", [1, 2])
+def test_inference(get_graph, t_order):
+    x_dict, edge_index_dict, global_node_idx = get_graph
+    edge_index_dict = {metapath: edge_index.unique(dim=1) for metapath, edge_index in edge_index_dict.items()}
+    model = LATTE(t_order=t_order, embedding_dim=16, in_channels_dict=in_channels_dict, num_nodes_dict=num_nodes_dict,
+                  metapaths=metapaths, attn_heads=4, use_proximity=False)
+    if t_order > 1:
+        model.set_metapath_joins(FullMetapathJoins(edge_index_dict, num_nodes_dict, metapaths, t_order=t_order))
+    model.eval()
+
+    with torch.no_grad():
+        expected, _, _ = model.forward(x_dict, edge_index_dict, global_node_idx)
+    embeddings = model.inference(x_dict, edge_index_dict, num_nodes_dict, node_types=["paper", "field"],
+                                 chunk_size=7)
+
+    for node_type in ["paper", "field"]:
+        assert embeddings[node_type].shape == (num_nodes_dict[node_type], 16 * t_order)
+        assert torch.allclose(embeddings[node_type], expected[node_type], atol=1e-5)
+
+
+def test_agg_relation_neighbors_autocast(get_graph):
+    x_dict, edge_index_dict, global_node_idx = get_graph
+    conv = LATTEConv(embedding_dim=16, in_channels_dict=in_channels_dict, num_nodes_dict=num_nodes_dict,
+                     metapaths=metapaths, attn_heads=4, attn_activation="LeakyReLU")
+    conv.eval()
+
+    with torch.no_grad():
+        l_dict = conv.get_h_dict(x_dict, global_node_idx, left_right="left")
+        r_dict = conv.get_h_dict(x_dict, global_node_idx, left_right="right")
+        alpha_l, alpha_r = conv.get_alphas(edge_index_dict, l_dict, r_dict)
+        beta = conv.get_beta_weights(x_dict, l_dict, l_dict, global_node_idx)
+
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            l_dict_bf16 = conv.get_h_dict(x_dict, global_node_idx, left_right="left")
+            r_dict_bf16 = conv.get_h_dict(x_dict, global_node_idx, left_right="right")
+            alpha_l_bf16, alpha_r_bf16 = conv.get_alphas(edge_index_dict, l_dict_bf16, r_dict_bf16)
+            beta_bf16 = conv.get_beta_weights(x_dict, l_dict_bf16, l_dict_bf16, global_node_idx)
+    # The embeddings of the featureless node types stay in fp32
+    r_concat, r_offsets = conv.concat_node_embeddings(r_dict_bf16)
+    r_concat = r_concat.to(torch.bfloat16)
+
+    for node_type in num_nodes_dict:
+        # The relation softmax is taken in fp32, then cast back to the dtype of the conv outputs
+        assert beta_bf16[node_type].dtype == torch.bfloat16
+        assert torch.allclose(beta_bf16[node_type].float(), beta[node_type], atol=2e-2)
+
+        expected = conv.agg_relation_neighbors(node_type, alpha_l, alpha_r, l_dict, r_dict, edge_index_dict,
+                                               global_node_idx)
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            emb_relations = conv.agg_relation_neighbors(node_type, alpha_l_bf16, alpha_r_bf16, l_dict_bf16,
+                                                        r_concat, edge_index_dict, global_node_idx,
+                                                        r_offsets=r_offsets)
+        # Accumulated in fp32, then cast back to the dtype of the embeddings
+        assert emb_relations.dtype == torch.bfloat16
+        assert torch.allclose(emb_relations.float(), expected, atol=5e-2, rtol=2e-2)
+
+
+@pytest.mark.parametrize("t_order", [1, 2])
+def test_forward_autocast(get_graph, t_order):
+    x_dict, edge_index_dict, global_node_idx = get_graph
+    model = LATTE(t_order=t_order, embedding_dim=16, in_channels_dict=in_channels_dict, num_nodes_dict=num_nodes_dict,
+                  metapaths=metapaths, attn_heads=4, use_proximity=True, neg_sampling_ratio=2.0)
+    if t_order > 1:
+        model.set_metapath_joins(FullMetapathJoins(edge_index_dict, num_nodes_dict, metapaths, t_order=t_order))
+    model.eval()
+
+    with torch.no_grad():
+        torch.manual_seed(1)
+        expected, expected_loss, _ = model.forward(x_dict, edge_index_dict, global_node_idx)
+        torch.manual_seed(1)
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            embeddings, proximity_loss, _ = model.forward(x_dict, edge_index_dict, global_node_idx)
+
+    for node_type, emb in expected.items():
+        assert embeddings[node_type].dtype == torch.bfloat16
+        assert torch.allclose(embeddings[node_type].float(), emb, atol=5e-2, rtol=2e-2)
+    # The proximity loss is reduced in fp32
+    assert proximity_loss.dtype == torch.float
+    assert torch.allclose(proximity_loss, expected_loss, rtol=1e-2)
@@ -0,0 +1,87 @@
+import pytest
+import torch
+
+from moge.generator.PyG.node_sampler import HeteroNeighborSampler
+from moge.generator.utils import BatchIndexMap
+
+num_nodes_dict = {"paper": 40, "author": 20}
+metapaths = [("paper", "cites", "paper"), ("paper", "written_by", "author"), ("author", "writes", "paper")]
+
+
+@pytest.fixture
+def get_sampler():
+    torch.manual_seed(0)
+    # Built without a source dataset, with only the attributes used by sample_typed()
+    sampler = HeteroNeighborSampler.__new__(HeteroNeighborSampler)
+    sampler.head_node_type = "paper"
+    sampler.neighbor_sizes = [3, 2]
+    sampler.inductive = True
+    sampler.num_nodes_dict = num_nodes_dict
+    sampler.edge_index_dict = {metapath: torch.stack([torch.randint(0, num_nodes_dict[metapath[0]], (150,)),
+                                                      torch.randint(0, num_nodes_dict[metapath[-1]], (150,))]) \
+                                   .unique(dim=1) for metapath in metapaths}
+    sampler.training_idx, sampler.validation_idx, sampler.testing_idx = torch.arange(20), torch.arange(20, 30), \
+                                                                        torch.arange(30, 40)
+    sampler.x_dict = {"paper": torch.randn(40, 4)}
+    sampler.y_dict = {"paper": torch.randint(0, 3, (40,))}
+    sampler.y_dict["paper"][5] = -1
+    sampler.typed_adjs = None
+    sampler.allowed_masks = {}
+    sampler.batch_index_map = BatchIndexMap(num_nodes_dict)
+    return sampler
+
+
+def assert_edges_in_graph(sampler, X):
+    for metapath, edge_index in X["edge_index_dict"].items():
+        head_type, tail_type = metapath[0], metapath[-1]
+        assert (edge_index >= 0).all()
+        # Batch index -> local index
+        edges = torch.stack([X["global_node_index"][head_type][edge_index[0]],
+                             X["global_node_index"][tail_type][edge_index[1]]], dim=0)
+        assert set(map(tuple, edges.t().tolist())) <= set(map(tuple, sampler.edge_index_dict[metapath].t().tolist()))
+
+
+def test_sample_typed(get_sampler):
+    iloc = torch.tensor([0, 5, 9, 13])
+    X, y, weights = get_sampler.sample_typed(iloc, mode="train")
+
+    paper_nodes = X["global_node_index"]["paper"]
+    assert set(iloc.tolist()) <= set(paper_nodes.tolist())
+    # Inductive training batches only have training nodes of the head node type
+    assert (paper_nodes < 20).all()
+    assert_edges_in_graph(get_sampler, X)
+
+    assert torch.equal(X["x_dict"]["paper"], get_sampler.x_dict["paper"][paper_nodes])
+    assert torch.equal(y, get_sampler.y_dict["paper"][paper_nodes])
+    assert torch.equal(weights, (y != -1).to(torch.float))
+
+
+def test_sample_typed_fanout(get_sampler):
+    get_sampler.neighbor_sizes = [2]
+    get_sampler.inductive = False
+    iloc = torch.arange(0, 20, 2)
+    X, y, weights = get_sampler.sample_typed(iloc, mode="train")
+    assert_edges_in_graph(get_sampler, X)
+
+    # A single hop from the batch nodes, with at most 2 neighbors per node and metapath
+    for metapath, edge_index in X["edge_index_dict"].items():
+        heads = X["global_node_index"][metapath[0]][edge_index[0]]
+        if metapath[0] == "paper":
+            assert set(heads.tolist()) <= set(iloc.tolist())
+        assert torch.bincount(heads).max() <= 2
+
+    # Without inductive filtering, non-training nodes are sampled but get no weight
+    paper_nodes = X["global_node_index"]["paper"]
+    assert (paper_nodes >= 20).any()
+    assert (weights[paper_nodes >= 20] == 0).all()
+
+
+def test_allowed_nodes_mask(get_sampler):
+    filter, mask = get_sampler.get_allowed_nodes_mask("train")
+    assert filter and mask.nonzero().view(-1).tolist() == list(range(20))
+    assert get_sampler.get_allowed_nodes_mask("train")[1] is mask
+
+    # Rebuilt when the splits are replaced
+    get_sampler.training_idx = torch.arange(10)
+    assert get_sampler.get_allowed_nodes_mask("train")[1].nonzero().view(-1).tolist() == list(range(10))
+    assert not get_sampler.get_allowed_nodes_mask("test")[0]
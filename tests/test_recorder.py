@@ -0,0 +1,89 @@
+import pandas as pd
+import pytest
+import torch
+
+from moge.generator.splits import hash_uniform
+from moge.module.recorder import RelationWeightRecorder
+
+num_nodes_dict = {"paper": 200, "author": 50}
+relations_dict = {"paper": ["paper.cites.paper", "paper.written_by.author", "paper"],
+                  "author": ["author.writes.paper", "author"]}
+
+
+@pytest.fixture
+def get_batches():
+    torch.manual_seed(0)
+    batches = []
+    for _ in range(4):
+        global_node_idx = {node_type: torch.randperm(num_nodes)[:30] for node_type, num_nodes in num_nodes_dict.items()}
+        beta = {node_type: torch.softmax(torch.randn(30, len(relations_dict[node_type]), 1), dim=1) \
+                for node_type in num_nodes_dict}
+        batches.append((beta, global_node_idx))
+    return batches
+
+
+def expected_weights(batches, sample_rate=1.0):
+    # The last recorded beta of each sampled node
+    expected = {node_type: {} for node_type in num_nodes_dict}
+    for beta, global_node_idx in batches:
+        for node_type, node_idx in global_node_idx.items():
+            for node, weights in zip(node_idx.tolist(), beta[node_type].squeeze(-1)):
+                if hash_uniform(torch.tensor([node]), seed=0).item() < sample_rate:
+                    expected[node_type][node] = weights
+    return {node_type: pd.DataFrame({node: weights.numpy() for node, weights in rows.items()},
+                                    index=relations_dict[node_type]).T.sort_index() \
+            for node_type, rows in expected.items()}
+
+
+@pytest.mark.parametrize("sample_rate", [1.0, 0.3])
+def test_recorder_update(get_batches, sample_rate):
+    recorder = RelationWeightRecorder(num_nodes_dict, relations_dict, sample_rate=sample_rate, seed=0)
+    for beta, global_node_idx in get_batches:
+        recorder.update(beta, global_node_idx)
+
+    for node_type, expected in expected_weights(get_batches, sample_rate).items():
+        if sample_rate < 1.0:
+            # The buffers only have rows for the sampled nodes
+            sampled = torch.arange(num_nodes_dict[node_type])
+            sampled = sampled[hash_uniform(sampled, seed=0) < sample_rate]
+            assert torch.equal(recorder.node_ids[node_type], sampled)
+            assert recorder.weights[node_type].size(0) == sampled.size(0) < num_nodes_dict[node_type]
+
+        df = recorder.to_dataframe(node_type).sort_index()
+        assert len(df) > 0
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    relation_weights = recorder.get_relation_weights()
+    assert set(relation_weights) == {relation for relations in relations_dict.values() for relation in relations}
+
+
+def test_recorder_reset(get_batches):
+    recorder = RelationWeightRecorder(num_nodes_dict, relations_dict, sample_rate=0.5)
+    beta, global_node_idx = get_batches[0]
+    recorder.update(beta, global_node_idx)
+    assert len(recorder.to_dataframe("paper")) > 0
+
+    recorder.reset()
+    assert all(len(recorder.to_dataframe(node_type)) == 0 for node_type in num_nodes_dict)
+    assert recorder.get_relation_weights() == {}
+
+    # Only the nodes recorded after the reset are kept
+    recorder.update(*get_batches[1])
+    for node_type, expected in expected_weights(get_batches[1:2], sample_rate=0.5).items():
+        pd.testing.assert_frame_equal(recorder.to_dataframe(node_type).sort_index(), expected, check_dtype=False)
+
+
+def test_recorder_flush_load(tmp_path, get_batches):
+    recorder = RelationWeightRecorder(num_nodes_dict, relations_dict, sample_rate=0.5)
+    for beta, global_node_idx in get_batches:
+        recorder.update(beta, global_node_idx)
+    recorder.flush(str(tmp_path), blocking=True)
+
+    loaded = RelationWeightRecorder.load(str(tmp_path))
+    assert set(loaded) == set(num_nodes_dict)
+    for node_type, df in loaded.items():
+        pd.testing.assert_frame_equal(df.sort_index(), recorder.to_dataframe(node_type).sort_index(),
+                                      check_dtype=False, check_index_type=False)
+
+    # The buffers stay readable after the flush
+    assert len(recorder.get_relation_weights()) > 0
@@ -0,0 +1,41 @@
+import torch
+
+from moge.module.sampling import edge_keys, isin_sorted, negative_sample
+
+
+def test_isin_sorted():
+    sorted_keys = torch.tensor([1, 3, 5, 7])
+    keys = torch.tensor([[0, 1, 2], [7, 8, 5]])
+    assert isin_sorted(keys, sorted_keys).tolist() == [[False, True, False], [True, False, True]]
+    assert not isin_sorted(keys, torch.tensor([], dtype=torch.long)).any()
+
+
+def test_negative_sample():
+    torch.manual_seed(0)
+    M, N = 20, 30
+    edge_index = torch.stack([torch.randint(0, M, (100,)), torch.randint(0, N, (100,))])
+
+    neg_edge_index = negative_sample(edge_index, M=M, N=N, n_sample_per_edge=5)
+    assert neg_edge_index.shape == (2, 500)
+    assert (neg_edge_index[0] < M).all() and (neg_edge_index[1] < N).all()
+    assert not isin_sorted(edge_keys(neg_edge_index, N), edge_keys(edge_index, N).unique()).any()
+
+
+def test_negative_sample_dense_graph():
+    torch.manual_seed(0)
+    M, N = 4, 5
+    # All pairs except (0, 0) and (3, 4)
+    edge_index = torch.stack(torch.meshgrid(torch.arange(M), torch.arange(N), indexing="ij")).view(2, -1)[:, 1:-1]
+
+    neg_edge_index = negative_sample(edge_index, M=M, N=N, n_sample_per_edge=3)
+    assert neg_edge_index.size(1) == 2
+    assert set(edge_keys(neg_edge_index, N).tolist()) <= {0, 3 * N + 4}
+
+    neg_edge_index = negative_sample(edge_index, M=M, N=N, n_sample_per_edge=3, strict=False)
+    assert neg_edge_index.size(1) <= 2
+    assert set(edge_keys(neg_edge_index, N).tolist()) <= {0, 3 * N + 4}
+
+
+def test_negative_sample_complete_graph():
+    edge_index = torch.stack(torch.meshgrid(torch.arange(3), torch.arange(3), indexing="ij")).view(2, -1)
+    assert negative_sample(edge_index, M=3, N=3, n_sample_per_edge=2).shape == (2, 0)
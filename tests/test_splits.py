@@ -0,0 +1,68 @@
+import pytest
+import torch
+
+from moge.generator.cache import is_mmap
+from moge.generator.splits import hash_uniform, split_by_hash, save_splits, load_splits
+
+
+@pytest.fixture
+def get_labeled_nodes():
+    torch.manual_seed(0)
+    ids = torch.randperm(5000)[:1000]
+    strata = torch.randint(0, 4, (1000,))
+    return ids, strata
+
+
+def test_hash_uniform():
+    ids = torch.arange(10000)
+    u = hash_uniform(ids, seed=0, chunk_size=1000)
+    assert ((u >= 0) & (u < 1)).all()
+    assert abs(u.mean().item() - 0.5) < 0.02
+    assert torch.equal(hash_uniform(ids[[5, 3, 9000]], seed=0), u[[5, 3, 9000]])
+    assert not torch.equal(hash_uniform(ids, seed=1), u)
+
+
+def test_split_by_hash(get_labeled_nodes):
+    ids, strata = get_labeled_nodes
+    splits = split_by_hash(ids, seed=0, train_ratio=0.6, valid_ratio=0.2, strata=strata)
+
+    all_ids = torch.cat([splits["train"], splits["valid"], splits["test"]])
+    assert torch.equal(all_ids.sort().values, ids.sort().values)
+
+    label_of = dict(zip(ids.tolist(), strata.tolist()))
+    for stratum, count in zip(*torch.unique(strata, return_counts=True)):
+        counts = {split: sum(label_of[i] == stratum for i in split_ids.tolist()) for split, split_ids in splits.items()}
+        assert counts["train"] == int(count * 0.6)
+        assert counts["valid"] == int(count * 0.2)
+
+
+def test_split_by_hash_order_invariance(get_labeled_nodes):
+    ids, strata = get_labeled_nodes
+    splits = split_by_hash(ids, seed=0, train_ratio=0.6, valid_ratio=0.2, strata=strata)
+
+    perm = torch.randperm(ids.size(0))
+    permuted = split_by_hash(ids[perm], seed=0, train_ratio=0.6, valid_ratio=0.2, strata=strata[perm])
+    assert all(torch.equal(splits[split], permuted[split]) for split in splits)
+
+    other_seed = split_by_hash(ids, seed=1, train_ratio=0.6, valid_ratio=0.2, strata=strata)
+    assert not torch.equal(splits["train"], other_seed["train"])
+
+
+def test_save_load_splits(tmp_path, get_labeled_nodes):
+    ids, strata = get_labeled_nodes
+    splits_dict = {"paper": split_by_hash(ids, seed=0, train_ratio=0.5, valid_ratio=0.25)}
+    save_splits(str(tmp_path), splits_dict, seed=0, train_ratio=0.5, valid_ratio=0.25)
+
+    loaded, metadata = load_splits(str(tmp_path))
+    assert metadata["seed"] == 0 and metadata["train_ratio"] == 0.5
+    for split, idx in splits_dict["paper"].items():
+        assert loaded["paper"][split].dtype == torch.long
+        assert is_mmap(loaded["paper"][split])
+        assert torch.equal(loaded["paper"][split], idx)
+
+    # Copy-on-write, so the files are unchanged by writes to the loaded tensors
+    loaded["paper"]["train"][0] = -1
+    assert torch.equal(load_splits(str(tmp_path))[0]["paper"]["train"], splits_dict["paper"]["train"])
+    assert not is_mmap(load_splits(str(tmp_path), mmap=False)[0]["paper"]["train"])
+
+    assert load_splits(str(tmp_path / "missing")) == (None, None)